@@ -0,0 +1,364 @@
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    基于 NumPy 的内存向量库，可替代实验中临时构建的 Chroma.
+
+    向量归一化后存放在连续的 float32 矩阵中，默认精确检索（矩阵乘 + argpartition），
+    相似度为余弦相似度；文档量较大时可选 index_type="hnsw"（需要 pip install hnswlib）.
+    save/load 以 .npy 文件保存向量，加载时可用 mmap 方式打开，多个进程共享同一份内存.
+
+    用法：
+        vectordb = NumpyVectorStore.from_documents(split_docs, embedding)
+        vectordb.save("../../data_base/vector_db/numpy")
+        vectordb = NumpyVectorStore.load("../../data_base/vector_db/numpy", embedding)
+    """
+
+    def __init__(
+            self,
+            embedding: Embeddings,
+            index_type: str = "flat",
+            hnsw_m: int = 16,
+            hnsw_ef_construction: int = 200,
+            hnsw_ef: int = 64,
+    ):
+        """
+        Args:
+            embedding (Embeddings): 用于文本向量化的模型.
+            index_type (str): "flat" 精确检索；"hnsw" 近似检索.
+            hnsw_m, hnsw_ef_construction, hnsw_ef: HNSW 图的参数，只在 index_type="hnsw" 时使用.
+        """
+        if index_type not in ("flat", "hnsw"):
+            raise ValueError(f"不支持的 index_type: {index_type}")
+        self._embedding = embedding
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef = hnsw_ef
+        # 矩阵按容量倍增预分配，前 _size 行有效
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self.ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        # 被删除的行不再参与检索
+        self._deleted = np.zeros(0, dtype=bool)
+        self._hnsw = None
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """全部有效行组成的归一化向量矩阵（视图，不复制）"""
+        return self._matrix[:self._size]
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _append_vectors(self, vectors: np.ndarray):
+        n, dim = vectors.shape
+        if self._matrix.shape[1] not in (0, dim):
+            raise ValueError(f"向量维度不一致：{self._matrix.shape[1]} != {dim}")
+        if self._size + n > self._matrix.shape[0]:
+            capacity = max(self._size + n, 2 * self._matrix.shape[0], 1024)
+            matrix = np.zeros((capacity, dim), dtype=np.float32)
+            if self._size:
+                matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+        self._matrix[self._size:self._size + n] = vectors
+        if self._hnsw is not None:
+            self._hnsw_add(np.arange(self._size, self._size + n))
+        self._size += n
+
+    def add_vectors(
+            self,
+            vectors: np.ndarray,
+            texts: List[str],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """直接添加已计算好的向量，可与 embedding 缓存配合使用；ids 已存在时覆盖旧记录"""
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1))
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        start = self._size
+        self._append_vectors(vectors)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        self.ids.extend(ids)
+        self._deleted = np.concatenate([self._deleted, np.zeros(len(texts), dtype=bool)])
+        for i, id_ in enumerate(ids):
+            # 同一 id 再次写入时，旧行标记为删除，保证每个 id 只检索到最新的一条
+            self._mark_deleted(self._id_to_row.get(id_))
+            self._id_to_row[id_] = start + i
+        return ids
+
+    def _mark_deleted(self, row: Optional[int]):
+        if row is None:
+            return
+        self._deleted[row] = True
+        if self._hnsw is not None:
+            self._hnsw.mark_deleted(row)
+
+    def add_texts(
+            self,
+            texts: Iterable[str],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_vectors(np.asarray(vectors, dtype=np.float32), texts, metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        for id_ in ids:
+            self._mark_deleted(self._id_to_row.pop(id_, None))
+        return True
+
+    def _filter_mask(self, filter: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """按 metadata 等值过滤，返回可参与检索的行；没有过滤条件且无删除时返回 None"""
+        if not filter and not self._deleted.any():
+            return None
+        mask = ~self._deleted[:self._size]
+        if filter:
+            for row in np.flatnonzero(mask):
+                metadata = self.metadatas[row]
+                if any(metadata.get(key) != value for key, value in filter.items()):
+                    mask[row] = False
+        return mask
+
+    def _hnsw_add(self, rows: np.ndarray):
+        if self._hnsw.get_max_elements() < rows[-1] + 1:
+            self._hnsw.resize_index(max(rows[-1] + 1, 2 * self._hnsw.get_max_elements()))
+        self._hnsw.add_items(self._matrix[rows], rows)
+
+    def _build_hnsw(self):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("index_type='hnsw' 需要安装 hnswlib：pip install hnswlib")
+        index = hnswlib.Index(space="ip", dim=self._matrix.shape[1])
+        index.init_index(max_elements=max(self._size, 1), ef_construction=self.hnsw_ef_construction,
+                         M=self.hnsw_m)
+        self._hnsw = index
+        if self._size:
+            self._hnsw_add(np.arange(self._size))
+        for row in np.flatnonzero(self._deleted):
+            index.mark_deleted(int(row))
+        index.set_ef(self.hnsw_ef)
+
+    def search_vectors(
+            self,
+            query_vector: np.ndarray,
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        返回与 query_vector 最相似的 k 行及其余弦相似度，按相似度降序
+
+        Args:
+            query_vector (np.ndarray): 未归一化的查询向量.
+            filter (Dict[str, Any]): metadata 等值过滤条件.
+        """
+        if self._size == 0:
+            return []
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        mask = self._filter_mask(filter)
+        if self.index_type == "hnsw":
+            if self._hnsw is None:
+                self._build_hnsw()
+            n_valid = self._size if mask is None else int(mask.sum())
+            k = min(k, n_valid)
+            if k == 0:
+                return []
+            self._hnsw.set_ef(max(self.hnsw_ef, k))
+            if mask is None:
+                labels, distances = self._hnsw.knn_query(query, k=k)
+            else:
+                labels, distances = self._hnsw.knn_query(query, k=k, filter=lambda row: bool(mask[row]))
+            # hnswlib 的 ip 距离为 1 - 内积
+            return [(int(row), float(1.0 - distance)) for row, distance in zip(labels[0], distances[0])]
+
+        scores = self.vectors @ query
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, int(mask.sum()))
+        k = min(k, self._size)
+        if k == 0:
+            return []
+        if k < self._size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(self._size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def _to_document(self, row: int) -> Document:
+        return Document(page_content=self.texts[row], metadata=self.metadatas[row])
+
+    def similarity_search_with_score_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        return [(self._to_document(row), score)
+                for row, score in self.search_vectors(np.asarray(embedding), k, filter)]
+
+    def similarity_search_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any,
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(
+            self,
+            query: str,
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(
+            self,
+            query: str,
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any,
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # 余弦相似度映射到 [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def max_marginal_relevance_search_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any,
+    ) -> List[Document]:
+        from fast_mmr import maximal_marginal_relevance
+
+        candidates = self.search_vectors(np.asarray(embedding), fetch_k, filter)
+        if not candidates:
+            return []
+        rows = [row for row, _ in candidates]
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32), self.vectors[rows], k, lambda_mult)
+        return [self._to_document(rows[i]) for i in selected]
+
+    def max_marginal_relevance_search(
+            self,
+            query: str,
+            k: int = 4,
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any,
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k, fetch_k, lambda_mult, filter)
+
+    @classmethod
+    def from_texts(
+            cls,
+            texts: List[str],
+            embedding: Embeddings,
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    def save(self, folder: str):
+        """
+        保存到 folder：vectors.npy（归一化向量）、docstore.json（文本、metadata、id），
+        HNSW 模式下另存 hnsw.bin
+        """
+        os.makedirs(folder, exist_ok=True)
+        keep = np.flatnonzero(~self._deleted[:self._size])
+        np.save(os.path.join(folder, "vectors.npy"), self.vectors[keep])
+        with open(os.path.join(folder, "docstore.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "index_type": self.index_type,
+                "texts": [self.texts[row] for row in keep],
+                "metadatas": [self.metadatas[row] for row in keep],
+                "ids": [self.ids[row] for row in keep],
+            }, f, ensure_ascii=False)
+        hnsw_path = os.path.join(folder, "hnsw.bin")
+        if self.index_type == "hnsw":
+            # 删除过的行在保存后重新编号，需要重建索引
+            if self._hnsw is None or len(keep) != self._size:
+                compact = NumpyVectorStore(self._embedding, "hnsw", self.hnsw_m,
+                                           self.hnsw_ef_construction, self.hnsw_ef)
+                compact.add_vectors(self.vectors[keep], [self.texts[row] for row in keep])
+                compact._build_hnsw()
+                compact._hnsw.save_index(hnsw_path)
+            else:
+                self._hnsw.save_index(hnsw_path)
+
+    @classmethod
+    def load(
+            cls,
+            folder: str,
+            embedding: Embeddings,
+            mmap: bool = True,
+            **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        """
+        从 folder 加载
+
+        Args:
+            mmap (bool): 以只读内存映射方式打开 vectors.npy，多个进程共享页缓存；
+                添加新文档时会自动复制为可写的内存矩阵.
+        """
+        with open(os.path.join(folder, "docstore.json"), encoding="utf-8") as f:
+            data = json.load(f)
+        store = cls(embedding, index_type=kwargs.pop("index_type", data["index_type"]), **kwargs)
+        store._matrix = np.load(os.path.join(folder, "vectors.npy"), mmap_mode="r" if mmap else None)
+        store._size = store._matrix.shape[0]
+        store.texts = data["texts"]
+        store.metadatas = data["metadatas"]
+        store.ids = data["ids"]
+        store._id_to_row = {id_: row for row, id_ in enumerate(store.ids)}
+        store._deleted = np.zeros(store._size, dtype=bool)
+        hnsw_path = os.path.join(folder, "hnsw.bin")
+        if store.index_type == "hnsw" and os.path.exists(hnsw_path):
+            import hnswlib
+            store._hnsw = hnswlib.Index(space="ip", dim=store._matrix.shape[1])
+            store._hnsw.load_index(hnsw_path, max_elements=store._size)
+            store._hnsw.set_ef(store.hnsw_ef)
+        return store
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import copy
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.text_splitter import TextSplitter
+from langchain_core.documents import Document
+
+# 文档块在原文中的位置 [start, end)
+Span = Tuple[int, int]
+
+
+class OffsetTextSplitter(TextSplitter):
+    """
+    记录字符偏移的递归字符切分器，切分结果与 RecursiveCharacterTextSplitter（keep_separator=True）一致
+
+    全程只处理原文中的 (start, end) 偏移：查找分隔符时在原文的区间上直接 search/finditer，
+    合并与重叠只移动偏移指针，不像 LangChain 的实现那样反复切分、拼接子串；
+    直到输出时才按偏移截取一次文本. create_documents 在 metadata 中写入 start_index 与 end_index，
+    与页码一起即可从文档块追溯到原文位置.
+
+    只支持按原文匹配的分隔符（不支持 is_separator_regex）.
+
+    用法：
+        text_splitter = OffsetTextSplitter(chunk_size=500, chunk_overlap=50, separators=["。", "，", ""])
+        split_docs = text_splitter.split_documents(pdf_pages)
+        pdf_pages[split_docs[0].metadata["page"]].page_content[
+            split_docs[0].metadata["start_index"]:split_docs[0].metadata["end_index"]]
+    """
+
+    def __init__(
+            self,
+            separators: Optional[List[str]] = None,
+            **kwargs: Any,
+    ):
+        kwargs.pop("keep_separator", None)
+        super().__init__(keep_separator=True, **kwargs)
+        self._separators = separators or ["\n\n", "\n", " ", ""]
+        self._patterns = [re.compile(re.escape(separator)) for separator in self._separators]
+
+    def _edges(self, text: str, start: int, end: int, index: int) -> List[int]:
+        """
+        按第 index 个分隔符切分区间，返回各段的边界；第 i 段为 [edges[i], edges[i + 1])，
+        分隔符保留在后一段开头，空分隔符按字符切分
+        """
+        if not self._separators[index]:
+            return list(range(start, end + 1))
+        edges = [start]
+        edges.extend(match.start() for match in self._patterns[index].finditer(text, start, end))
+        # 区间以分隔符开头时第一段为空，去掉
+        if len(edges) > 1 and edges[1] == start:
+            del edges[1]
+        edges.append(end)
+        return edges
+
+    def _strip(self, text: str, start: int, end: int) -> Optional[Span]:
+        """对应 _join_docs 中的 strip，返回去掉首尾空白后的区间，为空时返回 None"""
+        if self._strip_whitespace:
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+        return (start, end) if start < end else None
+
+    def _merge(self, text: str, edges: List[int], cum: List[int], spans: List[Span]):
+        """
+        对应 _merge_splits（分隔符长度为 0）
+
+        各段在原文中首尾相接，第 i 段为 [edges[i], edges[i + 1])，cum 为长度的前缀和，
+        窗口 [lo, hi) 的长度即 cum[hi] - cum[lo]. LangChain 逐段追加、逐段弹出，
+        这里用二分查找直接定位下一次输出的位置与弹出后的 lo，循环次数等于输出的块数而不是段数.
+        """
+        n = len(edges) - 1
+        lo = 0
+        while True:
+            # 第一个加入后超过 chunk_size 的段；各段都短于 chunk_size，因此 hi > lo
+            hi = bisect_right(cum, cum[lo] + self._chunk_size) - 1
+            if hi >= n:
+                break
+            span = self._strip(text, edges[lo], edges[hi])
+            if span is not None:
+                spans.append(span)
+            # 弹出到窗口长度不超过 chunk_overlap，且加入第 hi 段后不超过 chunk_size
+            target = max(cum[hi] - self._chunk_overlap, cum[hi + 1] - self._chunk_size)
+            lo = min(hi, bisect_left(cum, target, lo))
+        span = self._strip(text, edges[lo], edges[n])
+        if span is not None:
+            spans.append(span)
+
+    def _split_chars(self, text: str, start: int, end: int, spans: List[Span]):
+        """
+        按字符切分时每段长度都为 1，_merge 的窗口可以直接算出：
+        每块长 chunk_size 个字符，下一块从上一块末尾回退 min(chunk_overlap, chunk_size - 1) 个字符
+        """
+        step = self._chunk_size - min(self._chunk_overlap, self._chunk_size - 1)
+        lo = start
+        while end - lo > self._chunk_size:
+            span = self._strip(text, lo, lo + self._chunk_size)
+            if span is not None:
+                spans.append(span)
+            lo += step
+        span = self._strip(text, lo, end)
+        if span is not None:
+            spans.append(span)
+
+    def _split(self, text: str, start: int, end: int, separators: int, spans: List[Span]):
+        """对应 RecursiveCharacterTextSplitter._split_text，separators 为可用分隔符的起始下标"""
+        index = len(self._separators) - 1
+        for i in range(separators, len(self._separators)):
+            if not self._separators[i] or self._patterns[i].search(text, start, end):
+                index = i
+                break
+        if not self._separators[index] and self._length_function is len and self._chunk_size > 1:
+            if start < end:
+                self._split_chars(text, start, end, spans)
+            return
+        has_next = bool(self._separators[index]) and index + 1 < len(self._separators)
+
+        edges = self._edges(text, start, end, index)
+        if self._length_function is len:
+            # 长度即偏移之差，前缀和可以直接用边界代替
+            cum = edges
+            lengths = np.diff(edges)
+        else:
+            lengths = np.array([self._length_function(text[a:b]) for a, b in zip(edges, edges[1:])], dtype=np.int64)
+            cum = [0]
+            cum.extend(accumulate(lengths.tolist()))
+        # 长度不小于 chunk_size 的段需要继续切分，其余相邻的段合并
+        run = 0
+        for i in np.flatnonzero(lengths >= self._chunk_size).tolist():
+            if i > run:
+                self._merge(text, edges[run:i + 1], cum[run:i + 1], spans)
+            if has_next:
+                self._split(text, edges[i], edges[i + 1], index + 1, spans)
+            else:
+                spans.append((edges[i], edges[i + 1]))
+            run = i + 1
+        if run < len(edges) - 1:
+            self._merge(text, edges[run:], cum[run:], spans)
+
+    def split_offsets(self, text: str) -> List[Span]:
+        """返回各文档块在 text 中的 (start, end)，text[start:end] 即为 split_text 的结果"""
+        spans: List[Span] = []
+        self._split(text, 0, len(text), 0, spans)
+        return spans
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def create_documents(
+            self, texts: List[str], metadatas: Optional[List[dict]] = None
+    ) -> List[Document]:
+        """与 TextSplitter.create_documents 相同，并在 metadata 中记录 start_index 与 end_index"""
+        _metadatas = metadatas or [{}] * len(texts)
+        documents = []
+        for i, text in enumerate(texts):
+            for start, end in self.split_offsets(text):
+                metadata = copy.deepcopy(_metadatas[i])
+                metadata["start_index"] = start
+                metadata["end_index"] = end
+                documents.append(Document(page_content=text[start:end], metadata=metadata))
+        return documents
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        texts, metadatas = [], []
+        for doc in documents:
+            texts.append(doc.page_content)
+            metadatas.append(doc.metadata)
+        return self.create_documents(texts, metadatas=metadatas)
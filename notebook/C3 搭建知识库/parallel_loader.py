@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+
+# 文件扩展名 -> (模块, 加载器类, 参数)；以字符串保存，由子进程各自导入
+LOADERS: Dict[str, Tuple[str, str, Dict[str, Any]]] = {
+    "pdf": ("langchain.document_loaders.pdf", "PyMuPDFLoader", {}),
+    "md": ("langchain.document_loaders.markdown", "UnstructuredMarkdownLoader", {}),
+    "csv": ("langchain.document_loaders.csv_loader", "CSVLoader", {}),
+    "pptx": ("langchain.document_loaders.powerpoint", "UnstructuredPowerPointLoader", {}),
+    "docx": ("langchain_community.document_loaders.word_document", "UnstructuredWordDocumentLoader", {}),
+    "txt": ("langchain.document_loaders.text", "TextLoader", {"encoding": "utf-8"}),
+}
+
+# (文件路径, PDF 页码范围)，非 PDF 或不拆分时页码范围为 None
+Task = Tuple[str, Optional[Tuple[int, int]]]
+
+
+def get_file_paths(folder: str) -> List[str]:
+    """遍历 folder，返回全部文件路径"""
+    file_paths = []
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            file_paths.append(os.path.join(root, file))
+    return file_paths
+
+
+def _file_type(file_path: str) -> str:
+    return file_path.rsplit(".", 1)[-1].lower()
+
+
+def _pdf_page_count(file_path: str) -> int:
+    import fitz
+
+    with fitz.open(file_path) as doc:
+        return len(doc)
+
+
+def _load_pdf_pages(file_path: str, start: int, end: int) -> List[Document]:
+    """只读取 [start, end) 页，metadata 与 PyMuPDFLoader 一致"""
+    import fitz
+
+    docs = []
+    with fitz.open(file_path) as doc:
+        extra = {key: value for key, value in doc.metadata.items() if isinstance(value, (str, int))}
+        for page_num in range(start, min(end, len(doc))):
+            docs.append(Document(
+                page_content=doc[page_num].get_text(),
+                metadata=dict(source=file_path, file_path=file_path, page=page_num,
+                              total_pages=len(doc), **extra),
+            ))
+    return docs
+
+
+def _run_task(task: Task) -> Tuple[Task, List[Document], float, Optional[str]]:
+    """在子进程中加载一个任务，返回 (任务, 文档, 耗时, 错误信息)"""
+    file_path, pages = task
+    start_time = time.perf_counter()
+    try:
+        if pages is not None:
+            docs = _load_pdf_pages(file_path, *pages)
+        else:
+            module, name, kwargs = LOADERS[_file_type(file_path)]
+            loader = getattr(importlib.import_module(module), name)(file_path, **kwargs)
+            docs = loader.load()
+        error = None
+    except Exception as e:
+        docs, error = [], f"{type(e).__name__}: {e}"
+    return task, docs, time.perf_counter() - start_time, error
+
+
+class ParallelLoader(BaseLoader):
+    """
+    多进程加载 knowledge_db 中的多种格式文档
+
+    按扩展名选择加载器，每个文件作为一个任务提交到进程池；页数较多的 PDF 按页码范围拆成多个任务，
+    由不同进程并行解析。lazy_load 在任务完成时即产出文档（不保证文件顺序），
+    timings 记录每个文件的累计解析耗时与文档数.
+
+    用法：
+        loader = ParallelLoader(get_file_paths('../../data_base/knowledge_db'), max_workers=4)
+        for doc in loader.lazy_load():
+            ...
+        print(loader.timings)
+    """
+
+    def __init__(
+            self,
+            file_paths: List[str],
+            max_workers: Optional[int] = None,
+            pages_per_task: int = 20,
+    ):
+        """
+        Args:
+            file_paths (List[str]): 待加载文件，扩展名不在 LOADERS 中的文件会被跳过.
+            max_workers (int): 进程数，默认为 CPU 核数.
+            pages_per_task (int): PDF 每个任务的页数.
+        """
+        self.file_paths = file_paths
+        self.max_workers = max_workers
+        self.pages_per_task = pages_per_task
+        # 文件路径 -> {"seconds": 累计解析耗时, "documents": 文档数, "tasks": 任务数}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        # 文件路径 -> 错误信息
+        self.errors: Dict[str, str] = {}
+
+    def tasks(self) -> List[Task]:
+        """拆分任务，按文件大小从大到小排列，使耗时长的任务尽早开始"""
+        tasks: List[Task] = []
+        for file_path in sorted(self.file_paths, key=os.path.getsize, reverse=True):
+            file_type = _file_type(file_path)
+            if file_type not in LOADERS:
+                continue
+            if file_type == "pdf":
+                total = _pdf_page_count(file_path)
+                tasks.extend((file_path, (start, start + self.pages_per_task))
+                             for start in range(0, total, self.pages_per_task))
+            else:
+                tasks.append((file_path, None))
+        return tasks
+
+    def lazy_load(self) -> Iterator[Document]:
+        self.timings, self.errors = {}, {}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(_run_task, task) for task in self.tasks()]
+            for future in as_completed(futures):
+                (file_path, _), docs, seconds, error = future.result()
+                timing = self.timings.setdefault(file_path, {"seconds": 0.0, "documents": 0, "tasks": 0})
+                timing["seconds"] += seconds
+                timing["documents"] += len(docs)
+                timing["tasks"] += 1
+                if error is not None:
+                    self.errors[file_path] = error
+                    warnings.warn(f"加载 {file_path} 失败：{error}")
+                yield from docs
+
+    def load(self) -> List[Document]:
+        """加载全部文档，PDF 按页码排序，与逐个 loader.load() 的顺序一致"""
+        order = {file_path: i for i, file_path in enumerate(self.file_paths)}
+        docs = list(self.lazy_load())
+        docs.sort(key=lambda doc: (order.get(doc.metadata.get("source"), len(order)), doc.metadata.get("page", 0)))
+        return docs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并行加载知识库文档并输出每个文件的耗时")
+    parser.add_argument("--folder", default="../../data_base/knowledge_db")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--pages-per-task", type=int, default=20)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    loader = ParallelLoader(get_file_paths(args.folder), args.workers, args.pages_per_task)
+    n_docs = sum(1 for _ in loader.lazy_load())
+    for file_path, timing in sorted(loader.timings.items(), key=lambda item: -item[1]["seconds"]):
+        print(f"{timing['seconds']:8.2f}s  {int(timing['documents']):6d} docs  {file_path}")
+    print(f"共 {n_docs} 个文档，总耗时 {time.perf_counter() - start_time:.2f}s")
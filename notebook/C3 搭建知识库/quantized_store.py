@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from numpy_vectorstore import NumpyVectorStore
+
+
+class QuantizedVectorStore(NumpyVectorStore):
+    """
+    int8 量化、内存映射的只读向量库.
+
+    在 NumpyVectorStore.save 写出的目录上追加 vectors.int8.npy（每行对称量化的 int8 编码）
+    与 scales.npy（每行的缩放系数）。检索时先用 int8 编码粗排，取 k * oversample 个候选，
+    再从内存映射的 float32 向量中只读取这些候选行做精确重排。
+
+    int8 编码只有 float32 的 1/4 大小，且与 float32 文件一样以 mmap 方式打开，
+    多个 Streamlit 进程共享操作系统页缓存，每个进程的常驻内存只剩文本与 metadata.
+
+    用法：
+        # 由现有 Chroma 知识库导出并量化
+        QuantizedVectorStore.from_chroma('../../data_base/vector_db/chroma', '../../data_base/vector_db/int8')
+        vectordb = QuantizedVectorStore.load('../../data_base/vector_db/int8', embedding)
+    """
+
+    # 粗排候选数为 k 的倍数
+    oversample: int = 4
+    # 粗排时每次参与矩阵乘的行数，限制临时 float32 矩阵的大小（dim 1024 时约 16 MB）
+    chunk_rows: int = 4096
+
+    def add_vectors(self, *args: Any, **kwargs: Any) -> List[str]:
+        if getattr(self, "_codes", None) is not None:
+            raise RuntimeError("量化向量库是只读的，请在 NumpyVectorStore 中添加后重新 quantize")
+        return super().add_vectors(*args, **kwargs)
+
+    @staticmethod
+    def quantize(folder: str, chunk_rows: int = 65536):
+        """
+        为 folder 中的 vectors.npy 生成 vectors.int8.npy 与 scales.npy，按块处理以限制内存
+
+        先写入本进程独有的临时文件，再用 os.replace 替换：其他进程已映射的旧文件保持不变，
+        不会读到被截断或写了一半的编码.
+        """
+        vectors = np.load(os.path.join(folder, "vectors.npy"), mmap_mode="r")
+        codes_tmp = os.path.join(folder, f"vectors.int8.tmp-{os.getpid()}.npy")
+        scales_tmp = os.path.join(folder, f"scales.tmp-{os.getpid()}.npy")
+        codes = np.lib.format.open_memmap(codes_tmp, mode="w+", dtype=np.int8, shape=vectors.shape)
+        scales = np.empty(vectors.shape[0], dtype=np.float32)
+        for start in range(0, vectors.shape[0], chunk_rows):
+            block = np.asarray(vectors[start:start + chunk_rows], dtype=np.float32)
+            scale = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127.0
+            codes[start:start + chunk_rows] = np.clip(np.rint(block / scale[:, None]), -127, 127)
+            scales[start:start + chunk_rows] = scale
+        codes.flush()
+        del codes
+        np.save(scales_tmp, scales)
+        # 先替换 scales 再替换编码：两者之间被读到时行数相同但编码较旧，is_stale 会按 mtime 识别出来
+        os.replace(scales_tmp, os.path.join(folder, "scales.npy"))
+        os.replace(codes_tmp, os.path.join(folder, "vectors.int8.npy"))
+
+    @staticmethod
+    def is_stale(folder: str) -> bool:
+        """int8 编码或缩放系数缺失、行数/维度与 vectors.npy 不一致，或早于 vectors.npy 写出时，需要重新 quantize"""
+        codes_path = os.path.join(folder, "vectors.int8.npy")
+        scales_path = os.path.join(folder, "scales.npy")
+        vectors_path = os.path.join(folder, "vectors.npy")
+        if not (os.path.exists(codes_path) and os.path.exists(scales_path)):
+            return True
+        vectors = np.load(vectors_path, mmap_mode="r")
+        codes = np.load(codes_path, mmap_mode="r")
+        scales = np.load(scales_path, mmap_mode="r")
+        if codes.shape != vectors.shape or scales.shape != vectors.shape[:1]:
+            return True
+        return min(os.path.getmtime(codes_path), os.path.getmtime(scales_path)) < os.path.getmtime(vectors_path)
+
+    @classmethod
+    def load(
+            cls,
+            folder: str,
+            embedding: Embeddings,
+            mmap: bool = True,
+            oversample: int = 4,
+            **kwargs: Any,
+    ) -> "QuantizedVectorStore":
+        """加载量化向量库，int8 编码缺失或与 vectors.npy 不一致（见 is_stale）时先重新 quantize"""
+        if cls.is_stale(folder):
+            cls.quantize(folder)
+        store = super().load(folder, embedding, mmap=mmap, index_type="flat", **kwargs)
+        store.oversample = oversample
+        store._codes = np.load(os.path.join(folder, "vectors.int8.npy"), mmap_mode="r" if mmap else None)
+        store._scales = np.load(os.path.join(folder, "scales.npy"))
+        return store
+
+    @classmethod
+    def from_chroma(cls, persist_directory: str, folder: str, collection_name: str = "langchain"):
+        """把 Chroma 持久化目录中的向量、文本与 metadata 导出到 folder 并量化"""
+        import chromadb
+
+        client = chromadb.PersistentClient(path=persist_directory)
+        data = client.get_collection(collection_name).get(include=["documents", "metadatas", "embeddings"])
+        store = NumpyVectorStore(embedding=None)
+        store.add_vectors(np.asarray(data["embeddings"], dtype=np.float32), data["documents"],
+                          [metadata or {} for metadata in data["metadatas"]], data["ids"])
+        store.save(folder)
+        cls.quantize(folder)
+
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """用 int8 编码近似计算 query 与全部行的内积"""
+        scores = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, self.chunk_rows):
+            block = self._codes[start:start + self.chunk_rows].astype(np.float32)
+            scores[start:start + self.chunk_rows] = (block @ query) * self._scales[start:start + self.chunk_rows]
+        return scores
+
+    def search_vectors(
+            self,
+            query_vector: np.ndarray,
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[int, float]]:
+        if getattr(self, "_codes", None) is None:
+            return super().search_vectors(query_vector, k, filter)
+        if self._size == 0:
+            return []
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        scores = self.approximate_scores(query)
+        mask = self._filter_mask(filter)
+        n_valid = self._size
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            n_valid = int(mask.sum())
+        k = min(k, n_valid)
+        if k == 0:
+            return []
+        n_candidates = min(n_valid, k * self.oversample)
+        if n_candidates < self._size:
+            candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        else:
+            candidates = np.flatnonzero(np.isfinite(scores))
+        # 只读取候选行的 float32 向量做精确重排；按行号排序让 mmap 顺序读盘
+        candidates = np.sort(candidates)
+        exact = np.asarray(self._matrix[candidates], dtype=np.float32) @ query
+        order = np.argsort(-exact, kind="stable")[:k]
+        return [(int(candidates[i]), float(exact[i])) for i in order]
+
+
+def compare_recall(
+        store: QuantizedVectorStore,
+        qa_pairs: List[dict],
+        embedding: Embeddings,
+        ks: Sequence[int] = (1, 3, 5, 10),
+        min_query_len: int = 10,
+) -> Dict[str, List[float]]:
+    """
+    在问答对上比较 float32 精确检索与 int8 量化检索
+
+    Returns:
+        Dict[str, List[float]]: exact / quantized 为按页命中的召回率，overlap 为两者 top-k 结果的重合比例，
+        均与 ks 一一对应.
+    """
+    qa_pairs = [qa for qa in qa_pairs if len(qa["query"]) > min_query_len]
+    # 查询用 embed_query：BGE 等模型编码查询时会加上检索指令
+    query_vectors = np.asarray([embedding.embed_query(qa["query"]) for qa in qa_pairs], dtype=np.float32)
+    max_k = max(ks)
+    pages = [metadata.get("page") for metadata in store.metadatas]
+    results = {"exact": [0.0] * len(ks), "quantized": [0.0] * len(ks), "overlap": [0.0] * len(ks)}
+    for qa, query_vector in zip(qa_pairs, query_vectors):
+        quantized = [row for row, _ in store.search_vectors(query_vector, max_k)]
+        exact = [row for row, _ in NumpyVectorStore.search_vectors(store, query_vector, max_k)]
+        for i, k in enumerate(ks):
+            results["exact"][i] += qa["page_num"] in [pages[row] for row in exact[:k]]
+            results["quantized"][i] += qa["page_num"] in [pages[row] for row in quantized[:k]]
+            results["overlap"][i] += len(set(exact[:k]) & set(quantized[:k])) / k
+    return {name: [value / len(qa_pairs) for value in values] for name, values in results.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 Chroma 知识库为 int8 量化向量库并验证召回率")
+    parser.add_argument("--chroma", default="../../data_base/vector_db/chroma")
+    parser.add_argument("--output", default="../../data_base/vector_db/int8")
+    parser.add_argument("--qa", default="../C7 高级 RAG 技巧/2. 数据处理/train_dataset.json")
+    args = parser.parse_args()
+
+    from zhipuai_embedding import ZhipuAIEmbeddings
+
+    if not os.path.exists(os.path.join(args.output, "vectors.int8.npy")):
+        QuantizedVectorStore.from_chroma(args.chroma, args.output)
+    embedding = ZhipuAIEmbeddings()
+    store = QuantizedVectorStore.load(args.output, embedding)
+    with open(args.qa, encoding="utf-8") as f:
+        qa_pairs = json.load(f)
+    for name, values in compare_recall(store, qa_pairs, embedding).items():
+        print(name, ["%.4f" % value for value in values])
@@ -0,0 +1,203 @@
+'''
+客户端限流与 token 预算调度
+
+按 (服务商, API Key) 共享令牌桶，同时约束每秒请求数（RPS）与每分钟 token 数（TPM），
+并提供交互优先通道：有交互请求（如 Streamlit 聊天）在等待时，批量任务
+（如 embed_documents、生成问答对）让出配额，避免批量任务把交互请求饿死。
+
+用法：
+    limiter = get_rate_limiter("zhipuai", api_key)
+    limiter.acquire(estimate_tokens(text))               # 批量任务
+    limiter.acquire(tokens, priority=INTERACTIVE)        # 交互请求
+    ChatOpenAI(callbacks=[RateLimitCallbackHandler(limiter, priority=INTERACTIVE)])  # 没有 rate_limiter 字段的 LLM
+
+注意：限流器在进程内共享，不同进程之间不共享配额。
+'''
+
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 优先级：数值越小越优先
+INTERACTIVE = 0
+BATCH = 1
+
+# 各服务商的默认配额，可通过 get_rate_limiter 的参数覆盖
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    # (requests_per_second, tokens_per_minute)
+    "zhipuai": (5.0, 300000.0),
+    "wenxin": (5.0, 300000.0),
+    "openai": (3.0, 90000.0),
+}
+
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    '''
+    粗略估计文本的 token 数
+
+    中文字符及全角标点按每字 1 个 token 计，其余字符按每 4 个字符 1 个 token 计。
+    '''
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenBucket():
+    '''令牌桶：容量为 capacity，每秒补充 rate 个令牌'''
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        '''距离桶中令牌足够 amount 还需等待的秒数（调用前需先 refill）'''
+        # 单次请求超过桶容量时，只要求桶满即可放行，避免永久阻塞
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class RateLimiter():
+    '''同时约束 RPS 与 TPM 的限流器，支持交互优先通道'''
+
+    def __init__(self, requests_per_second: float, tokens_per_minute: Optional[float] = None):
+        # 请求桶允许 1 秒的突发
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self.tokens = None
+        if tokens_per_minute:
+            self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self._cond = threading.Condition()
+        self._interactive_waiting = 0
+
+    def acquire(self, tokens: int = 0, priority: int = BATCH, timeout: Optional[float] = None) -> bool:
+        '''
+        阻塞直到配额足够，并扣除 1 个请求与 tokens 个 token
+
+        Args:
+            tokens (int): 本次请求预计消耗的 token 数（提示词加预计输出）.
+            priority (int): INTERACTIVE 或 BATCH，有交互请求等待时批量请求不会被放行.
+            timeout (float): 最长等待秒数，None 表示一直等待.
+
+        Returns:
+            bool: 成功获取配额返回 True，超时返回 False.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if priority == INTERACTIVE:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if priority != INTERACTIVE and self._interactive_waiting:
+                        wait = None
+                    else:
+                        self.requests.refill(now)
+                        wait = self.requests.wait_time(1)
+                        if self.tokens is not None:
+                            self.tokens.refill(now)
+                            wait = max(wait, self.tokens.wait_time(tokens))
+                        if wait == 0.0:
+                            self.requests.tokens -= 1
+                            if self.tokens is not None:
+                                self.tokens.tokens -= tokens
+                            return True
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                if priority == INTERACTIVE:
+                    self._interactive_waiting -= 1
+                    self._cond.notify_all()
+
+    def record_usage(self, estimated: int, actual: int):
+        '''用服务端返回的实际 token 用量修正预估值，多退少补'''
+        if self.tokens is None:
+            return
+        with self._cond:
+            self.tokens.tokens = min(self.tokens.capacity, self.tokens.tokens + estimated - actual)
+            self._cond.notify_all()
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+        provider: str,
+        api_key: Optional[str] = None,
+        requests_per_second: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+) -> RateLimiter:
+    '''
+    获取 (provider, api_key) 对应的共享限流器，首次调用时按参数或默认配额创建
+
+    Args:
+        provider (str): 服务商名称，如 "zhipuai"、"wenxin"、"openai".
+        api_key (str): API Key，同一服务商的不同 Key 拥有独立配额.
+        requests_per_second (float): 每秒请求数上限.
+        tokens_per_minute (float): 每分钟 token 数上限.
+    '''
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    with _limiters_lock:
+        limiter = _limiters.get((provider, key_hash))
+        if limiter is None:
+            default_rps, default_tpm = DEFAULT_LIMITS.get(provider, (1.0, None))
+            limiter = RateLimiter(requests_per_second or default_rps,
+                                  tokens_per_minute or default_tpm)
+            _limiters[(provider, key_hash)] = limiter
+        return limiter
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    '''
+    通过回调为 ChatOpenAI 等没有 rate_limiter 字段的 LLM 接入限流：
+    请求发出前按提示词加预计输出扣除配额，返回后按实际用量修正
+    '''
+
+    # 限流时抛出的异常（如超时）需要中断请求，不能被回调管理器吞掉
+    raise_error = True
+
+    def __init__(self, limiter: RateLimiter, priority: int = BATCH, expected_output_tokens: int = 512):
+        self.limiter = limiter
+        self.priority = priority
+        self.expected_output_tokens = expected_output_tokens
+        self._estimated: Dict[UUID, int] = {}
+
+    def _acquire(self, run_id: UUID, text: str):
+        estimated = estimate_tokens(text) + self.expected_output_tokens
+        self.limiter.acquire(estimated, priority=self.priority)
+        self._estimated[run_id] = estimated
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any):
+        self._acquire(run_id, "".join(prompts))
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            **kwargs: Any):
+        self._acquire(run_id, "".join(str(message.content) for batch in messages for message in batch))
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        estimated = self._estimated.pop(run_id, None)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if estimated is not None and usage.get("total_tokens"):
+            self.limiter.record_usage(estimated, usage["total_tokens"])
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._estimated.pop(run_id, None)
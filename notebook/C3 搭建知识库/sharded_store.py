@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+
+def tag_documents(docs: List[Document], knowledge_db_dir: str) -> List[Document]:
+    """
+    为文档补充 collection、file、page 三个 metadata 字段
+
+    collection 为文件在 knowledge_db 下的一级目录名（如 pumkin_book、prompt_engineering、easy_rl），
+    file 为文件名，page 沿用 PDF 加载器给出的页码，其他格式记为 0.
+    """
+    root = os.path.abspath(knowledge_db_dir)
+    for doc in docs:
+        source = os.path.abspath(doc.metadata.get("source", ""))
+        relative = os.path.relpath(source, root)
+        parts = relative.split(os.sep)
+        doc.metadata["collection"] = parts[0] if len(parts) > 1 else "default"
+        doc.metadata["file"] = os.path.basename(source)
+        doc.metadata.setdefault("page", 0)
+    return docs
+
+
+def chroma_factory(persist_directory: str, embedding: Embeddings, docs: Optional[List[Document]] = None):
+    """默认的分片存储：每个分片一个持久化的 Chroma"""
+    from langchain.vectorstores.chroma import Chroma
+
+    if docs is None:
+        return Chroma(persist_directory=persist_directory, embedding_function=embedding)
+    return Chroma.from_documents(documents=docs, embedding=embedding, persist_directory=persist_directory)
+
+
+def numpy_factory(persist_directory: str, embedding: Embeddings, docs: Optional[List[Document]] = None):
+    """以 NumpyVectorStore 作为分片存储"""
+    from numpy_vectorstore import NumpyVectorStore
+
+    if docs is None:
+        return NumpyVectorStore.load(persist_directory, embedding)
+    store = NumpyVectorStore.from_documents(docs, embedding)
+    store.save(persist_directory)
+    return store
+
+
+class ShardedKnowledgeBase():
+    """
+    按 collection 分片的知识库
+
+    每个 collection 一个独立的向量库（默认 Chroma，存放在 root/<collection>），可以单独重建；
+    查询时只 embedding 一次，在选中的分片上并行检索后按相关性得分合并.
+
+    用法：
+        docs = tag_documents(split_docs, '../../data_base/knowledge_db')
+        kb = ShardedKnowledgeBase.build(docs, embedding, '../../data_base/vector_db/sharded')
+        kb.similarity_search("什么是南瓜书？", k=3, collections=["pumkin_book"])
+    """
+
+    def __init__(
+            self,
+            root: str,
+            embedding: Embeddings,
+            store_factory: Callable[..., VectorStore] = chroma_factory,
+            max_workers: int = 4,
+    ):
+        self.root = root
+        self.embedding = embedding
+        self.store_factory = store_factory
+        self.shards: Dict[str, VectorStore] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @classmethod
+    def build(
+            cls,
+            docs: List[Document],
+            embedding: Embeddings,
+            root: str,
+            **kwargs: Any,
+    ) -> "ShardedKnowledgeBase":
+        """按 metadata['collection'] 分组构建全部分片"""
+        kb = cls(root, embedding, **kwargs)
+        groups: Dict[str, List[Document]] = {}
+        for doc in docs:
+            groups.setdefault(doc.metadata.get("collection", "default"), []).append(doc)
+        for collection, group in groups.items():
+            kb.rebuild_shard(collection, group)
+        return kb
+
+    @classmethod
+    def load(cls, root: str, embedding: Embeddings, **kwargs: Any) -> "ShardedKnowledgeBase":
+        """加载 root 下已存在的全部分片"""
+        kb = cls(root, embedding, **kwargs)
+        for collection in sorted(os.listdir(root)):
+            if os.path.isdir(os.path.join(root, collection)):
+                kb.shards[collection] = kb.store_factory(os.path.join(root, collection), embedding)
+        return kb
+
+    def rebuild_shard(self, collection: str, docs: List[Document]):
+        """删除并重建单个分片，其余分片不受影响"""
+        persist_directory = os.path.join(self.root, collection)
+        if os.path.exists(persist_directory):
+            shutil.rmtree(persist_directory)
+        self.shards[collection] = self.store_factory(persist_directory, self.embedding, docs)
+
+    @staticmethod
+    def _search_shard(
+            store: VectorStore,
+            query_vector: List[float],
+            k: int,
+            filter: Optional[Dict[str, Any]],
+    ) -> List[Tuple[Document, float]]:
+        """在单个分片上检索，返回 (文档, 相关性得分)，得分越大越相关"""
+        if hasattr(store, "search_vectors"):
+            return store.similarity_search_with_score_by_vector(query_vector, k, filter)
+        # Chroma 返回距离，按其距离函数转换为相关性得分，保证不同分片的得分可比
+        relevance = store._select_relevance_score_fn()
+        if filter and len(filter) > 1:
+            # Chroma 的 where 条件多于一个字段时需要显式 $and
+            filter = {"$and": [{key: value} for key, value in filter.items()]}
+        results = store.similarity_search_by_vector_with_relevance_scores(query_vector, k, filter=filter)
+        return [(doc, relevance(distance)) for doc, distance in results]
+
+    def similarity_search_with_score(
+            self,
+            query: str,
+            k: int = 4,
+            collections: Optional[List[str]] = None,
+            filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Args:
+            collections (List[str]): 只检索这些分片，为空时检索全部分片.
+            filter (Dict[str, Any]): 分片内按 metadata 预过滤，如 {"file": "pumpkin_book.pdf"}.
+        """
+        names = collections or list(self.shards)
+        missing = [name for name in names if name not in self.shards]
+        if missing:
+            raise KeyError(f"不存在的分片：{missing}")
+        query_vector = self.embedding.embed_query(query)
+        futures = [self._executor.submit(self._search_shard, self.shards[name], query_vector, k, filter)
+                   for name in names]
+        results = [item for future in futures for item in future.result()]
+        if not results:
+            return []
+        scores = np.array([score for _, score in results])
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [results[i] for i in order]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    ShardedKnowledgeBase 的检索器，可用于 RetrievalQA 等问答链
+
+    用法：
+        retriever = ShardedRetriever(kb=kb, k=3, collections=["pumkin_book"])
+    """
+
+    kb: Any
+    k: int = 4
+    collections: Optional[List[str]] = None
+    filter: Optional[Dict[str, Any]] = None
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.kb.similarity_search(query, self.k, collections=self.collections, filter=self.filter)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from text_cleaner import pdf_cleaner
+
+# 各阶段之间队列中的结束标记
+_DONE = object()
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[Document]:
+    """逐页读取 PDF，每次只持有一页，metadata 与 PyMuPDFLoader 一致"""
+    import fitz
+
+    with fitz.open(file_path) as doc:
+        extra = {key: value for key, value in doc.metadata.items() if isinstance(value, (str, int))}
+        for page_num, page in enumerate(doc):
+            yield Document(
+                page_content=page.get_text(),
+                metadata=dict(source=file_path, file_path=file_path, page=page_num,
+                              total_pages=len(doc), **extra),
+            )
+
+
+def chunk_id(doc: Document, index: int) -> str:
+    """由来源、页码与块序号生成稳定的 id，重复入库时覆盖而不是追加"""
+    key = f"{doc.metadata.get('source')}:{doc.metadata.get('page')}:{index}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def upsert(vectorstore: VectorStore, ids: List[str], vectors: np.ndarray,
+           texts: List[str], metadatas: List[dict]):
+    """写入已计算好向量的文档块，支持 NumpyVectorStore 与 Chroma"""
+    if hasattr(vectorstore, "add_vectors"):
+        existing = [id_ for id_ in ids if id_ in vectorstore._id_to_row]
+        if existing:
+            vectorstore.delete(existing)
+        vectorstore.add_vectors(vectors, texts, metadatas, ids)
+    elif hasattr(vectorstore, "_collection"):
+        vectorstore._collection.upsert(ids=ids, embeddings=vectors.tolist(),
+                                       documents=texts, metadatas=metadatas)
+    else:
+        raise TypeError(f"不支持的向量库类型：{type(vectorstore).__name__}")
+
+
+class _Stage(threading.Thread):
+    """后台阶段：把 source 产出的元素放入有界队列，异常在消费端重新抛出"""
+
+    def __init__(self, source: Iterable[Any], maxsize: int):
+        super().__init__(daemon=True)
+        self.source = source
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.error: Optional[BaseException] = None
+        self.stopped = threading.Event()
+
+    def _put(self, item: Any) -> bool:
+        # 消费端已退出时不再阻塞在已满的队列上
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        try:
+            for item in self.source:
+                if not self._put(item):
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            # 关闭上游生成器，使其中的阶段也随之停止
+            if hasattr(self.source, "close"):
+                self.source.close()
+        self._put(_DONE)
+
+    def __iter__(self) -> Iterator[Any]:
+        self.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.stopped.set()
+        if self.error is not None:
+            raise self.error
+
+
+def ingest_documents(
+        pages: Iterable[Document],
+        embedding: Embeddings,
+        vectorstore: VectorStore,
+        text_splitter: Any = None,
+        clean: Optional[Callable[[str], str]] = pdf_cleaner,
+        batch_size: int = 32,
+        queue_size: int = 4,
+) -> int:
+    """
+    流式入库：读取页 → 清洗 → 切分 → 批量 embedding → 写入向量库
+
+    三个阶段分别运行在解析线程、embedding 线程与调用线程中，阶段之间为有界队列，
+    因此同时在内存中的只有少量页与 queue_size 个批次，与文档总页数无关；
+    第一批文档块切分完成后即开始 embedding，不必等待全部页解析结束.
+
+    Args:
+        pages (Iterable[Document]): 逐页产出的文档，如 iter_pdf_pages(file_path).
+        embedding (Embeddings): 向量模型.
+        vectorstore (VectorStore): 目标向量库（NumpyVectorStore 或 Chroma）.
+        text_splitter: 文本切分器，默认为 chunk_size=500、chunk_overlap=50 的 RecursiveCharacterTextSplitter.
+        clean (Callable[[str], str]): 每页的清洗函数，默认为 text_cleaner.pdf_cleaner，为 None 时不清洗.
+        batch_size (int): 每次 embedding 的文档块数.
+        queue_size (int): 阶段之间队列的最大批次数.
+
+    Returns:
+        int: 写入的文档块数.
+    """
+    if text_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+
+    def split_batches() -> Iterator[List[Document]]:
+        batch: List[Document] = []
+        for page in pages:
+            if clean is not None:
+                page.page_content = clean(page.page_content)
+            for index, chunk in enumerate(text_splitter.split_documents([page])):
+                chunk.metadata['id'] = chunk_id(chunk, index)
+                batch.append(chunk)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def embed_batches() -> Iterator[tuple]:
+        for batch in _Stage(split_batches(), queue_size):
+            texts = [chunk.page_content for chunk in batch]
+            yield batch, np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+
+    n_chunks = 0
+    for batch, vectors in _Stage(embed_batches(), queue_size):
+        upsert(vectorstore, [chunk.metadata['id'] for chunk in batch], vectors,
+               [chunk.page_content for chunk in batch], [chunk.metadata for chunk in batch])
+        n_chunks += len(batch)
+    return n_chunks
+
+
+def ingest_pdf(file_path: str, embedding: Embeddings, vectorstore: VectorStore, **kwargs: Any) -> int:
+    """
+    逐页流式导入一个 PDF，kwargs 传给 ingest_documents
+
+    用法：
+        vectordb = Chroma(persist_directory='../../data_base/vector_db/chroma', embedding_function=embedding)
+        ingest_pdf('../../data_base/knowledge_db/pumkin_book/pumpkin_book.pdf', embedding, vectordb)
+    """
+    return ingest_documents(iter_pdf_pages(file_path), embedding, vectorstore, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="逐页流式导入 PDF 到 Chroma 向量库")
+    parser.add_argument("file_path")
+    parser.add_argument("--persist-directory", default="../../data_base/vector_db/chroma")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    from langchain.vectorstores.chroma import Chroma
+    from zhipuai_embedding import ZhipuAIEmbeddings
+
+    embedding = ZhipuAIEmbeddings()
+    vectordb = Chroma(persist_directory=args.persist_directory, embedding_function=embedding)
+    print(f"写入 {ingest_pdf(args.file_path, embedding, vectordb, batch_size=args.batch_size)} 个文档块")
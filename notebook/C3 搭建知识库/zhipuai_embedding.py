@@ -14,6 +14,10 @@ class ZhipuAIEmbeddings(BaseModel, Embeddings):
 
     client: Any
     """`zhipuai.ZhipuAI"""
+    rate_limiter: Any = None
+    """`rate_limiter.RateLimiter`，为空时不限流"""
+    priority: int = 1
+    """限流优先级，交互请求设为 `rate_limiter.INTERACTIVE`"""
 
     @root_validator()
     def validate_environment(cls, values: Dict) -> Dict:
@@ -41,6 +45,9 @@ class ZhipuAIEmbeddings(BaseModel, Embeddings):
         Return:
             embeddings (List[float]): 输入文本的 embedding，一个浮点数值列表.
         """
+        if self.rate_limiter is not None:
+            from rate_limiter import estimate_tokens
+            self.rate_limiter.acquire(estimate_tokens(text), priority=self.priority)
         embeddings = self.client.embeddings.create(
             model="embedding-2",
             input=text
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# 大模型与 Embedding 调用的录制 / 回放（cassette）：联网时把请求与响应（连同耗时）录到磁盘，
+# 离线时按请求内容确定性地回放，可选地按录制时的耗时或合成的延迟分布等待，用于无网络的性能测试.
+#
+# 所有调用统一记录为两类请求，LangChain 封装、SDK 客户端与 stub_server 共用同一份录制：
+#     chat：{model, messages} -> {content, prompt_tokens, completion_tokens}
+#     embedding：{model, input（单条文本）} -> {embedding}
+#
+# 用法：
+#     cassette = Cassette('cassettes/rag.jsonl', mode='auto')            # 有录制就回放，没有就调用并录制
+#     llm = CassetteLLM(llm=ZhipuAILLM(api_key=...), cassette=cassette)
+#     embedding = CassetteEmbeddings(ZhipuAIEmbeddings(), cassette, model='embedding-2')
+#     client = CassetteClient(ZhipuAI(), cassette)                       # generate_qa_pairs 使用的原生客户端
+#
+#     cassette = Cassette('cassettes/rag.jsonl', mode='replay', latency=recorded_latency())   # 离线
+#     llm = CassetteLLM(model='glm-4', cassette=cassette)
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+MODES = ('record', 'replay', 'auto', 'off')
+
+# 延迟模型：接收 (请求类型, 录制的条目) 返回需要等待的秒数
+LatencyModel = Callable[[str, dict], float]
+
+
+class CassetteMiss(KeyError):
+    '''回放模式下请求不在录制中'''
+
+
+def request_key(kind: str, request: Mapping[str, Any]) -> str:
+    '''请求的规范化哈希；只取 model 与 messages / input，温度等参数不参与匹配'''
+    if kind == 'chat':
+        payload = {'model': request.get('model'), 'messages': request['messages']}
+    else:
+        payload = {'model': request.get('model'), 'input': request['input']}
+    text = json.dumps([kind, payload], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def chat_request(model: str, prompt: str) -> dict:
+    '''与 ZhipuAILLM、Wenxin_LLM 等封装相同，单轮 user 消息'''
+    return {'model': model, 'messages': [{'role': 'user', 'content': prompt}]}
+
+
+def recorded_latency(scale: float = 1.0) -> LatencyModel:
+    '''按录制时的实际耗时等待，scale 可放大或缩小'''
+    return lambda kind, entry: entry.get('seconds', 0.0) * scale
+
+
+def lognormal_latency(chat_median: float = 1.0, embedding_median: float = 0.05, sigma: float = 0.5,
+                      seed: int = 0) -> LatencyModel:
+    '''
+    合成的对数正态延迟
+
+    每个延迟以 (seed, 请求哈希, 该请求第几次出现) 为种子单独抽样，同一调用得到的延迟与之前运行过哪些请求无关.
+    '''
+    def latency(kind: str, entry: dict) -> float:
+        median = chat_median if kind == 'chat' else embedding_median
+        digest = hashlib.sha1(f"{seed}:{entry.get('key', '')}:{entry.get('occurrence', 0)}".encode('utf-8'))
+        return median * random.Random(int(digest.hexdigest()[:16], 16)).lognormvariate(0.0, sigma)
+    return latency
+
+
+def token_latency(first_token: float = 0.3, per_token: float = 0.02, embedding: float = 0.05) -> LatencyModel:
+    '''首 token 延迟 + 每个输出 token 的生成时间，输出越长等待越久'''
+    def latency(kind: str, entry: dict) -> float:
+        if kind != 'chat':
+            return embedding
+        return first_token + per_token * entry['response'].get('completion_tokens', 0)
+    return latency
+
+
+def synthetic_response(kind: str, request: Mapping[str, Any], dim: int = 1024) -> dict:
+    '''
+    录制中没有该请求时的确定性合成响应
+
+    chat 返回固定格式的占位回答；embedding 返回以文本哈希为种子的单位向量，相同文本的向量相同.
+    '''
+    key = request_key(kind, request)
+    if kind == 'chat':
+        content = f'[synthetic:{key[:8]}]'
+        prompt = ''.join(message.get('content', '') for message in request['messages'])
+        return {'content': content, 'prompt_tokens': len(prompt), 'completion_tokens': len(content)}
+    rng = np.random.default_rng(int(key[:16], 16))
+    vector = rng.standard_normal(dim)
+    return {'embedding': (vector / np.linalg.norm(vector)).tolist()}
+
+
+class Cassette():
+    '''
+    请求 / 响应的录制与回放
+
+    录制以 JSONL 追加写入，每行为 {key, kind, request, response, seconds}. 同一请求录制多次时，
+    回放按录制顺序轮流返回，调用顺序相同则结果相同.
+    '''
+
+    def __init__(
+            self,
+            path: str,
+            mode: str = 'auto',
+            latency: Optional[LatencyModel] = None,
+            synthetic: bool = False,
+            embedding_dim: int = 1024,
+    ):
+        '''
+        Args:
+            path (str): 录制文件.
+            mode (str): record 总是调用并录制；replay 只回放，缺失时报 CassetteMiss；
+                auto 有录制就回放，否则调用并录制；off 直接调用，不读写录制.
+            latency (LatencyModel): 回放时的延迟模型，为空时立即返回.
+            synthetic (bool): 回放缺失时返回 synthetic_response 而不是报错.
+            embedding_dim (int): 合成 embedding 的维度.
+        '''
+        if mode not in MODES:
+            raise ValueError(f'mode 必须是 {MODES} 之一')
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.synthetic = synthetic
+        self.embedding_dim = embedding_dim
+        self._entries: Dict[str, List[dict]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'recorded': 0, 'synthetic': 0}
+        # 每个请求经过 wait 的次数，传给延迟模型的 occurrence
+        self._occurrences: Dict[str, int] = {}
+        # 上次录制中断时最后一行没有换行，下次追加前先补一个换行，避免与新记录粘在一起
+        self._torn = False
+        if mode != 'off' and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    self._torn = not line.endswith('\n')
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断时写了一半的行
+                        continue
+                    self._entries.setdefault(entry['key'], []).append(entry)
+
+    @classmethod
+    def from_env(cls, default_path: str = 'cassettes/rag.jsonl') -> Optional['Cassette']:
+        '''
+        按环境变量创建：LLM_CASSETTE_MODE（未设置时返回 None）、LLM_CASSETTE（录制文件）、
+        LLM_CASSETTE_LATENCY（none / recorded / lognormal）
+        '''
+        mode = os.environ.get('LLM_CASSETTE_MODE')
+        if not mode:
+            return None
+        latency = {'recorded': recorded_latency(), 'lognormal': lognormal_latency()}.get(
+            os.environ.get('LLM_CASSETTE_LATENCY', 'none'))
+        return cls(os.environ.get('LLM_CASSETTE', default_path), mode=mode, latency=latency,
+                   synthetic=os.environ.get('LLM_CASSETTE_SYNTHETIC') == '1')
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def lookup(self, kind: str, request: Mapping[str, Any]) -> Optional[dict]:
+        '''取下一条录制，不等待延迟；没有录制时返回 None'''
+        key = request_key(kind, request)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats['misses'] += 1
+                return None
+            cursor = self._cursor.get(key, 0)
+            self._cursor[key] = cursor + 1
+            self.stats['hits'] += 1
+            return entries[cursor % len(entries)]
+
+    def record(self, kind: str, request: Mapping[str, Any], response: dict, seconds: float) -> dict:
+        entry = {'key': request_key(kind, request), 'kind': kind, 'request': dict(request),
+                 'response': response, 'seconds': seconds}
+        with self._lock:
+            self._entries.setdefault(entry['key'], []).append(entry)
+            self.stats['recorded'] += 1
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self._torn:
+                    f.write('\n')
+                    self._torn = False
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        return entry
+
+    def wait(self, kind: str, entry: dict):
+        '''按延迟模型等待，条目中附带该请求是第几次出现（occurrence，从 0 开始）'''
+        if self.latency is None:
+            return
+        key = entry.get('key', '')
+        with self._lock:
+            occurrence = self._occurrences.get(key, 0)
+            self._occurrences[key] = occurrence + 1
+        seconds = self.latency(kind, {**entry, 'occurrence': occurrence})
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def reset_occurrences(self):
+        '''清零各请求的出现次数，此后的延迟与之前运行过哪些请求无关；基准测试在每个场景开始前调用'''
+        with self._lock:
+            self._occurrences.clear()
+
+    def replay_miss(self, kind: str, request: Mapping[str, Any]) -> dict:
+        '''已经 lookup 未命中且无法调用服务商时：返回合成响应，未开启 synthetic 时报 CassetteMiss'''
+        if not self.synthetic:
+            raise CassetteMiss(f'录制中没有该 {kind} 请求：{json.dumps(dict(request), ensure_ascii=False)[:200]}')
+        response = synthetic_response(kind, request, self.embedding_dim)
+        with self._lock:
+            self.stats['synthetic'] += 1
+        self.wait(kind, {'key': request_key(kind, request), 'kind': kind, 'response': response, 'seconds': 0.0})
+        return response
+
+    def call(self, kind: str, request: Mapping[str, Any], fn: Optional[Callable[[], dict]]) -> dict:
+        '''
+        按模式回放或调用 fn 并录制
+
+        Args:
+            kind (str): 'chat' 或 'embedding'.
+            request (Mapping): chat 为 {model, messages}，embedding 为 {model, input}.
+            fn (Callable): 实际调用服务商的函数，返回规范化的响应；只回放时可以为空.
+
+        Returns:
+            dict: 规范化的响应.
+        '''
+        if self.mode != 'record' and self.mode != 'off':
+            entry = self.lookup(kind, request)
+            if entry is not None:
+                self.wait(kind, entry)
+                return entry['response']
+        if self.mode == 'replay' or fn is None:
+            return self.replay_miss(kind, request)
+        start_time = time.perf_counter()
+        response = fn()
+        seconds = time.perf_counter() - start_time
+        if self.mode != 'off':
+            self.record(kind, request, response, seconds)
+        return response
+
+
+def _model_name(llm: Any, model: Optional[str] = None) -> str:
+    '''参与请求匹配的模型名：优先用显式传入的 model，其次取 llm 的 model / model_name，都没有时报错'''
+    if model:
+        return model
+    for attr in ('model', 'model_name'):
+        value = getattr(llm, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    # 退回类名会让同一类的不同模型共用录制，必须显式指定
+    raise ValueError(f'无法从 {type(llm).__name__} 取得模型名，请显式传入 model')
+
+
+# 继承自 langchain_core.language_models.llms.LLM
+class CassetteLLM(LLM):
+    # 被录制的模型，可以是 ZhipuAILLM、Wenxin_LLM、ChatOpenAI 等；只回放时可以为空
+    llm: Any = None
+    # 模型名，参与请求匹配；为空时取 llm 的 model / model_name
+    model: Optional[str] = None
+    cassette: Any
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None,
+              **kwargs: Any) -> str:
+        model = _model_name(self.llm, self.model)
+
+        def invoke() -> dict:
+            result = self.llm.invoke(prompt, stop=stop)
+            content = result if isinstance(result, str) else result.content
+            usage = getattr(result, 'usage_metadata', None) or {}
+            return {'content': content, 'prompt_tokens': usage.get('input_tokens'),
+                    'completion_tokens': usage.get('output_tokens')}
+
+        response = self.cassette.call('chat', chat_request(model, prompt), invoke if self.llm is not None else None)
+        return response['content']
+
+    @property
+    def _llm_type(self) -> str:
+        return 'Cassette'
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {'model': _model_name(self.llm, self.model), 'cassette': self.cassette.path}
+
+
+class CassetteEmbeddings(Embeddings):
+    '''按单条文本录制 / 回放的 Embeddings；录制时未命中的文本仍合并为一次 embed_documents'''
+
+    def __init__(self, embedding: Optional[Embeddings], cassette: Cassette, model: Optional[str] = None):
+        '''
+        Args:
+            embedding (Embeddings): 被录制的模型，只回放时可以为空.
+            cassette (Cassette): 录制.
+            model (str): 模型名，参与请求匹配；为空时取 embedding 的 model / model_name，
+                都没有（如 ZhipuAIEmbeddings）时必须传入.
+        '''
+        self.embedding = embedding
+        self.cassette = cassette
+        self.model = _model_name(embedding, model)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            if self.cassette.mode in ('replay', 'auto'):
+                entry = self.cassette.lookup('embedding', {'model': self.model, 'input': text})
+                if entry is not None:
+                    self.cassette.wait('embedding', entry)
+                    vectors[i] = entry['response']['embedding']
+                    continue
+            missing.append(i)
+        if missing and (self.cassette.mode == 'replay' or self.embedding is None):
+            # 上面已经 lookup 过，直接按未命中处理，不再重复计数
+            for i in missing:
+                vectors[i] = self.cassette.replay_miss('embedding', {'model': self.model, 'input': texts[i]})[
+                    'embedding']
+        elif missing:
+            start_time = time.perf_counter()
+            computed = self.embedding.embed_documents([texts[i] for i in missing])
+            # 一次批量调用的耗时均摊到每条文本
+            seconds = (time.perf_counter() - start_time) / len(missing)
+            for i, vector in zip(missing, computed):
+                vectors[i] = list(vector)
+                if self.cassette.mode != 'off':
+                    self.cassette.record('embedding', {'model': self.model, 'input': texts[i]},
+                                         {'embedding': vectors[i]}, seconds)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        def invoke() -> dict:
+            return {'embedding': list(self.embedding.embed_query(text))}
+
+        return self.cassette.call('embedding', {'model': self.model, 'input': text},
+                                  invoke if self.embedding is not None else None)['embedding']
+
+
+class AttrDict(dict):
+    '''可以用属性访问的字典，模拟 SDK 的响应对象（response.choices[0].message.content）'''
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def to_attr(value: Any) -> Any:
+    if isinstance(value, dict):
+        return AttrDict({key: to_attr(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_attr(item) for item in value]
+    return value
+
+
+def chat_completion_response(model: str, response: dict) -> dict:
+    '''规范化的 chat 响应 -> OpenAI / 智谱 chat.completions 的响应格式'''
+    prompt_tokens = response.get('prompt_tokens') or 0
+    completion_tokens = response.get('completion_tokens') or 0
+    return {
+        'id': 'cassette-' + hashlib.sha1(response['content'].encode('utf-8')).hexdigest()[:12],
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': response['content']}}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+def embeddings_response(model: str, vectors: Sequence[List[float]], n_chars: int) -> dict:
+    '''embedding 向量 -> OpenAI / 智谱 embeddings.create 的响应格式'''
+    return {
+        'object': 'list',
+        'model': model,
+        'data': [{'object': 'embedding', 'index': i, 'embedding': vector} for i, vector in enumerate(vectors)],
+        'usage': {'prompt_tokens': n_chars, 'total_tokens': n_chars},
+    }
+
+
+class _Completions():
+    def __init__(self, client: Any, cassette: Cassette):
+        self._client = client
+        self._cassette = cassette
+
+    def create(self, model: str, messages: List[dict], **kwargs: Any) -> AttrDict:
+        def invoke() -> dict:
+            response = self._client.chat.completions.create(model=model, messages=messages, **kwargs)
+            usage = response.usage
+            return {'content': response.choices[0].message.content,
+                    'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+                    'completion_tokens': getattr(usage, 'completion_tokens', None)}
+
+        response = self._cassette.call('chat', {'model': model, 'messages': messages},
+                                       invoke if self._client is not None else None)
+        return to_attr(chat_completion_response(model, response))
+
+
+class _Embeddings():
+    def __init__(self, client: Any, cassette: Cassette):
+        self._client = client
+        self._cassette = cassette
+
+    def create(self, model: str, input: Any, **kwargs: Any) -> AttrDict:
+        texts = [input] if isinstance(input, str) else list(input)
+        vectors = []
+        for text in texts:
+            def invoke(text: str = text) -> dict:
+                response = self._client.embeddings.create(model=model, input=text, **kwargs)
+                return {'embedding': list(response.data[0].embedding)}
+
+            vectors.append(self._cassette.call('embedding', {'model': model, 'input': text},
+                                               invoke if self._client is not None else None)['embedding'])
+        return to_attr(embeddings_response(model, vectors, sum(len(text) for text in texts)))
+
+
+class _Chat():
+    def __init__(self, client: Any, cassette: Cassette):
+        self.completions = _Completions(client, cassette)
+
+
+class CassetteClient():
+    '''
+    包装 ZhipuAI() / OpenAI() 原生客户端的 chat.completions.create 与 embeddings.create
+
+    可直接替换 generate_qa_pairs 中 get_llm 返回的客户端，或 ZhipuAIEmbeddings 的 client 字段.
+    '''
+
+    def __init__(self, client: Any, cassette: Cassette):
+        self.chat = _Chat(client, cassette)
+        self.embeddings = _Embeddings(client, cassette)
+        self.cassette = cassette
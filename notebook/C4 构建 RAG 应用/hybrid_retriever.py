@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# BM25 稀疏检索 + 向量检索，用倒数排名融合（RRF）合并结果
+
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+# 中文连续片段、其余文字的单词（英文、数字、希腊字母、数学斜体字母、全角字母等），以及单个非 ASCII 符号；
+# 空白与 ASCII 标点不成词
+_TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[^\W\u4e00-\u9fff]+|[^\w\s\x00-\x7f]')
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+# 单个符号中只保留数学符号（Sm，如 ∑ ∈ ＝）与其他符号（So），丢弃标点
+_SYMBOL_CATEGORIES = ('Sm', 'So')
+
+# 稀疏与稠密检索共用的线程池，避免每次查询创建线程
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def tokenize(text: str) -> List[str]:
+    '''
+    不依赖分词器的中英文切词
+
+    英文、数字、希腊字母等转为小写后整体保留，∑、∈ 等数学符号各自成词（利于公式、变量名、术语的精确匹配），
+    中文连续片段切为单字与二元组。
+    '''
+    tokens = []
+    for piece in _TOKEN_PATTERN.findall(text):
+        if _CJK_PATTERN.fullmatch(piece):
+            tokens.extend(piece)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        elif len(piece) > 1 or piece.isalnum() or unicodedata.category(piece) in _SYMBOL_CATEGORIES:
+            tokens.append(piece.lower())
+    return tokens
+
+
+class BM25Index():
+    '''
+    倒排表形式的 BM25 索引
+
+    构建时即计算好每个 (词, 文档) 的 BM25 权重，查询时只需把查询词的倒排表按文档累加。
+    '''
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        # 第 i 个词的倒排表为 doc_ids/weights[offsets[i]:offsets[i + 1]]
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.docs: List[Document] = []
+
+    @classmethod
+    def from_documents(cls, docs: List[Document], k1: float = 1.5, b: float = 0.75) -> 'BM25Index':
+        index = cls(k1, b)
+        index.docs = list(docs)
+        term_freqs = [Counter(tokenize(doc.page_content)) for doc in index.docs]
+        lengths = np.array([sum(tf.values()) for tf in term_freqs], dtype=np.float32)
+        avg_length = float(lengths.mean()) if len(lengths) else 0.0
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, tf in enumerate(term_freqs):
+            for term, freq in tf.items():
+                postings.setdefault(term, []).append((doc_id, freq))
+
+        n_docs = len(index.docs)
+        offsets = [0]
+        doc_ids, weights = [], []
+        for term_id, (term, plist) in enumerate(postings.items()):
+            index.vocab[term] = term_id
+            ids = np.array([doc_id for doc_id, _ in plist], dtype=np.int32)
+            freqs = np.array([freq for _, freq in plist], dtype=np.float32)
+            idf = math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            norm = k1 * (1 - b + b * lengths[ids] / max(avg_length, 1e-6))
+            doc_ids.append(ids)
+            weights.append(idf * freqs * (k1 + 1) / (freqs + norm))
+            offsets.append(offsets[-1] + len(plist))
+        index.offsets = np.array(offsets, dtype=np.int64)
+        if doc_ids:
+            index.doc_ids = np.concatenate(doc_ids)
+            index.weights = np.concatenate(weights).astype(np.float32)
+        return index
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float]]:
+        '''返回得分最高的 k 个 (文档序号, BM25 得分)，只包含与查询有词重合的文档'''
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        for term, count in Counter(tokenize(query)).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # 同一倒排表内文档不重复，可直接按下标累加
+            scores[self.doc_ids[start:end]] += count * self.weights[start:end]
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(int(i), float(scores[i])) for i in matched]
+
+    def save(self, folder: str):
+        '''保存到 folder：bm25.npz（倒排表）与 bm25_docs.json（词表、文档与参数）'''
+        os.makedirs(folder, exist_ok=True)
+        np.savez(os.path.join(folder, 'bm25.npz'),
+                 offsets=self.offsets, doc_ids=self.doc_ids, weights=self.weights)
+        with open(os.path.join(folder, 'bm25_docs.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'k1': self.k1,
+                'b': self.b,
+                'vocab': self.vocab,
+                'docs': [{'page_content': doc.page_content, 'metadata': doc.metadata} for doc in self.docs],
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, folder: str) -> 'BM25Index':
+        with open(os.path.join(folder, 'bm25_docs.json'), encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(data['k1'], data['b'])
+        index.vocab = data['vocab']
+        index.docs = [Document(**doc) for doc in data['docs']]
+        arrays = np.load(os.path.join(folder, 'bm25.npz'))
+        index.offsets = arrays['offsets']
+        index.doc_ids = arrays['doc_ids']
+        index.weights = arrays['weights']
+        return index
+
+
+def build_bm25_index(docs: List[Document], folder: str) -> BM25Index:
+    '''
+    入库时与向量库同时构建并保存 BM25 索引，例如：
+
+        vectordb = Chroma.from_documents(split_docs, embedding, persist_directory=persist_directory)
+        build_bm25_index(split_docs, persist_directory + '_bm25')
+    '''
+    index = BM25Index.from_documents(docs)
+    index.save(folder)
+    return index
+
+
+def _doc_key(doc: Document) -> Tuple[str, Any, Any]:
+    return doc.page_content, doc.metadata.get('source'), doc.metadata.get('page')
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = 60,
+                           weights: Optional[List[float]] = None) -> List[Document]:
+    '''RRF：文档得分为各路结果中 weight / (k + 排名) 之和，同一文档按内容与来源去重'''
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[Tuple, float] = {}
+    docs: Dict[Tuple, Document] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    '''
+    并行执行向量检索与 BM25 检索，用 RRF 融合
+
+    用法：
+        retriever = HybridRetriever(vectorstore=vectordb, bm25=BM25Index.load(bm25_folder), k=3)
+        qa_chain = RetrievalQA.from_chain_type(llm, retriever=retriever, ...)
+    '''
+
+    vectorstore: VectorStore
+    bm25: Any
+    # 最终返回的文档数
+    k: int = 4
+    # 每一路检索的候选数
+    fetch_k: int = 20
+    # RRF 平滑常数
+    rrf_k: int = 60
+    # 稠密、稀疏两路的权重
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _sparse_search(self, query: str) -> List[Document]:
+        return [self.bm25.docs[i] for i, _ in self.bm25.search(query, self.fetch_k)]
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        sparse = _executor.submit(self._sparse_search, query)
+        dense = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        fused = reciprocal_rank_fusion([dense, sparse.result()], self.rrf_k,
+                                       [self.dense_weight, self.sparse_weight])
+        return fused[:self.k]
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# 基于 LangChain 定义多后端路由模型：按权重与实测延迟分流，失败自动切换并熔断
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+from langchain_core.callbacks.manager import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.pydantic_v1 import PrivateAttr
+
+
+class BackendState():
+    '''记录单个后端的调用统计与熔断状态'''
+
+    def __init__(self, name: str, weight: float = 1.0):
+        self.name = name
+        self.weight = weight
+        # 指数滑动平均延迟（秒），None 表示尚未测得
+        self.latency: Optional[float] = None
+        self.calls = 0
+        self.errors = 0
+        # 连续失败次数，达到阈值后熔断
+        self.consecutive_failures = 0
+        # 熔断截止时间，0 表示未熔断
+        self.open_until = 0.0
+        # 半开状态下是否已有一个试探请求在进行
+        self.probing = False
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.calls if self.calls else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "weight": self.weight,
+            "latency": self.latency,
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": self.error_rate,
+            "open": self.open_until > time.monotonic(),
+        }
+
+
+# 继承自 langchain_core.language_models.llms.LLM
+class RouterLLM(LLM):
+    # 后端模型列表，可以是 ZhipuAILLM、Wenxin_LLM、ChatOpenAI 等任意 LangChain 模型
+    backends: List[Any]
+    # 各后端的静态权重，默认等权
+    weights: Optional[List[float]] = None
+    # 连续失败多少次后熔断
+    failure_threshold: int = 3
+    # 熔断持续时间（秒），到期后进入半开状态放行一个试探请求
+    cooldown: float = 30.0
+    # 延迟滑动平均系数
+    latency_alpha: float = 0.2
+
+    _states: List[BackendState] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if not self.backends:
+            raise ValueError('backends 不能为空')
+        weights = self.weights or [1.0] * len(self.backends)
+        if len(weights) != len(self.backends):
+            raise ValueError('weights 的长度必须与 backends 一致')
+        self._states = [
+            BackendState(self._backend_name(backend, i), weight)
+            for i, (backend, weight) in enumerate(zip(self.backends, weights))
+        ]
+
+    @classmethod
+    def from_env(cls, **kwargs: Any) -> 'RouterLLM':
+        '''
+        根据环境变量中已配置的 API Key 构造路由模型
+
+        ZHIPUAI_API_KEY -> ZhipuAILLM
+        QIANFAN_AK / QIANFAN_SK -> Wenxin_LLM
+        OPENAI_API_KEY -> ChatOpenAI
+        '''
+        backends = []
+        if os.environ.get("ZHIPUAI_API_KEY"):
+            from zhipuai_llm import ZhipuAILLM
+            backends.append(ZhipuAILLM(api_key=os.environ["ZHIPUAI_API_KEY"]))
+        if os.environ.get("QIANFAN_AK") and os.environ.get("QIANFAN_SK"):
+            from wenxin_llm import Wenxin_LLM
+            backends.append(Wenxin_LLM(api_key=os.environ["QIANFAN_AK"],
+                                       secret_key=os.environ["QIANFAN_SK"]))
+        if os.environ.get("OPENAI_API_KEY"):
+            from langchain_openai import ChatOpenAI
+            backends.append(ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0))
+        if not backends:
+            raise ValueError('环境变量中没有找到任何可用的 API Key')
+        return cls(backends=backends, **kwargs)
+
+    @staticmethod
+    def _backend_name(backend: Any, index: int) -> str:
+        model = getattr(backend, "model", None) or getattr(backend, "model_name", None)
+        return f"{index}:{type(backend).__name__}:{model}"
+
+    def _available(self, state: BackendState, now: float) -> bool:
+        '''熔断未到期的后端不可用；到期后只放行一个试探请求'''
+        if state.open_until == 0.0:
+            return True
+        if now < state.open_until:
+            return False
+        return not state.probing
+
+    def _score(self, state: BackendState) -> float:
+        # 尚未测得延迟的后端按已知最小延迟计，保证新后端也能分到流量
+        known = [s.latency for s in self._states if s.latency]
+        latency = state.latency or (min(known) if known else 1.0)
+        return state.weight / max(latency, 1e-3)
+
+    def _plan(self) -> List[int]:
+        '''
+        生成本次请求的后端尝试顺序
+
+        首选后端按 权重/延迟 加权随机抽取，其余可用后端按得分降序作为备选；
+        全部熔断时退化为按熔断到期时间排序，保证请求仍有机会被处理。
+        '''
+        now = time.monotonic()
+        with self._lock:
+            candidates = [i for i, s in enumerate(self._states) if self._available(s, now)]
+            if not candidates:
+                return sorted(range(len(self._states)), key=lambda i: self._states[i].open_until)
+            scores = [self._score(self._states[i]) for i in candidates]
+            first = random.choices(candidates, weights=scores, k=1)[0]
+            rest = sorted((i for i in candidates if i != first),
+                          key=lambda i: self._score(self._states[i]), reverse=True)
+            return [first] + rest
+
+    def _acquire(self, index: int) -> bool:
+        '''尝试占用后端；半开状态的后端同一时间只放行一个试探请求'''
+        now = time.monotonic()
+        with self._lock:
+            state = self._states[index]
+            if state.open_until == 0.0:
+                return True
+            if not self._available(state, now):
+                return False
+            state.probing = True
+            return True
+
+    def _record(self, index: int, latency: Optional[float]):
+        '''记录一次调用结果，latency 为 None 表示失败'''
+        with self._lock:
+            state = self._states[index]
+            state.calls += 1
+            state.probing = False
+            if latency is None:
+                state.errors += 1
+                state.consecutive_failures += 1
+                if state.consecutive_failures >= self.failure_threshold:
+                    state.open_until = time.monotonic() + self.cooldown
+                return
+            state.consecutive_failures = 0
+            state.open_until = 0.0
+            if state.latency is None:
+                state.latency = latency
+            else:
+                state.latency = (1 - self.latency_alpha) * state.latency + self.latency_alpha * latency
+
+    def _call(self, prompt : str, stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any):
+        errors = []
+        order = self._plan()
+        # 全部后端都处于熔断期时，仍按计划顺序强制尝试
+        forced = not any(self._states[i].open_until == 0.0 or
+                         self._states[i].open_until <= time.monotonic() for i in order)
+        for index in order:
+            if not forced and not self._acquire(index):
+                continue
+            backend = self.backends[index]
+            start = time.perf_counter()
+            try:
+                output = backend.invoke(prompt, stop=stop, **kwargs)
+            except Exception as e:
+                self._record(index, None)
+                errors.append(f"{self._states[index].name}: {e!r}")
+                continue
+            self._record(index, time.perf_counter() - start)
+            # ChatModel 返回 AIMessage，LLM 返回 str
+            return getattr(output, "content", output)
+        raise RuntimeError("所有后端均调用失败：\n" + "\n".join(errors))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        '''返回各后端的调用次数、错误率、平均延迟与熔断状态'''
+        with self._lock:
+            return [state.to_dict() for state in self._states]
+
+    # 首先定义一个返回默认参数的方法
+    @property
+    def _default_params(self) -> Dict[str, Any]:
+        """获取路由的默认参数。"""
+        normal_params = {
+            "failure_threshold": self.failure_threshold,
+            "cooldown": self.cooldown,
+            }
+        return {**normal_params}
+
+    @property
+    def _llm_type(self) -> str:
+        return "Router"
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        """Get the identifying parameters."""
+        return {**{"backends": [s.name for s in self._states]}, **self._default_params}
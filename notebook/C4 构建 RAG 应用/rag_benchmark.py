@@ -0,0 +1,613 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# 端到端 RAG 基准测试：回答 “一个问题的 8 秒花在哪里”.
+#
+# 以 streamlit_app.get_qa_chain 的路径（get_retriever 的混合检索 / 重排 + 同一 Prompt 的 RetrievalQA stuff 链）
+# 为对象，服务商由 cassette 替身代替（录制回放或确定性合成响应，可模拟延迟），无需联网。包含三个场景：
+#     ingestion：加载 data_base/knowledge_db -> 清洗 -> 切分 -> embedding -> 写入向量库 -> 构建 BM25 索引，
+#                各阶段耗时与吞吐；
+#     query：逐个问题执行问答链，embed_query / search / retrieve / prompt_assembly / generate / total
+#            各阶段的 p50 / p95 / p99 延迟；
+#     concurrent：多个并发度下的吞吐（qps）与延迟分位数.
+# 另外记录各场景期间常驻内存相对场景开始时的峰值增量、cassette 与 embedding 缓存命中率. 每个场景重复 --repeat 次取各指标的中位数，
+# 结果写为 JSON，可与保存的基线对比：超出容差的指标视为回归（退出码为 1），延迟模型或向量库与基线不同时
+# 拒绝对比（退出码为 2），用于部署前拦截性能退化.
+#
+# 用法：
+#     python rag_benchmark.py --store numpy --persist-directory bench_db --save-baseline baseline.json
+#     python rag_benchmark.py --store numpy --persist-directory bench_db --scenarios query --baseline baseline.json
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks.manager import CallbackManagerForLLMRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.retrievers import BaseRetriever
+
+sys.path.append('../C3 搭建知识库')
+
+from cassette import (Cassette, CassetteEmbeddings, CassetteLLM, lognormal_latency, recorded_latency,
+                      token_latency)
+
+# 结果格式的版本，字段变化时递增
+SCHEMA_VERSION = 3
+
+KNOWLEDGE_DB = '../../data_base/knowledge_db'
+QUESTIONS = '../C7 高级 RAG 技巧/2. 数据处理/train_dataset.json'
+
+LATENCY_MODELS = {
+    'none': lambda: None,
+    'recorded': lambda: recorded_latency(),
+    'lognormal': lambda: lognormal_latency(seed=0),
+    'token': lambda: token_latency(),
+}
+
+# 每个问题的阶段耗时，由各个计时封装写入当前线程的 trace
+_local = threading.local()
+
+
+def _record(stage: str, seconds: float):
+    stages = getattr(_local, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def trace() -> Iterator[Dict[str, float]]:
+    '''收集代码块内各计时封装的耗时'''
+    _local.stages = {}
+    try:
+        yield _local.stages
+    finally:
+        _local.stages = None
+
+
+class TimedEmbeddings(Embeddings):
+    '''记录 embed_query / embed_documents 耗时的 Embeddings'''
+
+    def __init__(self, embedding: Embeddings):
+        self.embedding = embedding
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        start_time = time.perf_counter()
+        vectors = self.embedding.embed_documents(texts)
+        _record('embed_documents', time.perf_counter() - start_time)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        start_time = time.perf_counter()
+        vector = self.embedding.embed_query(text)
+        _record('embed_query', time.perf_counter() - start_time)
+        return vector
+
+
+class TimedRetriever(BaseRetriever):
+    '''记录检索总耗时（其中包含 embed_query）'''
+
+    retriever: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        start_time = time.perf_counter()
+        docs = self.retriever.invoke(query)
+        _record('retrieve', time.perf_counter() - start_time)
+        return docs
+
+
+# 继承自 langchain_core.language_models.llms.LLM
+class TimedLLM(LLM):
+    # 被计时的模型
+    llm: Any
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None,
+              run_manager: Optional[CallbackManagerForLLMRun] = None,
+              **kwargs: Any) -> str:
+        start_time = time.perf_counter()
+        result = self.llm.invoke(prompt, stop=stop)
+        _record('generate', time.perf_counter() - start_time)
+        _record('prompt_chars', len(prompt))
+        return result if isinstance(result, str) else result.content
+
+    @property
+    def _llm_type(self) -> str:
+        return 'Timed'
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {'llm': type(self.llm).__name__}
+
+
+def rss_mb() -> float:
+    '''当前进程的常驻内存（MB）'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    '''进程启动以来的峰值常驻内存（MB），Linux 上 ru_maxrss 以 KB 为单位，macOS 为字节'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@contextmanager
+def rss_growth(interval: float = 0.02) -> Iterator[Dict[str, float]]:
+    '''
+    代码块执行期间由后台线程按 interval 秒采样常驻内存，结束后 usage['rss_growth_mb'] 为峰值相对开始时的增量
+
+    ru_maxrss 是进程级的峰值，入库之后的场景只会重复入库时的峰值，因此各场景单独采样.
+    '''
+    start = rss_mb()
+    peak = [start]
+    usage = {'rss_growth_mb': 0.0}
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield usage
+    finally:
+        done.set()
+        sampler.join()
+        usage['rss_growth_mb'] = max(peak[0], rss_mb()) - start
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    '''毫秒为单位的 mean / p50 / p95 / p99'''
+    if not len(seconds):
+        return {'count': 0}
+    values = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'mean_ms': float(values.mean()), 'p50_ms': float(p50),
+            'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+
+class Providers():
+    '''服务商替身：cassette 回放（缺失时合成），可选地在外层套 CachedEmbeddings'''
+
+    def __init__(self, cassette: Cassette, llm_model: str = 'gpt-3.5-turbo',
+                 embedding_model: str = 'embedding-2', embedding_cache: bool = False):
+        self.cassette = cassette
+        self.llm = CassetteLLM(model=llm_model, cassette=cassette)
+        embedding: Embeddings = CassetteEmbeddings(None, cassette, model=embedding_model)
+        self.embedding_cache = None
+        if embedding_cache:
+            sys.path.append('../C7 高级 RAG 技巧/2. 数据处理')
+            from embedding_cache import CachedEmbeddings
+            self.embedding_cache = embedding = CachedEmbeddings(embedding, namespace=embedding_model)
+        self.embedding = TimedEmbeddings(embedding)
+
+    def cache_stats(self) -> Dict[str, float]:
+        stats = self.cassette.stats
+        total = stats['hits'] + stats['misses']
+        result = {'cassette_hit_rate': stats['hits'] / total if total else 0.0,
+                  'cassette_synthetic': stats['synthetic']}
+        if self.embedding_cache is not None:
+            result['embedding_cache_hit_rate'] = self.embedding_cache.hit_rate
+        return result
+
+
+def bm25_directory(persist_directory: str) -> str:
+    '''与向量库对应的 BM25 索引目录，与 streamlit_app 的 chroma / chroma_bm25 约定相同'''
+    return os.path.normpath(persist_directory) + '_bm25'
+
+
+def make_vectorstore(store: str, embedding: Embeddings, persist_directory: str):
+    '''入库用的向量库：chroma 打开（或创建）persist_directory，numpy 新建空库，入库后再 save'''
+    if store == 'chroma':
+        from langchain.vectorstores.chroma import Chroma
+        return Chroma(persist_directory=persist_directory, embedding_function=embedding)
+    from numpy_vectorstore import NumpyVectorStore
+    return NumpyVectorStore(embedding, index_type=store[len('numpy-'):] if store.startswith('numpy-') else 'flat')
+
+
+def load_vectorstore(store: str, embedding: Embeddings, persist_directory: Optional[str]):
+    '''打开之前 ingestion 写入 persist_directory 的向量库，不存在或为空时报错'''
+    if not persist_directory:
+        raise ValueError('不运行 ingestion 时需要用 persist_directory 指定已入库的向量库')
+    if store == 'chroma':
+        vectorstore = make_vectorstore(store, embedding, persist_directory)
+        if vectorstore._collection.count() == 0:
+            raise ValueError(f'{persist_directory} 中的 Chroma 向量库为空，请先运行 ingestion')
+        return vectorstore
+    if not os.path.exists(os.path.join(persist_directory, 'docstore.json')):
+        raise ValueError(f'{persist_directory} 中没有 NumpyVectorStore，请先运行 ingestion')
+    from numpy_vectorstore import NumpyVectorStore
+    return NumpyVectorStore.load(persist_directory, embedding,
+                                 index_type=store[len('numpy-'):] if store.startswith('numpy-') else 'flat')
+
+
+def run_ingestion(providers: Providers, knowledge_db: str = KNOWLEDGE_DB, store: str = 'chroma',
+                  persist_directory: Optional[str] = None, chunk_size: int = 500, chunk_overlap: int = 50,
+                  batch_size: int = 64, max_workers: Optional[int] = None) -> Tuple[Any, dict]:
+    '''
+    入库场景：加载、清洗、切分、embedding、写入向量库（numpy 同时保存到 persist_directory）、构建 BM25 索引，
+    各阶段顺序执行并分别计时；同一 persist_directory 重复入库时覆盖而不是追加
+
+    Returns:
+        Tuple[VectorStore, dict]: 构建好的向量库（供 query 场景使用）与指标.
+    '''
+    from offset_splitter import OffsetTextSplitter
+    from parallel_loader import ParallelLoader, get_file_paths
+    from text_cleaner import markdown_cleaner, pdf_cleaner
+
+    stages = {}
+    start_time = time.perf_counter()
+    docs = ParallelLoader(get_file_paths(knowledge_db), max_workers=max_workers).load()
+    stages['load'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for doc in docs:
+        clean = pdf_cleaner if doc.metadata.get('source', '').endswith('.pdf') else markdown_cleaner
+        doc.page_content = clean(doc.page_content)
+    stages['clean'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    splitter = OffsetTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = splitter.split_documents(docs)
+    stages['split'] = time.perf_counter() - start_time
+
+    texts = [chunk.page_content for chunk in chunks]
+    start_time = time.perf_counter()
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(providers.embedding.embed_documents(texts[start:start + batch_size]))
+    stages['embed'] = time.perf_counter() - start_time
+
+    persist_directory = persist_directory or tempfile.mkdtemp(prefix='rag_benchmark_')
+    vectorstore = make_vectorstore(store, providers.embedding, persist_directory)
+    start_time = time.perf_counter()
+    metadatas = [chunk.metadata for chunk in chunks]
+    if hasattr(vectorstore, 'add_vectors'):
+        vectorstore.add_vectors(np.asarray(vectors, dtype=np.float32), texts, metadatas)
+        vectorstore.save(persist_directory)
+    else:
+        for start in range(0, len(texts), batch_size):
+            vectorstore._collection.upsert(ids=[str(i) for i in range(start, min(start + batch_size, len(texts)))],
+                                           embeddings=vectors[start:start + batch_size],
+                                           documents=texts[start:start + batch_size],
+                                           metadatas=metadatas[start:start + batch_size])
+    stages['index'] = time.perf_counter() - start_time
+
+    from hybrid_retriever import build_bm25_index
+    start_time = time.perf_counter()
+    build_bm25_index(chunks, bm25_directory(persist_directory))
+    stages['bm25'] = time.perf_counter() - start_time
+
+    total = sum(stages.values())
+    n_chars = sum(len(text) for text in texts)
+    return vectorstore, {
+        'documents': len(docs),
+        'chunks': len(chunks),
+        'chars': n_chars,
+        'stages_seconds': stages,
+        'total_seconds': total,
+        'chunks_per_second': len(chunks) / total if total else 0.0,
+        'embed_chars_per_second': n_chars / stages['embed'] if stages['embed'] else 0.0,
+    }
+
+
+def build_qa_chain(providers: Providers, vectorstore: Any, bm25_folder: Optional[str] = None):
+    '''
+    与 get_qa_chain 相同的 RetrievalQA：检索器由 streamlit_app.get_retriever 构建（bm25_folder 存在时混合检索，
+    设置 RERANK_MODEL 时重排），Prompt 为 streamlit_app.QA_TEMPLATE，检索器与模型套上计时封装
+    '''
+    from langchain.chains import RetrievalQA
+    from langchain.prompts import PromptTemplate
+    from streamlit_app import QA_TEMPLATE, get_retriever
+
+    prompt = PromptTemplate(input_variables=['context', 'question'], template=QA_TEMPLATE)
+    retriever = TimedRetriever(retriever=get_retriever(vectorstore, bm25_folder))
+    return RetrievalQA.from_chain_type(TimedLLM(llm=providers.llm), retriever=retriever,
+                                       return_source_documents=True, chain_type_kwargs={'prompt': prompt})
+
+
+def ask(chain: Any, question: str) -> Dict[str, float]:
+    '''执行一次问答，返回各阶段耗时（秒）'''
+    with trace() as stages:
+        start_time = time.perf_counter()
+        chain.invoke({'query': question})
+        stages['total'] = time.perf_counter() - start_time
+    stages = dict(stages)
+    # 检索中去掉 embed_query 即检索本身（向量检索、BM25 与重排）；总耗时中去掉检索与生成即 Prompt 拼装与链的开销
+    stages['search'] = stages.get('retrieve', 0.0) - stages.get('embed_query', 0.0)
+    stages['prompt_assembly'] = stages['total'] - stages.get('retrieve', 0.0) - stages.get('generate', 0.0)
+    return stages
+
+
+STAGES = ('embed_query', 'search', 'retrieve', 'prompt_assembly', 'generate', 'total')
+
+
+def summarize_stages(traces: List[Dict[str, float]]) -> Dict[str, dict]:
+    return {stage: latency_summary([item[stage] for item in traces if stage in item]) for stage in STAGES}
+
+
+def run_query(chain: Any, questions: Sequence[str], warmup: int = 2) -> dict:
+    '''query 场景：逐个问题执行，统计各阶段延迟分位数'''
+    for question in questions[:warmup]:
+        ask(chain, question)
+    start_time = time.perf_counter()
+    traces = [ask(chain, question) for question in questions]
+    seconds = time.perf_counter() - start_time
+    return {
+        'questions': len(questions),
+        'qps': len(questions) / seconds if seconds else 0.0,
+        'stages': summarize_stages(traces),
+        'prompt_chars_mean': float(np.mean([item.get('prompt_chars', 0) for item in traces])) if traces else 0.0,
+    }
+
+
+def run_concurrent(chain: Any, questions: Sequence[str], concurrency: Sequence[int] = (1, 4, 16)) -> dict:
+    '''concurrent 场景：每个并发度下用线程池执行全部问题，统计吞吐与延迟'''
+    results = {}
+    for workers in concurrency:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            start_time = time.perf_counter()
+            traces = list(executor.map(lambda question: ask(chain, question), questions))
+            seconds = time.perf_counter() - start_time
+        results[str(workers)] = {
+            'qps': len(questions) / seconds if seconds else 0.0,
+            'total': latency_summary([item['total'] for item in traces]),
+            'generate': latency_summary([item.get('generate', 0.0) for item in traces]),
+            'retrieve': latency_summary([item.get('retrieve', 0.0) for item in traces]),
+        }
+    return results
+
+
+def run_context() -> dict:
+    '''运行环境，写入结果便于对比时确认可比性'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+def flatten(value: Any, prefix: str = '') -> Dict[str, float]:
+    '''嵌套字典展开为 a.b.c -> 数值'''
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(flatten(item, f'{prefix}.{key}' if prefix else str(key)))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+
+def median_results(runs: List[Any]) -> Any:
+    '''多次运行的结果逐项取中位数，非数值字段取第一次的值'''
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: median_results([run[key] for run in runs if key in run]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        value = float(np.median(runs))
+        return int(value) if isinstance(first, int) and value.is_integer() else value
+    return first
+
+
+def _higher_is_better(name: str) -> Optional[bool]:
+    '''吞吐类指标越大越好，耗时与内存越小越好，其余（计数等）不参与对比'''
+    leaf = name.rsplit('.', 1)[-1]
+    if leaf == 'qps' or leaf.endswith('_per_second') or leaf.endswith('hit_rate'):
+        return True
+    if leaf.endswith('_ms') or leaf.endswith('_mb') or 'seconds' in name:
+        return False
+    return None
+
+
+def _milliseconds(name: str, value: float) -> Optional[float]:
+    '''耗时类指标换算为毫秒，其余返回 None'''
+    if name.endswith('_ms'):
+        return value
+    if 'seconds' in name:
+        return value * 1000
+    return None
+
+
+# 这些运行环境不同时，结果之间没有可比性
+COMPARABLE_CONTEXT = ('schema_version', 'latency', 'store')
+# 进程级的内存读数取决于本次运行了哪些场景，只作记录，不参与对比（各场景的 rss_growth_mb 参与对比）
+NOT_COMPARED = ('memory.',)
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.1, min_ms: float = 1.0,
+            min_mb: float = 1.0) -> List[dict]:
+    '''
+    与基线逐项对比，两者应为 run_benchmark 按 repeat 次运行取中位数后的结果
+
+    Args:
+        tolerance (float): 相对变化超过该比例视为回归.
+        min_ms (float): 基线小于该毫秒数的耗时指标（*_ms 与 *seconds*）不参与对比（噪声远大于数值本身）.
+        min_mb (float): 基线小于该 MB 数的内存指标（*_mb）不参与对比，理由同上.
+
+    Returns:
+        List[dict]: 回归的指标，每项为 {metric, baseline, current, change}.
+
+    Raises:
+        ValueError: COMPARABLE_CONTEXT 中的运行环境（结果格式、延迟模型、向量库）与基线不同.
+    '''
+    for key in COMPARABLE_CONTEXT:
+        expected, actual = baseline.get('context', {}).get(key), current.get('context', {}).get(key)
+        if expected != actual:
+            raise ValueError(f'基线的 {key} 为 {expected}，本次为 {actual}，结果不可比')
+    current_values = flatten(current.get('scenarios', {}))
+    baseline_values = flatten(baseline.get('scenarios', {}))
+    regressions = []
+    for name, base in baseline_values.items():
+        better = _higher_is_better(name)
+        if better is None or name not in current_values or base == 0 or name.startswith(NOT_COMPARED):
+            continue
+        base_ms = _milliseconds(name, base)
+        if base_ms is not None and base_ms < min_ms:
+            continue
+        if name.endswith('_mb') and abs(base) < min_mb:
+            continue
+        value = current_values[name]
+        change = (value - base) / abs(base)
+        if (better and change < -tolerance) or (not better and change > tolerance):
+            regressions.append({'metric': name, 'baseline': base, 'current': value, 'change': change})
+    return regressions
+
+
+def print_report(results: dict):
+    scenarios = results['scenarios']
+    if 'ingestion' in scenarios:
+        ingestion = scenarios['ingestion']
+        print(f"ingestion: {ingestion['documents']} 文档，{ingestion['chunks']} 块，"
+              f"{ingestion['total_seconds']:.2f}s，内存增量 {ingestion['rss_growth_mb']:.0f} MB")
+        for stage, seconds in ingestion['stages_seconds'].items():
+            print(f'    {stage:<16}{seconds:>10.3f}s')
+    if 'query' in scenarios:
+        query = scenarios['query']
+        print(f"query: {query['questions']} 个问题，{query['qps']:.2f} qps")
+        print(f"    {'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, summary in query['stages'].items():
+            if summary.get('count'):
+                print(f"    {stage:<16}{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}")
+    if 'concurrent' in scenarios:
+        print(f"concurrent: {'workers':>8}{'qps':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for workers, result in scenarios['concurrent'].items():
+            if isinstance(result, dict):
+                print(f"            {workers:>8}{result['qps']:>10.2f}{result['total']['p50_ms']:>10.1f}"
+                      f"{result['total']['p95_ms']:>10.1f}")
+    print('cache:', json.dumps(scenarios.get('cache', {}), ensure_ascii=False))
+
+
+def load_questions(path: str, limit: Optional[int] = None) -> List[str]:
+    '''读取问题：train_dataset.json 这类 [{query, ...}]、[{question, ...}] 或问题字符串列表'''
+    with open(path, encoding='utf-8') as f:
+        items = json.load(f)
+    questions = [item if isinstance(item, str) else item.get('query', item.get('question')) for item in items]
+    # train_dataset.json 中有少量生成失败的空问题
+    questions = [question for question in questions if question]
+    return questions[:limit] if limit else questions
+
+
+def run_benchmark(
+        providers: Providers,
+        questions: Sequence[str],
+        scenarios: Sequence[str] = ('ingestion', 'query', 'concurrent'),
+        store: str = 'chroma',
+        knowledge_db: str = KNOWLEDGE_DB,
+        persist_directory: Optional[str] = None,
+        concurrency: Sequence[int] = (1, 4, 16),
+        repeat: int = 3,
+) -> dict:
+    '''
+    依次运行各场景，每个场景重复 repeat 次，各指标取中位数
+
+    query 与 concurrent 使用 ingestion 构建的向量库与 BM25 索引；未运行 ingestion 时从 persist_directory 加载，
+    没有已入库的向量库时报错. 每次运行场景前清零 cassette 的请求出现次数，合成延迟只取决于场景本身，
+    只运行部分场景的结果可以与完整运行的基线对比；各场景记录常驻内存的增量 rss_growth_mb.
+    '''
+    results = {'context': run_context(), 'scenarios': {}}
+    results['context'].update(store=store, repeat=repeat)
+    baseline_rss = rss_mb()
+    runs: Dict[str, List[dict]] = {}
+    if 'ingestion' in scenarios:
+        persist_directory = persist_directory or tempfile.mkdtemp(prefix='rag_benchmark_')
+        for _ in range(repeat):
+            providers.cassette.reset_occurrences()
+            with rss_growth() as memory:
+                vectorstore, metrics = run_ingestion(providers, knowledge_db, store, persist_directory)
+            runs.setdefault('ingestion', []).append({**metrics, **memory})
+    else:
+        vectorstore = load_vectorstore(store, providers.embedding, persist_directory)
+    chain = build_qa_chain(providers, vectorstore, bm25_directory(persist_directory))
+    for _ in range(repeat):
+        if 'query' in scenarios:
+            providers.cassette.reset_occurrences()
+            with rss_growth() as memory:
+                metrics = run_query(chain, questions)
+            runs.setdefault('query', []).append({**metrics, **memory})
+        if 'concurrent' in scenarios:
+            providers.cassette.reset_occurrences()
+            with rss_growth() as memory:
+                metrics = run_concurrent(chain, questions, concurrency)
+            runs.setdefault('concurrent', []).append({**metrics, **memory})
+    for name, scenario_runs in runs.items():
+        results['scenarios'][name] = median_results(scenario_runs)
+    results['scenarios']['cache'] = providers.cache_stats()
+    results['scenarios']['memory'] = {'start_rss_mb': baseline_rss, 'peak_rss_mb': peak_rss_mb()}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线端到端 RAG 基准测试：入库、问答与并发场景的阶段耗时')
+    parser.add_argument('--scenarios', nargs='+', default=['ingestion', 'query', 'concurrent'],
+                        choices=['ingestion', 'query', 'concurrent'])
+    parser.add_argument('--knowledge-db', default=KNOWLEDGE_DB)
+    parser.add_argument('--store', default='chroma', choices=['chroma', 'numpy', 'numpy-hnsw'])
+    parser.add_argument('--persist-directory', default=None,
+                        help='向量库目录；入库时为空则使用临时目录，只运行 query / concurrent 时必须指定')
+    parser.add_argument('--questions', default=QUESTIONS)
+    parser.add_argument('--limit', type=int, default=50, help='使用的问题数')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景的重复次数，各指标取中位数')
+    parser.add_argument('--cassette', default='cassettes/rag.jsonl', help='录制文件，缺失的请求使用合成响应')
+    parser.add_argument('--latency', choices=list(LATENCY_MODELS), default='none', help='模拟的服务商延迟')
+    parser.add_argument('--embedding-dim', type=int, default=1024)
+    parser.add_argument('--embedding-cache', action='store_true', help='在 embedding 外层套 CachedEmbeddings')
+    parser.add_argument('--output', default='rag_benchmark.json')
+    parser.add_argument('--baseline', default=None, help='对比的基线结果')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--min-ms', type=float, default=1.0, help='基线低于该毫秒数的耗时指标不参与对比')
+    parser.add_argument('--min-mb', type=float, default=1.0, help='基线低于该 MB 数的内存指标不参与对比')
+    parser.add_argument('--save-baseline', default=None, help='把本次结果另存为基线')
+    args = parser.parse_args()
+
+    cassette = Cassette(args.cassette, mode='replay', latency=LATENCY_MODELS[args.latency](), synthetic=True,
+                        embedding_dim=args.embedding_dim)
+    providers = Providers(cassette, embedding_cache=args.embedding_cache)
+    results = run_benchmark(providers, load_questions(args.questions, args.limit), args.scenarios, args.store,
+                            args.knowledge_db, args.persist_directory, args.concurrency, args.repeat)
+    results['context'].update(latency=args.latency, cassette_entries=len(cassette))
+    print_report(results)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(results, baseline, args.tolerance, args.min_ms, args.min_mb)
+        except ValueError as e:
+            print(e)
+            sys.exit(2)
+        for item in regressions:
+            print(f"回归 {item['metric']}: {item['baseline']:.3f} -> {item['current']:.3f} ({item['change']:+.1%})")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# 基于本地 cross-encoder（如 bge-reranker）的重排阶段：检索器多召回一些候选，重排后只把最相关、
+# 且总长度不超过 token 预算的文档块放进提示词
+
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain.retrievers import ContextualCompressionRetriever
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.documents import Document
+
+sys.path.append('../C3 搭建知识库')
+from rate_limiter import estimate_tokens
+
+# 同一进程内每个模型只加载一次
+_models: Dict[str, Any] = {}
+_models_lock = threading.Lock()
+
+# 分数缓存按模型在进程内共享：get_retriever 每次提问都会新建 CrossEncoderReranker
+_score_caches: Dict[str, OrderedDict] = {}
+_score_lock = threading.Lock()
+
+
+def load_cross_encoder(model_name: str, max_length: int = 512):
+    '''加载并缓存 CrossEncoder，需要 pip install sentence-transformers'''
+    with _models_lock:
+        model = _models.get(model_name)
+        if model is None:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError:
+                raise ImportError('重排需要安装 sentence-transformers：pip install sentence-transformers')
+            model = CrossEncoder(model_name, max_length=max_length, device='cpu')
+            _models[model_name] = model
+        return model
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class CrossEncoderReranker(BaseDocumentCompressor):
+    '''
+    用 cross-encoder 为 (问题, 文档块) 打分并重排
+
+    用法：
+        retriever = rerank_retriever(vectordb.as_retriever(search_kwargs={"k": 20}), top_n=3)
+        qa_chain = RetrievalQA.from_chain_type(llm, retriever=retriever, ...)
+    '''
+
+    # 重排模型，bge-reranker-base 在 CPU 上即可运行
+    model_name: str = "BAAI/bge-reranker-base"
+    # 最多保留的文档数
+    top_n: int = 3
+    # 保留文档的总 token 预算，超出时截断，为 None 时不限制
+    max_tokens: Optional[int] = 1500
+    # 每批送入模型的 (问题, 文档块) 数
+    batch_size: int = 16
+    # 输入模型的最大长度
+    max_length: int = 512
+    # 分数缓存（同一模型共享）的最大条数
+    cache_size: int = 10000
+
+    @staticmethod
+    def chunk_id(doc: Document) -> str:
+        '''文档块标识：优先使用 metadata 中的 id，否则为内容哈希'''
+        return str(doc.metadata.get('id') or _hash(doc.page_content))
+
+    def score(self, query: str, documents: Sequence[Document]) -> List[float]:
+        '''为每个文档块打分，已缓存的 (问题哈希, 文档块标识) 不再计算'''
+        query_hash = _hash(query)
+        keys = [(query_hash, self.chunk_id(doc)) for doc in documents]
+        scores: List[Optional[float]] = []
+        with _score_lock:
+            cache = _score_caches.setdefault(self.model_name, OrderedDict())
+            for key in keys:
+                score = cache.get(key)
+                if score is not None:
+                    cache.move_to_end(key)
+                scores.append(score)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            model = load_cross_encoder(self.model_name, self.max_length)
+            pairs = [(query, documents[i].page_content) for i in missing]
+            predicted = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            with _score_lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    cache[keys[i]] = float(score)
+                while len(cache) > self.cache_size:
+                    cache.popitem(last=False)
+        return scores
+
+    def compress_documents(
+            self,
+            documents: Sequence[Document],
+            query: str,
+            callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        ranked: List[Tuple[float, Document]] = sorted(
+            zip(self.score(query, documents), documents), key=lambda item: item[0], reverse=True)
+        selected = []
+        used = 0
+        for score, doc in ranked[:self.top_n]:
+            if self.max_tokens is not None:
+                tokens = estimate_tokens(doc.page_content)
+                # 至少保留一个文档块
+                if selected and used + tokens > self.max_tokens:
+                    break
+                used += tokens
+            selected.append(Document(page_content=doc.page_content,
+                                     metadata={**doc.metadata, 'rerank_score': score}))
+        return selected
+
+
+def rerank_retriever(base_retriever, **kwargs: Any) -> ContextualCompressionRetriever:
+    '''在 base_retriever 之后接入重排阶段，kwargs 传给 CrossEncoderReranker'''
+    return ContextualCompressionRetriever(
+        base_compressor=CrossEncoderReranker(**kwargs),
+        base_retriever=base_retriever,
+    )
@@ -1,12 +1,13 @@
-import streamlit as st
 from langchain_openai import ChatOpenAI
 import os
+import functools
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import PromptTemplate
 from langchain.chains import RetrievalQA
 import sys
 sys.path.append("../C3 搭建知识库") # 将父目录放入系统路径中
 from zhipuai_embedding import ZhipuAIEmbeddings
+from rate_limiter import get_rate_limiter, RateLimitCallbackHandler, INTERACTIVE
 from langchain.vectorstores.chroma import Chroma
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationalRetrievalChain
@@ -16,11 +17,26 @@ _ = load_dotenv(find_dotenv())    # read local .env file
 
 #export OPENAI_API_KEY=
 #os.environ["OPENAI_API_BASE"] = 'https://api.chatgptid.net/v1'
-zhipuai_api_key = os.environ['ZHIPUAI_API_KEY']
+zhipuai_api_key = os.environ.get('ZHIPUAI_API_KEY')
 
+# 不带历史记录的问答链所用的 Prompt，rag_benchmark 与此共用
+QA_TEMPLATE = """使用以下上下文来回答最后的问题。如果你不知道答案，就说你不知道，不要试图编造答
+        案。最多使用三句话。尽量使答案简明扼要。总是在回答的最后说“谢谢你的提问！”。
+        {context}
+        问题: {question}
+        """
+
+# 入库时与 Chroma 同时构建的 BM25 索引（见 hybrid_retriever.build_bm25_index）
+BM25_DIRECTORY = '../C3 搭建知识库/data_base/vector_db/chroma_bm25'
+
+
+def get_llm(openai_api_key, temperature=0, **kwargs):
+    # 聊天属于交互请求，走限流器的优先通道，抢占同进程内批量任务的配额
+    limiter = RateLimitCallbackHandler(get_rate_limiter("openai", openai_api_key), priority=INTERACTIVE)
+    return ChatOpenAI(temperature=temperature, openai_api_key=openai_api_key, callbacks=[limiter], **kwargs)
 
 def generate_response(input_text, openai_api_key):
-    llm = ChatOpenAI(temperature=0.7, openai_api_key=openai_api_key)
+    llm = get_llm(openai_api_key, temperature=0.7)
     output = llm.invoke(input_text)
     output_parser = StrOutputParser()
     output = output_parser.invoke(output)
@@ -29,7 +45,7 @@ def generate_response(input_text, openai_api_key):
 
 def get_vectordb():
     # 定义 Embeddings
-    embedding = ZhipuAIEmbeddings()
+    embedding = ZhipuAIEmbeddings(rate_limiter=get_rate_limiter("zhipuai", zhipuai_api_key), priority=INTERACTIVE)
     # 向量数据库持久化路径
     persist_directory = '../C3 搭建知识库/data_base/vector_db/chroma'
     # 加载数据库
@@ -39,15 +55,37 @@ def get_vectordb():
     )
     return vectordb
 
+@functools.lru_cache(maxsize=4)
+def load_bm25_index(bm25_directory, mtime):
+    # 每次提问都会调用 get_retriever，BM25 索引只在首次及索引文件更新（mtime 变化）后加载
+    from hybrid_retriever import BM25Index
+    return BM25Index.load(bm25_directory)
+
+def get_retriever(vectordb, bm25_directory=BM25_DIRECTORY, rerank_model=None):
+    # bm25_directory 存在时使用混合检索；rag_benchmark 传入与其向量库对应的索引目录
+    # 设置环境变量 RERANK_MODEL（如 BAAI/bge-reranker-base）时，先多召回候选再由本地模型重排
+    rerank_model = rerank_model or os.environ.get('RERANK_MODEL')
+    k = 20 if rerank_model else 4
+    if bm25_directory and os.path.exists(bm25_directory):
+        from hybrid_retriever import HybridRetriever
+        bm25 = load_bm25_index(bm25_directory, os.path.getmtime(os.path.join(bm25_directory, 'bm25.npz')))
+        retriever = HybridRetriever(vectorstore=vectordb, bm25=bm25, k=k)
+    else:
+        retriever = vectordb.as_retriever(search_kwargs={"k": k})
+    if rerank_model:
+        from reranker import rerank_retriever
+        retriever = rerank_retriever(retriever, model_name=rerank_model)
+    return retriever
+
 #带有历史记录的问答链
 def get_chat_qa_chain(question:str,openai_api_key:str):
     vectordb = get_vectordb()
-    llm = ChatOpenAI(model_name = "gpt-3.5-turbo", temperature = 0,openai_api_key = openai_api_key)
+    llm = get_llm(openai_api_key, model_name = "gpt-3.5-turbo")
     memory = ConversationBufferMemory(
         memory_key="chat_history",  # 与 prompt 的输入变量保持一致。
         return_messages=True  # 将以消息列表的形式返回聊天记录，而不是单个字符串
     )
-    retriever=vectordb.as_retriever()
+    retriever=get_retriever(vectordb)
     qa = ConversationalRetrievalChain.from_llm(
         llm,
         retriever=retriever,
@@ -59,16 +97,11 @@ def get_chat_qa_chain(question:str,openai_api_key:str):
 #不带历史记录的问答链
 def get_qa_chain(question:str,openai_api_key:str):
     vectordb = get_vectordb()
-    llm = ChatOpenAI(model_name = "gpt-3.5-turbo", temperature = 0,openai_api_key = openai_api_key)
-    template = """使用以下上下文来回答最后的问题。如果你不知道答案，就说你不知道，不要试图编造答
-        案。最多使用三句话。尽量使答案简明扼要。总是在回答的最后说“谢谢你的提问！”。
-        {context}
-        问题: {question}
-        """
+    llm = get_llm(openai_api_key, model_name = "gpt-3.5-turbo")
     QA_CHAIN_PROMPT = PromptTemplate(input_variables=["context","question"],
-                                 template=template)
+                                 template=QA_TEMPLATE)
     qa_chain = RetrievalQA.from_chain_type(llm,
-                                       retriever=vectordb.as_retriever(),
+                                       retriever=get_retriever(vectordb),
                                        return_source_documents=True,
                                        chain_type_kwargs={"prompt":QA_CHAIN_PROMPT})
     result = qa_chain({"query": question})
@@ -77,6 +110,9 @@ def get_qa_chain(question:str,openai_api_key:str):
 
 # Streamlit 应用程序界面
 def main():
+    # 只在界面中使用 streamlit，rag_benchmark 等导入本模块时不需要安装
+    import streamlit as st
+
     st.title('🦜🔗 动手学大模型应用开发')
     openai_api_key = st.sidebar.text_input('OpenAI API Key', type='password')
 
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+
+# 本地的 OpenAI / 智谱兼容桩服务：按 cassette 录制回放 chat.completions 与 embeddings，
+# 录制中没有的请求返回确定性的合成响应，可按录制耗时或合成分布模拟服务商延迟.
+#
+# 用法：
+#     python stub_server.py --cassette cassettes/rag.jsonl --latency recorded --port 8002
+#
+#     export OPENAI_BASE_URL=http://127.0.0.1:8002/v1 OPENAI_API_KEY=stub       # ChatOpenAI、OpenAI()
+#     export ZHIPUAI_BASE_URL=http://127.0.0.1:8002/api/paas/v4                # ZhipuAI()、ZhipuAIEmbeddings
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Union
+
+from cassette import (Cassette, CassetteMiss, chat_completion_response, embeddings_response, lognormal_latency,
+                      recorded_latency, token_latency)
+
+LATENCY_MODELS = {
+    'none': lambda args: None,
+    'recorded': lambda args: recorded_latency(args.scale),
+    'lognormal': lambda args: lognormal_latency(args.chat_median, args.embedding_median, seed=args.seed),
+    'token': lambda args: token_latency(),
+}
+
+
+def create_app(cassette: Cassette):
+    '''OpenAI（/v1）与智谱（/api/paas/v4）兼容的 chat/completions 与 embeddings 接口'''
+    from fastapi import FastAPI, HTTPException
+    from fastapi.responses import StreamingResponse
+    from pydantic import BaseModel as RequestModel
+
+    class ChatRequest(RequestModel):
+        model: str
+        messages: List[Dict[str, Any]]
+        stream: bool = False
+
+    class EmbeddingRequest(RequestModel):
+        model: str
+        input: Union[str, List[str]]
+
+    app = FastAPI()
+
+    def replay(kind: str, request: dict) -> dict:
+        try:
+            return cassette.call(kind, request, None)
+        except CassetteMiss as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    # 同步函数由 FastAPI 放到线程池执行，模拟延迟的 sleep 不会阻塞其他请求
+    def chat_completions(request: ChatRequest):
+        response = chat_completion_response(
+            request.model, replay('chat', {'model': request.model, 'messages': request.messages}))
+        if not request.stream:
+            return response
+        # 流式请求一次性返回完整内容，再发送结束标记
+        chunk = {**response, 'object': 'chat.completion.chunk',
+                 'choices': [{'index': 0, 'delta': response['choices'][0]['message'], 'finish_reason': 'stop'}]}
+        body = f'data: {json.dumps(chunk, ensure_ascii=False)}\n\ndata: [DONE]\n\n'
+        return StreamingResponse(iter([body]), media_type='text/event-stream')
+
+    def embeddings(request: EmbeddingRequest):
+        texts = [request.input] if isinstance(request.input, str) else request.input
+        vectors = [replay('embedding', {'model': request.model, 'input': text})['embedding']
+                   for text in texts]
+        return embeddings_response(request.model, vectors, sum(len(text) for text in texts))
+
+    for prefix in ('/v1', '/api/paas/v4'):
+        app.post(f'{prefix}/chat/completions')(chat_completions)
+        app.post(f'{prefix}/embeddings')(embeddings)
+
+    @app.get('/v1/models')
+    def models():
+        names = sorted({entry['request'].get('model') for entries in cassette._entries.values()
+                        for entry in entries})
+        return {'object': 'list', 'data': [{'id': name, 'object': 'model', 'created': int(time.time())}
+                                           for name in names]}
+
+    @app.get('/stats')
+    def stats():
+        return {**cassette.stats, 'entries': len(cassette)}
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='按 cassette 回放的 OpenAI / 智谱兼容桩服务')
+    parser.add_argument('--cassette', default='cassettes/rag.jsonl')
+    parser.add_argument('--latency', choices=list(LATENCY_MODELS), default='none')
+    parser.add_argument('--scale', type=float, default=1.0, help='recorded 延迟的缩放系数')
+    parser.add_argument('--chat-median', type=float, default=1.0, help='lognormal 延迟的 chat 中位数（秒）')
+    parser.add_argument('--embedding-median', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dim', type=int, default=1024, help='合成 embedding 的维度')
+    parser.add_argument('--no-synthetic', action='store_true', help='录制中没有的请求返回错误')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8002)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    cassette = Cassette(args.cassette, mode='replay', latency=LATENCY_MODELS[args.latency](args),
+                        synthetic=not args.no_synthetic, embedding_dim=args.dim)
+    print(f'已加载 {len(cassette)} 条录制')
+    uvicorn.run(create_app(cassette), host=args.host, port=args.port)
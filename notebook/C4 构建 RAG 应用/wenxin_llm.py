@@ -18,6 +18,12 @@ class Wenxin_LLM(LLM):
     secret_key : str = None
     # 系统消息
     system : str = None
+    # 限流器（rate_limiter.RateLimiter），为空时不限流
+    rate_limiter: Any = None
+    # 限流优先级，交互请求设为 rate_limiter.INTERACTIVE
+    priority: int = 1
+    # 限流时预估的输出 token 数
+    expected_output_tokens: int = 512
 
 
 
@@ -37,11 +43,20 @@ class Wenxin_LLM(LLM):
         chat_comp = qianfan.ChatCompletion(ak=self.api_key,sk=self.secret_key)
         message = gen_wenxin_messages(prompt)
 
+        if self.rate_limiter is not None:
+            from rate_limiter import estimate_tokens
+            estimated = estimate_tokens(prompt) + self.expected_output_tokens
+            self.rate_limiter.acquire(estimated, priority=self.priority)
+
         resp = chat_comp.do(messages = message, 
                             model= self.model,
                             temperature = self.temperature,
                             system = self.system)
 
+        usage = resp.body.get("usage")
+        if self.rate_limiter is not None and usage:
+            self.rate_limiter.record_usage(estimated, usage["total_tokens"])
+
         return resp["result"]
         
     # 首先定义一个返回默认参数的方法
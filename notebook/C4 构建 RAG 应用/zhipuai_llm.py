@@ -16,6 +16,12 @@ class ZhipuAILLM(LLM):
     temperature: float = 0.1
     # API_Key
     api_key: str = None
+    # 限流器（rate_limiter.RateLimiter），为空时不限流
+    rate_limiter: Any = None
+    # 限流优先级，交互请求设为 rate_limiter.INTERACTIVE
+    priority: int = 1
+    # 限流时预估的输出 token 数
+    expected_output_tokens: int = 512
     
     def _call(self, prompt : str, stop: Optional[List[str]] = None,
                 run_manager: Optional[CallbackManagerForLLMRun] = None,
@@ -35,11 +41,17 @@ class ZhipuAILLM(LLM):
             return messages
         
         messages = gen_glm_params(prompt)
+        if self.rate_limiter is not None:
+            from rate_limiter import estimate_tokens
+            estimated = estimate_tokens(prompt) + self.expected_output_tokens
+            self.rate_limiter.acquire(estimated, priority=self.priority)
         response = client.chat.completions.create(
             model = self.model,
             messages = messages,
             temperature = self.temperature
         )
+        if self.rate_limiter is not None and response.usage is not None:
+            self.rate_limiter.record_usage(estimated, response.usage.total_tokens)
 
         if len(response.choices) > 0:
             return response.choices[0].message.content
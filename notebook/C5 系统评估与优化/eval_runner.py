@@ -0,0 +1,400 @@
+'''
+并发、带缓存的生成评估
+
+1.如何评估 LLM 应用 / 2.评估并优化生成部分 中逐个问题调用 qa_chain({"query": ...})，再逐个调用大模型打分；
+改一次 Prompt 就要把所有问题重新生成、重新打分。EvalRunner 对一组问题：
+
+    1. 并发执行 检索 -> 生成 -> 大模型打分，每个问题一个任务，线程数可配置（限流交给 LLM 自带的 rate_limiter）；
+    2. 生成结果按 (问题, Prompt 模板, 模型, 检索上下文哈希) 缓存，打分结果按 (生成缓存键, 回答, 打分模板, 打分模型) 缓存，
+       缓存以 JSONL 追加写入磁盘，只修改一个模板时，其他模板与未变化的问题都直接命中缓存；
+    3. 有参考答案时同时计算 multi_select_score_v2 等基于参考答案的分数；
+    4. 输出逐题明细与各维度平均分的评估报告（JSON 与 CSV）。
+
+用法：
+    runner = EvalRunner(llm, vectordb.as_retriever(), judge_llm=judge_llm, cache_path='eval_cache.jsonl')
+    report = runner.run(questions, TEMPLATES['template_v2'], template_name='template_v2')
+    write_report(report, 'report_v2')
+'''
+
+import argparse
+import ast
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# estimate_tokens 位于 C3 的 rate_limiter
+sys.path.append('../C3 搭建知识库')
+
+# 2.评估并优化生成部分 中迭代的 Prompt 模板
+TEMPLATES: Dict[str, str] = {
+    'template_v1': """使用以下上下文来回答最后的问题。如果你不知道答案，就说你不知道，不要试图编造答
+案。最多使用三句话。尽量使答案简明扼要。总是在回答的最后说“谢谢你的提问！”。
+{context}
+问题: {question}
+""",
+    'template_v2': """使用以下上下文来回答最后的问题。如果你不知道答案，就说你不知道，不要试图编造答
+案。你应该使答案尽可能详细具体，但不要偏题。如果答案比较长，请酌情进行分段，以提高答案的阅读体验。
+{context}
+问题: {question}
+有用的回答:""",
+    'template_v3': """使用以下上下文来回答最后的问题。如果你不知道答案，就说你不知道，不要试图编造答
+案。你应该使答案尽可能详细具体，但不要偏题。如果答案比较长，请酌情进行分段，以提高答案的阅读体验。
+如果答案有几点，你应该分点标号回答，让答案清晰具体
+{context}
+问题: {question}
+有用的回答:""",
+    'template_v4': """使用以下上下文来回答最后的问题。如果你不知道答案，就说你不知道，不要试图编造答
+案。你应该使答案尽可能详细具体，但不要偏题。如果答案比较长，请酌情进行分段，以提高答案的阅读体验。
+如果答案有几点，你应该分点标号回答，让答案清晰具体。
+请你附上回答的来源原文，以保证回答的正确性。
+{context}
+问题: {question}
+有用的回答:""",
+}
+
+# 1.如何评估 LLM 应用 中的大模型打分 Prompt，依次填入 问题、回答、知识片段
+JUDGE_PROMPT = '''
+你是一个模型回答评估员。
+接下来，我将给你一个问题、对应的知识片段以及模型根据知识片段对问题的回答。
+请你依次评估以下维度模型回答的表现，分别给出打分：
+
+① 知识查找正确性。评估系统给定的知识片段是否能够对问题做出回答。如果知识片段不能做出回答，打分为0；如果知识片段可以做出回答，打分为1。
+
+② 回答一致性。评估系统的回答是否针对用户问题展开，是否有偏题、错误理解题意的情况，打分分值在0~1之间，0为完全偏题，1为完全切题。
+
+③ 回答幻觉比例。该维度需要综合系统回答与查找到的知识片段，评估系统的回答是否出现幻觉，打分分值在0~1之间,0为全部是模型幻觉，1为没有任何幻觉。
+
+④ 回答正确性。该维度评估系统回答是否正确，是否充分解答了用户问题，打分分值在0~1之间，0为完全不正确，1为完全正确。
+
+⑤ 逻辑性。该维度评估系统回答是否逻辑连贯，是否出现前后冲突、逻辑混乱的情况。打分分值在0~1之间，0为逻辑完全混乱，1为完全没有逻辑问题。
+
+⑥ 通顺性。该维度评估系统回答是否通顺、合乎语法。打分分值在0~1之间，0为语句完全不通顺，1为语句完全通顺没有任何语法问题。
+
+⑦ 智能性。该维度评估系统回答是否拟人化、智能化，是否能充分让用户混淆人工回答与智能回答。打分分值在0~1之间，0为非常明显的模型回答，1为与人工回答高度一致。
+
+你应该是比较严苛的评估员，很少给出满分的高评估。
+用户问题：
+```
+{}
+```
+待评估的回答：
+```
+{}
+```
+给定的知识片段：
+```
+{}
+```
+你应该返回给我一个可直接解析的 Python 字典，字典的键是如上维度，值是每一个维度对应的评估打分。
+不要输出任何其他内容。
+'''
+
+
+def multi_select_score_v2(true_answer: str, generate_answer: str) -> float:
+    '''1.如何评估 LLM 应用 中的多选题打分：选错 -1，不选 0，漏选 0.5，全对 1'''
+    true_answers = list(true_answer)
+    false_answers = [item for item in ['A', 'B', 'C', 'D'] if item not in true_answers]
+    if any(item in generate_answer for item in false_answers):
+        return -1
+    correct = sum(1 for item in true_answers if item in generate_answer)
+    if correct == 0:
+        return 0
+    return 1 if correct == len(true_answers) else 0.5
+
+
+def content_hash(*parts: str) -> str:
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8') + b'\x00')
+    return digest.hexdigest()
+
+
+def model_name(llm: Any) -> str:
+    '''取模型名作为缓存键的一部分：model_name / model / _llm_type'''
+    for attr in ('model_name', 'model'):
+        value = getattr(llm, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    return getattr(llm, '_llm_type', type(llm).__name__)
+
+
+def format_context(docs: Sequence[Document]) -> str:
+    '''与 RetrievalQA 的 stuff 链相同，各片段以空行拼接'''
+    return '\n\n'.join(doc.page_content for doc in docs)
+
+
+def call_llm(llm: Any, prompt: str) -> str:
+    '''兼容 LLM（返回 str）与 ChatModel（返回消息）'''
+    return call_llm_with_usage(llm, prompt)[0]
+
+
+def call_llm_with_usage(llm: Any, prompt: str) -> Tuple[str, int, int]:
+    '''
+    调用模型并返回 (回复, prompt token 数, 输出 token 数)
+
+    ChatModel 的消息带有 usage_metadata 或 response_metadata['token_usage'] 时使用服务端统计，
+    否则（如 ZhipuAILLM 这类只返回字符串的 LLM）用 estimate_tokens 估计.
+    '''
+    result = llm.invoke(prompt)
+    if isinstance(result, str):
+        text, usage = result, None
+    else:
+        text = result.content
+        usage = getattr(result, 'usage_metadata', None)
+        if usage:
+            usage = (usage.get('input_tokens'), usage.get('output_tokens'))
+        else:
+            token_usage = (getattr(result, 'response_metadata', None) or {}).get('token_usage') or {}
+            usage = (token_usage.get('prompt_tokens'), token_usage.get('completion_tokens'))
+    if not usage or usage[0] is None or usage[1] is None:
+        from rate_limiter import estimate_tokens
+        usage = (estimate_tokens(prompt), estimate_tokens(text))
+    return text, int(usage[0]), int(usage[1])
+
+
+def parse_judge(text: str) -> Dict[str, float]:
+    '''从打分回复中截取第一个 {...} 并解析为字典'''
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        raise ValueError(f'无法解析打分结果：{text[:100]}')
+    scores = ast.literal_eval(text[start:end + 1])
+    return {str(key): float(value) for key, value in scores.items()}
+
+
+class ResultCache():
+    '''键值缓存，追加写入 JSONL，多线程安全'''
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._data: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 上次写入中断时最后一行没有换行，下次追加前先补一个换行
+        self._torn = False
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    self._torn = not line.endswith('\n')
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断时写了一半的行
+                        continue
+                    self._data[record['key']] = record['value']
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._data[key] = value
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    if self._torn:
+                        f.write('\n')
+                        self._torn = False
+                    f.write(json.dumps({'key': key, 'value': value}, ensure_ascii=False) + '\n')
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class EvalRunner():
+    '''对一组问题并发执行 检索、生成、打分，生成与打分结果按内容缓存'''
+
+    def __init__(
+            self,
+            llm: Any,
+            retriever: Any,
+            judge_llm: Optional[Any] = None,
+            judge_prompt: str = JUDGE_PROMPT,
+            cache_path: Optional[str] = 'eval_cache.jsonl',
+            max_workers: int = 8,
+            scorers: Optional[Dict[str, Callable[[str, str], float]]] = None,
+    ):
+        '''
+        Args:
+            llm: 生成回答的模型，ZhipuAILLM、ChatOpenAI 等任意 LangChain 模型.
+            retriever: 检索器，如 vectordb.as_retriever().
+            judge_llm: 打分模型，为空时不做大模型打分.
+            judge_prompt (str): 打分 Prompt，依次以 format 填入 问题、回答、知识片段.
+            cache_path (str): 缓存文件，为空时只在内存中缓存.
+            max_workers (int): 并发处理的问题数.
+            scorers (dict): 名称 -> fn(参考答案, 回答)，问题带有 reference 时计算.
+        '''
+        self.llm = llm
+        self.retriever = retriever
+        self.judge_llm = judge_llm
+        self.judge_prompt = judge_prompt
+        self.cache = ResultCache(cache_path)
+        self.max_workers = max_workers
+        self.scorers = scorers or {}
+
+    def retrieve(self, question: str) -> List[Document]:
+        return self.retriever.invoke(question)
+
+    def generate(self, question: str, context: str, template: str, model: Optional[str] = None) -> dict:
+        '''按 (问题, 模板, 模型, 上下文哈希) 缓存的生成，返回 {answer, seconds, *_tokens, cached, key}'''
+        model = model or model_name(self.llm)
+        key = content_hash('generate', question, template, model, content_hash(context))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return {**cached, 'cached': True, 'key': key}
+        start_time = time.perf_counter()
+        answer, prompt_tokens, output_tokens = call_llm_with_usage(
+            self.llm, template.format(context=context, question=question))
+        value = {'answer': answer, 'seconds': time.perf_counter() - start_time,
+                 'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens}
+        self.cache.put(key, value)
+        return {**value, 'cached': False, 'key': key}
+
+    def judge(self, question: str, answer: str, context: str, generation_key: str) -> dict:
+        '''按 (生成缓存键, 回答, 打分模板, 打分模型) 缓存的大模型打分，返回 {scores, seconds, cached}'''
+        key = content_hash('judge', generation_key, answer, self.judge_prompt, model_name(self.judge_llm))
+        cached = self.cache.get(key)
+        if cached is None:
+            start_time = time.perf_counter()
+            raw = call_llm(self.judge_llm, self.judge_prompt.format(question, answer, context))
+            cached = {'raw': raw, 'seconds': time.perf_counter() - start_time}
+            # 解析失败的回复不写入缓存，下次重新打分
+            scores = parse_judge(raw)
+            self.cache.put(key, cached)
+            return {'scores': scores, 'seconds': cached['seconds'], 'cached': False}
+        return {'scores': parse_judge(cached['raw']), 'seconds': cached['seconds'], 'cached': True}
+
+    def evaluate_one(self, case: dict, template: str, template_name: str,
+                     docs: Optional[List[Document]] = None) -> dict:
+        '''
+        评估一个问题
+
+        Args:
+            case (dict): {question, reference（可选）}.
+            docs (List[Document]): 已检索的文档，为空时调用 retriever.
+        '''
+        question = case['question']
+        record = {'question': question, 'template': template_name, 'model': model_name(self.llm)}
+        try:
+            start_time = time.perf_counter()
+            if docs is None:
+                docs = self.retrieve(question)
+            record['retrieve_seconds'] = time.perf_counter() - start_time
+            context = format_context(docs)
+            record['context_hash'] = content_hash(context)[:12]
+            generation = self.generate(question, context, template, record['model'])
+            record.update(answer=generation['answer'], generate_seconds=generation['seconds'],
+                          prompt_tokens=generation.get('prompt_tokens'), output_tokens=generation.get('output_tokens'),
+                          generate_cached=generation['cached'])
+            if case.get('reference') is not None:
+                for name, scorer in self.scorers.items():
+                    record[name] = scorer(case['reference'], generation['answer'])
+            if self.judge_llm is not None:
+                judgement = self.judge(question, generation['answer'], context, generation['key'])
+                record.update(judgement['scores'])
+                record.update(judge_seconds=judgement['seconds'], judge_cached=judgement['cached'])
+        except Exception as e:
+            record['error'] = f'{type(e).__name__}: {e}'
+        return record
+
+    def run(self, cases: Sequence[dict], template: str, template_name: str = 'template') -> dict:
+        '''
+        并发评估全部问题
+
+        Returns:
+            dict: {records: 逐题明细（与 cases 顺序一致）, summary: 各数值列的平均分与缓存命中率}.
+        '''
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            records = list(executor.map(lambda case: self.evaluate_one(case, template, template_name), cases))
+        return {'records': records,
+                'summary': summarize(records, time.perf_counter() - start_time, self.cache.hit_rate)}
+
+
+def summarize(records: List[dict], seconds: float, cache_hit_rate: float) -> dict:
+    '''各数值列（打分维度、参考答案分数、耗时）的平均值'''
+    ok = [record for record in records if 'error' not in record]
+    values: Dict[str, List[float]] = {}
+    for record in ok:
+        for key, value in record.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                values.setdefault(key, []).append(value)
+    summary = {key: sum(column) / len(column) for key, column in values.items()}
+    summary.update(questions=len(records), errors=len(records) - len(ok), seconds=seconds,
+                   cache_hit_rate=cache_hit_rate)
+    return summary
+
+
+def write_report(report: dict, prefix: str):
+    '''写出 <prefix>.json（明细与汇总）与 <prefix>.csv（逐题明细）'''
+    with open(prefix + '.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    columns = []
+    for record in report['records']:
+        columns.extend(key for key in record if key not in columns)
+    with open(prefix + '.csv', 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(report['records'])
+
+
+def load_cases(path: str) -> List[dict]:
+    '''读取问题集：JSON 列表或 JSONL，每项为问题字符串或 {question, reference}'''
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+    cases = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'question': item}
+        elif 'question' not in item and 'query' in item:
+            # 兼容 generate_qa_pairs 生成的 {query, answer}
+            item = {'question': item['query'], 'reference': item.get('answer')}
+        cases.append(item)
+    return cases
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='并发、带缓存地评估生成部分')
+    parser.add_argument('--questions', required=True, help='问题集 JSON / JSONL')
+    parser.add_argument('--template', default='template_v2', choices=list(TEMPLATES))
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--judge-model', default='gpt-3.5-turbo')
+    parser.add_argument('--persist-directory', default='../../data_base/vector_db/chroma')
+    parser.add_argument('--cache', default='eval_cache.jsonl')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--output', default=None, help='报告文件前缀，默认为 report_<template>')
+    args = parser.parse_args()
+
+    from dotenv import find_dotenv, load_dotenv
+    from langchain.vectorstores.chroma import Chroma
+    from langchain_openai import ChatOpenAI
+    from zhipuai_embedding import ZhipuAIEmbeddings
+
+    _ = load_dotenv(find_dotenv())
+    vectordb = Chroma(persist_directory=args.persist_directory, embedding_function=ZhipuAIEmbeddings())
+    runner = EvalRunner(ChatOpenAI(model_name=args.model, temperature=0), vectordb.as_retriever(),
+                        judge_llm=ChatOpenAI(model_name=args.judge_model, temperature=0), cache_path=args.cache,
+                        max_workers=args.max_workers)
+    report = runner.run(load_cases(args.questions), TEMPLATES[args.template], args.template)
+    write_report(report, args.output or f'report_{args.template}')
+    print(json.dumps(report['summary'], ensure_ascii=False, indent=2))
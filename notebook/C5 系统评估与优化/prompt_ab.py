@@ -0,0 +1,141 @@
+'''
+共享检索结果的 Prompt 模板 A/B 对比
+
+2.评估并优化生成部分 中每换一个模板（template_v1 ~ template_v4）都要重建 RetrievalQA，并对同一批问题重新检索。
+这里每个问题只检索一次，同一份上下文并发分发给 N 个模板生成（与打分），逐模板并列记录：
+生成延迟 p50/p95、prompt token 数、输出 token 数与各维度得分。生成与打分沿用 EvalRunner 的缓存，
+只新增或修改一个模板时，其余模板全部命中缓存.
+
+用法：
+    runner = EvalRunner(llm, vectordb.as_retriever(), judge_llm=judge_llm)
+    report = run_ab(runner, load_cases('questions.json'), TEMPLATES)
+    print_comparison(report)
+    write_comparison(report, 'prompt_ab')
+
+    python prompt_ab.py --questions questions.json --templates template_v1 template_v2 template_v3
+'''
+
+import argparse
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from eval_runner import TEMPLATES, EvalRunner, load_cases, summarize, write_report
+
+
+def run_ab(runner: EvalRunner, cases: Sequence[dict], templates: Dict[str, str]) -> dict:
+    '''
+    每个问题检索一次，再把 (问题, 模板) 组合并发交给 runner 生成与打分
+
+    Returns:
+        dict: {records: 全部明细, retrieve_seconds: 检索总耗时, templates: 模板名 -> 汇总}.
+    '''
+    with ThreadPoolExecutor(max_workers=runner.max_workers) as executor:
+        start_time = time.perf_counter()
+        docs = list(executor.map(lambda case: runner.retrieve(case['question']), cases))
+        retrieve_seconds = time.perf_counter() - start_time
+
+        tasks = [(case, case_docs, name) for case, case_docs in zip(cases, docs) for name in templates]
+        start_time = time.perf_counter()
+        records = list(executor.map(
+            lambda task: runner.evaluate_one(task[0], templates[task[2]], task[2], docs=task[1]), tasks))
+        seconds = time.perf_counter() - start_time
+
+    by_template: Dict[str, List[dict]] = {name: [] for name in templates}
+    for record in records:
+        by_template[record['template']].append(record)
+    summaries = {}
+    for name, template_records in by_template.items():
+        summary = summarize(template_records, seconds, runner.cache.hit_rate)
+        latencies = [record['generate_seconds'] for record in template_records if 'generate_seconds' in record]
+        if latencies:
+            summary['generate_p50_ms'] = float(np.percentile(latencies, 50) * 1000)
+            summary['generate_p95_ms'] = float(np.percentile(latencies, 95) * 1000)
+        # 只取未命中缓存的生成，才是本次真正花费的 token
+        fresh = [record for record in template_records if record.get('generate_cached') is False]
+        summary['fresh_generations'] = len(fresh)
+        summary['fresh_prompt_tokens'] = sum(record.get('prompt_tokens') or 0 for record in fresh)
+        summary['fresh_output_tokens'] = sum(record.get('output_tokens') or 0 for record in fresh)
+        summaries[name] = summary
+    return {'records': records, 'retrieve_seconds': retrieve_seconds, 'templates': summaries}
+
+
+# 并列展示的指标：(汇总字段, 表头)
+COMPARE_COLUMNS = [
+    ('generate_p50_ms', 'p50 ms'),
+    ('generate_p95_ms', 'p95 ms'),
+    ('prompt_tokens', 'prompt tok'),
+    ('output_tokens', 'output tok'),
+    ('errors', 'errors'),
+]
+
+
+def _score_columns(report: dict) -> List[str]:
+    '''汇总中除耗时、token 与计数外的数值列，即打分维度与参考答案分数'''
+    skip = {key for key, _ in COMPARE_COLUMNS} | {
+        'retrieve_seconds', 'generate_seconds', 'judge_seconds', 'questions', 'seconds', 'cache_hit_rate',
+        'fresh_generations', 'fresh_prompt_tokens', 'fresh_output_tokens'}
+    columns = []
+    for summary in report['templates'].values():
+        columns.extend(key for key in summary if key not in skip and key not in columns)
+    return columns
+
+
+def print_comparison(report: dict):
+    '''每个模板一行，并列打印延迟、平均 token 数与各维度平均分'''
+    columns = COMPARE_COLUMNS + [(key, key) for key in _score_columns(report)]
+    print(f"{'template':<14}" + ''.join(f'{title:>12}' for _, title in columns))
+    for name, summary in report['templates'].items():
+        cells = []
+        for key, _ in columns:
+            value = summary.get(key)
+            cells.append(f'{"-":>12}' if value is None else f'{value:>12.2f}' if isinstance(value, float)
+                         else f'{value:>12}')
+        print(f'{name:<14}' + ''.join(cells))
+    print(f"检索 {report['retrieve_seconds']:.2f}s（每个问题一次，{len(report['templates'])} 个模板共享）")
+
+
+def write_comparison(report: dict, prefix: str):
+    '''写出 <prefix>.json、<prefix>.csv（逐条明细）与 <prefix>_summary.csv（每个模板一行）'''
+    write_report(report, prefix)
+    columns = []
+    for summary in report['templates'].values():
+        columns.extend(key for key in summary if key not in columns)
+    with open(prefix + '_summary.csv', 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['template'] + columns)
+        writer.writeheader()
+        for name, summary in report['templates'].items():
+            writer.writerow({'template': name, **summary})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='共享检索结果，对比多个 Prompt 模板')
+    parser.add_argument('--questions', required=True, help='问题集 JSON / JSONL')
+    parser.add_argument('--templates', nargs='+', default=list(TEMPLATES), choices=list(TEMPLATES))
+    parser.add_argument('--model', default='gpt-3.5-turbo')
+    parser.add_argument('--judge-model', default='gpt-3.5-turbo')
+    parser.add_argument('--no-judge', action='store_true')
+    parser.add_argument('--persist-directory', default='../../data_base/vector_db/chroma')
+    parser.add_argument('--cache', default='eval_cache.jsonl')
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--output', default='prompt_ab')
+    args = parser.parse_args()
+
+    from dotenv import find_dotenv, load_dotenv
+    from langchain.vectorstores.chroma import Chroma
+    from langchain_openai import ChatOpenAI
+    from zhipuai_embedding import ZhipuAIEmbeddings
+
+    _ = load_dotenv(find_dotenv())
+    vectordb = Chroma(persist_directory=args.persist_directory, embedding_function=ZhipuAIEmbeddings())
+    judge_llm = None if args.no_judge else ChatOpenAI(model_name=args.judge_model, temperature=0)
+    runner = EvalRunner(ChatOpenAI(model_name=args.model, temperature=0), vectordb.as_retriever(),
+                        judge_llm=judge_llm, cache_path=args.cache, max_workers=args.max_workers)
+    report = run_ab(runner, load_cases(args.questions), {name: TEMPLATES[name] for name in args.templates})
+    print_comparison(report)
+    write_comparison(report, args.output)
+    print(json.dumps(report['templates'], ensure_ascii=False, indent=2))
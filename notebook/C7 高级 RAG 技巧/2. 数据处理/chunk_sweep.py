@@ -0,0 +1,163 @@
+'''
+并行的分块策略网格搜索
+
+替代 附分块长度评估 中对每个 chunk_size 重建 Chroma、重新 embedding 全部文档块的做法：
+1. 在多个进程中并行按各配置切分文档；
+2. 各配置切出的文档块经 CachedEmbeddings 按内容哈希去重，相同的块只 embedding 一次；
+3. 在多个进程中并行构建各配置的向量矩阵并用 recall_eval 评估；
+4. 写出 chunksize_recall.csv 格式的召回率表及每个配置的耗时表。
+
+用法：
+    configs = grid(chunk_size=[200, 300, 400, 500], chunk_overlap=[0, 50])
+    results = run_sweep(configs, data_pages, qa_pairs.qa_pairs, embedding,
+                        cache_dir='embedding_cache', output_csv='chunksize_recall.csv',
+                        timing_csv='chunksize_timing.csv')
+
+配置为字典，splitter 取 'recursive'（默认）或 'character'，其余键作为参数传给对应的 TextSplitter。
+'''
+
+import csv
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings
+from recall_eval import KS, embed_queries, evaluate_retrieval, write_recall_csv
+
+# 配置名中参数的简写
+_ALIASES = {'chunk_size': 'chunk', 'chunk_overlap': 'overlap'}
+
+
+def grid(splitter: str = 'recursive', separators: Optional[List[str]] = None, **params: Sequence) -> List[dict]:
+    '''
+    由参数网格生成配置列表，配置名形如 chunk_200_overlap_50
+
+    例如 grid(chunk_size=[200, 300], chunk_overlap=[0, 50]) 生成 4 个配置。
+    '''
+    if separators is None and splitter == 'recursive':
+        separators = ['。', '，', '']
+    names = list(params)
+    configs = []
+    for values in itertools.product(*(params[name] for name in names)):
+        config = {'splitter': splitter, **dict(zip(names, values))}
+        if separators is not None:
+            config['separators'] = separators
+        config['name'] = '_'.join(f'{_ALIASES.get(name, name)}_{value}' for name, value in zip(names, values))
+        configs.append(config)
+    return configs
+
+
+def split_with_config(config: dict, pages: List[Document]) -> List[Document]:
+    '''按配置切分文档，在子进程中执行'''
+    params = {key: value for key, value in config.items() if key not in ('name', 'splitter')}
+    splitter = config.get('splitter', 'recursive')
+    if splitter == 'recursive':
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter(**params)
+    elif splitter == 'character':
+        from langchain_text_splitters.character import CharacterTextSplitter
+        text_splitter = CharacterTextSplitter(**params)
+    else:
+        raise ValueError(f'不支持的 splitter: {splitter}')
+    return text_splitter.split_documents(pages)
+
+
+def _timed_split(config: dict, pages: List[Document]):
+    start = time.perf_counter()
+    docs = split_with_config(config, pages)
+    return docs, time.perf_counter() - start
+
+
+def _timed_evaluate(qa_pairs, docs, doc_vectors, query_vectors, ks):
+    start = time.perf_counter()
+    scores = evaluate_retrieval(qa_pairs, docs, ks=ks, doc_vectors=doc_vectors,
+                                query_vectors=query_vectors)
+    return scores, time.perf_counter() - start
+
+
+def run_sweep(
+        configs: List[dict],
+        pages: List[Document],
+        qa_pairs: List[dict],
+        embedding: Embeddings,
+        ks: Sequence[int] = KS,
+        cache_dir: Optional[str] = None,
+        namespace: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        output_csv: Optional[str] = None,
+        timing_csv: Optional[str] = None,
+        min_query_len: int = 10,
+) -> Dict[str, dict]:
+    '''
+    对每个分块配置切分、embedding 并评估召回
+
+    Args:
+        configs (List[dict]): 分块配置，见 grid.
+        pages (List[Document]): 已清洗的文档页.
+        qa_pairs (List[dict]): 评估用问答对，格式同 train_dataset.json.
+        embedding (Embeddings): embedding 模型，会被 CachedEmbeddings 包装（已包装的直接使用）.
+        cache_dir (str): embedding 缓存目录，提供时跨次运行复用.
+        namespace (str): 缓存命名空间，通常填模型名；为空时取 embedding 的 model_name / model.
+        max_workers (int): 切分与评估的进程数，默认为 CPU 核数.
+        output_csv (str): 召回率表路径，格式同 chunksize_recall.csv.
+        timing_csv (str): 每个配置的块数与各阶段耗时.
+
+    Returns:
+        Dict[str, dict]: {配置名: {'scores': {'recall', 'mrr', 'ndcg'}, 'num_chunks', 各阶段耗时}}.
+    '''
+    if isinstance(embedding, CachedEmbeddings):
+        cache = embedding
+    else:
+        cache = CachedEmbeddings(embedding, cache_dir=cache_dir, namespace=namespace)
+    qa_pairs = [qa for qa in qa_pairs if len(qa['query']) > min_query_len]
+    query_vectors = embed_queries(cache.embedding, [qa['query'] for qa in qa_pairs])
+
+    results = {config['name']: {} for config in configs}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        split_futures = [executor.submit(_timed_split, config, pages) for config in configs]
+        splits = {}
+        for config, future in zip(configs, split_futures):
+            docs, seconds = future.result()
+            splits[config['name']] = docs
+            results[config['name']].update(num_chunks=len(docs), split_seconds=seconds)
+
+        # embedding 在主进程中按配置顺序进行，模型只加载一次；后面的配置只需计算新出现的块
+        rows = {}
+        for config in configs:
+            name = config['name']
+            misses = cache.misses
+            start = time.perf_counter()
+            rows[name] = cache.lookup([doc.page_content for doc in splits[name]])
+            results[name].update(embed_seconds=time.perf_counter() - start,
+                                 embedded_chunks=cache.misses - misses)
+        cache.save()
+
+        matrix = cache.matrix()
+        eval_futures = {
+            name: executor.submit(_timed_evaluate, qa_pairs, splits[name], matrix[rows[name]],
+                                  query_vectors, ks)
+            for name in rows
+        }
+        for name, future in eval_futures.items():
+            scores, seconds = future.result()
+            results[name].update(scores=scores, eval_seconds=seconds)
+
+    if output_csv is not None:
+        write_recall_csv(output_csv, {name: result['scores']['recall'] for name, result in results.items()}, ks)
+    if timing_csv is not None:
+        write_timing_csv(timing_csv, results)
+    return results
+
+
+def write_timing_csv(path: str, results: Dict[str, dict]):
+    '''写出每个配置的块数、新 embedding 的块数与各阶段耗时（秒）'''
+    columns = ['num_chunks', 'embedded_chunks', 'split_seconds', 'embed_seconds', 'eval_seconds']
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([''] + columns)
+        for name, result in results.items():
+            writer.writerow([name] + [result[column] for column in columns])
@@ -0,0 +1,236 @@
+'''
+向量模型基准测试：在知识库语料与 train_dataset.json 问答对上度量各候选模型的成本与效果
+
+每个候选模型在独立的子进程中运行（内存互不干扰），记录：
+    加载耗时、文档 embedding 吞吐（docs/s、chars/s）、单条查询延迟 p50/p95、
+    进程常驻内存增量与峰值增量、向量维度、float32 / int8 索引大小、recall/mrr/ndcg@k。
+结果追加写入 JSONL 结果文件，每条记录带 schema 版本、运行时间、git 版本与语料哈希，便于跨版本对比。
+
+用法：
+    python embedding_benchmark.py --models bge-small-zh m3e-base zhipuai-embedding-2
+    python embedding_benchmark.py --models local:BAAI/bge-small-zh-v1.5   # 经 embedding_server 推理
+'''
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from recall_eval import KS, embed_texts, evaluate_retrieval
+
+# 结果记录格式的版本，字段变化时递增
+SCHEMA_VERSION = 2
+
+C3_DIR = '../../C3 搭建知识库'
+KNOWLEDGE_DB = '../../../data_base/knowledge_db'
+
+
+def _huggingface(model_name: str) -> Callable[[], Embeddings]:
+    def factory() -> Embeddings:
+        from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name)
+    return factory
+
+
+def _zhipuai() -> Embeddings:
+    sys.path.append(C3_DIR)
+    from zhipuai_embedding import ZhipuAIEmbeddings
+    return ZhipuAIEmbeddings()
+
+
+# 候选模型：名称 -> 构造 Embeddings 的函数（在子进程中调用）
+CANDIDATES: Dict[str, Callable[[], Embeddings]] = {
+    'bge-small-zh': _huggingface('BAAI/bge-small-zh-v1.5'),
+    'bge-base-zh': _huggingface('BAAI/bge-base-zh-v1.5'),
+    'm3e-base': _huggingface('moka-ai/m3e-base'),
+    'zhipuai-embedding-2': _zhipuai,
+}
+
+
+def get_candidate(name: str) -> Embeddings:
+    '''按名称构造模型，local:<模型名> 表示使用 embedding_server 中的模型'''
+    if name.startswith('local:'):
+        from embedding_server import LocalServerEmbeddings
+        return LocalServerEmbeddings(model=name[len('local:'):])
+    return CANDIDATES[name]()
+
+
+def rss_mb() -> float:
+    '''当前进程的常驻内存（MB）'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    '''进程启动以来的峰值常驻内存（MB），Linux 上 ru_maxrss 以 KB 为单位，macOS 为字节'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile_ms(seconds: Sequence[float], q: float) -> float:
+    return float(np.percentile(np.asarray(seconds) * 1000, q)) if len(seconds) else 0.0
+
+
+def load_corpus(knowledge_db: str = KNOWLEDGE_DB, chunk_size: int = 300, chunk_overlap: int = 50,
+                max_workers: Optional[int] = None):
+    '''
+    与应用入库相同的语料：knowledge_db 下的全部文档经 parallel_loader 加载，PDF 用 pdf_cleaner、
+    其余用 markdown_cleaner 清洗后切分；南瓜书以外的文档没有 page，只作为召回评估中的干扰项
+    '''
+    sys.path.append(C3_DIR)
+    from offset_splitter import OffsetTextSplitter
+    from parallel_loader import ParallelLoader, get_file_paths
+    from text_cleaner import markdown_cleaner, pdf_cleaner
+
+    docs = ParallelLoader(get_file_paths(knowledge_db), max_workers=max_workers).load()
+    for doc in docs:
+        clean = pdf_cleaner if doc.metadata.get('source', '').endswith('.pdf') else markdown_cleaner
+        doc.page_content = clean(doc.page_content)
+    splitter = OffsetTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.split_documents(docs)
+
+
+def benchmark_model(name: str, docs: list, qa_pairs: List[dict], ks: Sequence[int] = KS,
+                    batch_size: int = 64, min_query_len: int = 10) -> dict:
+    '''在当前进程中测试一个模型，返回指标'''
+    baseline = rss_mb()
+    start_time = time.perf_counter()
+    embedding = get_candidate(name)
+    load_seconds = time.perf_counter() - start_time
+    loaded = rss_mb()
+
+    texts = [doc.page_content for doc in docs]
+    start_time = time.perf_counter()
+    doc_vectors = embed_texts(embedding, texts, batch_size=batch_size)
+    embed_seconds = time.perf_counter() - start_time
+
+    # 查询逐条 embedding，与线上问答一致；向量同时用于召回评估
+    qa_pairs = [qa for qa in qa_pairs if len(qa['query']) > min_query_len]
+    latencies, query_vectors = [], []
+    for qa in qa_pairs:
+        start_time = time.perf_counter()
+        query_vectors.append(embedding.embed_query(qa['query']))
+        latencies.append(time.perf_counter() - start_time)
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+    # 每个模型在新启动的子进程中运行，进程级的 ru_maxrss 即本模型加载与 embedding 期间的峰值
+    peak = peak_rss_mb()
+
+    scores = evaluate_retrieval(qa_pairs, docs, ks=ks, doc_vectors=doc_vectors, query_vectors=query_vectors,
+                                metric='cosine', min_query_len=min_query_len)
+    dim = int(doc_vectors.shape[1])
+    return {
+        'model': name,
+        'num_docs': len(texts),
+        'num_queries': len(qa_pairs),
+        'dim': dim,
+        'load_seconds': load_seconds,
+        'embed_seconds': embed_seconds,
+        'docs_per_second': len(texts) / embed_seconds,
+        'chars_per_second': sum(len(text) for text in texts) / embed_seconds,
+        'query_p50_ms': percentile_ms(latencies, 50),
+        'query_p95_ms': percentile_ms(latencies, 95),
+        'model_rss_mb': loaded - baseline,
+        'peak_rss_mb': peak - baseline,
+        'index_float32_mb': len(texts) * dim * 4 / 1e6,
+        'index_int8_mb': len(texts) * (dim + 4) / 1e6,
+        'ks': list(ks),
+        **{f'{metric}@k': values for metric, values in scores.items()},
+    }
+
+
+def _run_in_process(args):
+    return benchmark_model(*args)
+
+
+def run_context(docs: list) -> dict:
+    '''运行环境与语料信息，写入每条结果记录'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    corpus = hashlib.sha1('\x00'.join(doc.page_content for doc in docs).encode('utf-8')).hexdigest()[:12]
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'corpus_hash': corpus,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+def run_benchmark(models: Sequence[str], docs: list, qa_pairs: List[dict], ks: Sequence[int] = KS,
+                  batch_size: int = 64, output: Optional[str] = 'embedding_benchmark.jsonl') -> List[dict]:
+    '''
+    依次在独立子进程中测试各模型，结果追加写入 output
+
+    Returns:
+        List[dict]: 每个模型一条记录，失败的模型记录 error 字段.
+    '''
+    context = run_context(docs)
+    results = []
+    # spawn：每个模型从干净的进程开始，内存统计不受之前模型影响
+    ctx = multiprocessing.get_context('spawn')
+    for name in models:
+        with ctx.Pool(1) as pool:
+            try:
+                record = pool.apply(_run_in_process, ((name, docs, qa_pairs, ks, batch_size),))
+            except Exception as e:
+                record = {'model': name, 'error': f'{type(e).__name__}: {e}'}
+        record = {**context, **record}
+        results.append(record)
+        if output:
+            with open(output, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return results
+
+
+def print_table(results: List[dict]):
+    # (字段, 宽度, 数值格式)
+    columns = [('model', -24, ''), ('dim', 5, ''), ('docs_per_second', 16, '.1f'), ('query_p50_ms', 13, '.1f'),
+               ('query_p95_ms', 13, '.1f'), ('peak_rss_mb', 12, '.0f'), ('index_float32_mb', 17, '.2f')]
+    align = lambda width: f'<{-width}' if width < 0 else f'>{width}'
+    print(' '.join(f'{name:{align(width)}}' for name, width, _ in columns), ' recall@k')
+    for record in results:
+        if 'error' in record:
+            print(f"{record['model']:<24} {record['error']}")
+            continue
+        row = ' '.join(f'{record[name]:{align(width)}{fmt}}' for name, width, fmt in columns)
+        print(row, ' '.join(f'{value:.3f}' for value in record['recall@k']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='向量模型 CPU 吞吐、延迟、内存与召回率基准测试')
+    parser.add_argument('--models', nargs='+', default=['bge-small-zh', 'm3e-base'])
+    parser.add_argument('--knowledge-db', default=KNOWLEDGE_DB)
+    parser.add_argument('--qa', default='train_dataset.json')
+    parser.add_argument('--chunk-size', type=int, default=300)
+    parser.add_argument('--chunk-overlap', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--output', default='embedding_benchmark.jsonl')
+    args = parser.parse_args()
+
+    docs = load_corpus(args.knowledge_db, args.chunk_size, args.chunk_overlap)
+    with open(args.qa, encoding='utf-8') as f:
+        qa_pairs = json.load(f)
+    print_table(run_benchmark(args.models, docs, qa_pairs, batch_size=args.batch_size, output=args.output))
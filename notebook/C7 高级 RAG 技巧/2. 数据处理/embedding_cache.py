@@ -0,0 +1,136 @@
+'''
+按内容哈希缓存 embedding
+
+CachedEmbeddings 包装任意 LangChain Embeddings：相同文本（按 模型名 + 文本 的哈希）只 embedding 一次，
+结果可持久化到磁盘，跨配置、跨实验复用。
+
+用法：
+    embedding = CachedEmbeddings(HuggingFaceEmbeddings(model_name='BAAI/bge-small-zh-v1.5'),
+                                 cache_dir='embedding_cache', namespace='bge-small-zh-v1.5')
+    vectordb = Chroma.from_documents(split_docs, embedding)
+    embedding.save()
+'''
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str, namespace: str = '') -> str:
+    return hashlib.sha1((namespace + '\x00' + text).encode('utf-8')).hexdigest()
+
+
+def model_namespace(embedding: Embeddings) -> str:
+    '''从被包装的模型上取模型名（model_name 或 model 字段）作为缓存命名空间，取不到时报错'''
+    for attr in ('model_name', 'model'):
+        name = getattr(embedding, attr, None)
+        if isinstance(name, str) and name:
+            return name
+    raise ValueError(f'无法从 {type(embedding).__name__} 推断模型名，请显式传入 namespace，'
+                     '否则不同模型的向量会写进同一个缓存')
+
+
+class CachedEmbeddings(Embeddings):
+    '''带内容哈希缓存的 Embeddings'''
+
+    def __init__(
+            self,
+            embedding: Embeddings,
+            cache_dir: Optional[str] = None,
+            namespace: Optional[str] = None,
+            batch_size: int = 256,
+    ):
+        '''
+        Args:
+            embedding (Embeddings): 实际计算 embedding 的模型.
+            cache_dir (str): 持久化目录，为空时只在内存中缓存.
+            namespace (str): 区分不同模型的缓存，通常填模型名；为空时取 embedding 的 model_name / model.
+            batch_size (int): 未命中的文本按该大小分批 embedding.
+        '''
+        self.embedding = embedding
+        self.cache_dir = cache_dir
+        self.namespace = namespace or model_namespace(embedding)
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._index: Dict[str, int] = {}
+        self._vectors: List[np.ndarray] = []
+        self._saved = 0
+        if cache_dir is not None:
+            self._load()
+
+    def _paths(self):
+        name = self.namespace.replace('/', '_')
+        return (os.path.join(self.cache_dir, f'{name}.keys.json'),
+                os.path.join(self.cache_dir, f'{name}.npy'))
+
+    def _load(self):
+        keys_path, vectors_path = self._paths()
+        if not (os.path.exists(keys_path) and os.path.exists(vectors_path)):
+            return
+        with open(keys_path, encoding='utf-8') as f:
+            keys = json.load(f)
+        vectors = np.load(vectors_path)
+        self._index = {key: i for i, key in enumerate(keys)}
+        self._vectors = list(vectors)
+        self._saved = len(keys)
+
+    def save(self):
+        '''把缓存写入 cache_dir，没有新增向量时跳过'''
+        if self.cache_dir is None or self._saved == len(self._vectors):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        keys_path, vectors_path = self._paths()
+        keys = sorted(self._index, key=self._index.get)
+        np.save(vectors_path, self.matrix())
+        with open(keys_path, 'w', encoding='utf-8') as f:
+            json.dump(keys, f)
+        self._saved = len(keys)
+
+    def matrix(self) -> np.ndarray:
+        '''全部缓存向量组成的 float32 矩阵，行号与 lookup 返回的下标一致'''
+        if not self._vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(self._vectors).astype(np.float32, copy=False)
+
+    def lookup(self, texts: List[str]) -> np.ndarray:
+        '''
+        返回 texts 在缓存矩阵中的行号，未命中的文本先去重再分批 embedding
+
+        多个配置共享同一批文本时，用 matrix()[lookup(texts)] 即可取出向量而不重复计算。
+        '''
+        keys = [text_hash(text, self.namespace) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self._index or key in missing:
+                self.hits += 1
+            else:
+                self.misses += 1
+                missing[key] = text
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start:start + self.batch_size]
+            vectors = self.embedding.embed_documents([missing[key] for key in batch_keys])
+            for key, vector in zip(batch_keys, vectors):
+                self._index[key] = len(self._vectors)
+                self._vectors.append(np.asarray(vector, dtype=np.float32))
+        return np.array([self._index[key] for key in keys], dtype=np.int64)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        rows = self.lookup(texts)
+        return [self._vectors[row].tolist() for row in rows]
+
+    def embed_query(self, text: str) -> List[float]:
+        # 查询不经过缓存：部分模型（如 bge）对查询与文档使用不同的指令前缀
+        return self.embedding.embed_query(text)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,366 @@
+'''
+本地 embedding 模型的 CPU 推理服务
+
+每个模型只在服务进程中加载一次，notebook、Streamlit 等所有使用方通过 HTTP 共享：
+
+    1. DynamicBatcher 把并发请求在 max_wait_ms 内攒成一批，按长度排序后分桶推理，减少 padding；
+    2. 可选把模型导出为 ONNX 并做 int8 动态量化，用 onnxruntime 推理（rapidocr 已依赖 onnxruntime）；
+    3. 推理线程数固定，并可绑定到指定 CPU 核，避免多个进程、多个线程池互相争抢.
+
+接口与 OpenAI 的 /v1/embeddings 相同，LocalServerEmbeddings 为对应的 LangChain Embeddings.
+
+启动：
+    python embedding_server.py --models BAAI/bge-small-zh-v1.5 moka-ai/m3e-base --backend onnx --quantize --threads 4
+使用：
+    embedding = LocalServerEmbeddings(model='BAAI/bge-small-zh-v1.5')
+    vectordb = Chroma.from_documents(split_docs, embedding)
+'''
+
+import argparse
+import asyncio
+import os
+import queue
+import threading
+import time
+import warnings
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+from langchain_core.embeddings import Embeddings
+from langchain_core.pydantic_v1 import BaseModel
+
+# 模型的池化方式与是否归一化，与其 sentence-transformers 配置一致；未列出的模型默认 mean、不归一化
+POOLING: Dict[str, Tuple[str, bool]] = {
+    'BAAI/bge-small-zh-v1.5': ('cls', True),
+    'BAAI/bge-base-zh-v1.5': ('cls', True),
+    'moka-ai/m3e-base': ('mean', False),
+}
+
+
+def pin_threads(threads: int, cores: Optional[Sequence[int]] = None):
+    '''
+    固定推理线程数并绑定 CPU 核，需要在加载模型之前调用
+
+    环境变量只对之后才加载的库（torch 等）生效；numpy 已在模块顶部导入，
+    其 BLAS 线程池通过 threadpoolctl 在运行时限制.
+
+    Args:
+        threads (int): 每个模型推理使用的线程数.
+        cores (Sequence[int]): 进程绑定的 CPU 核编号，为空时不绑定（仅 Linux 支持绑定）.
+    '''
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except ImportError:
+        warnings.warn('未安装 threadpoolctl，numpy 的 BLAS 线程数不受限制：pip install threadpoolctl')
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, set(cores))
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+class TorchEncoder():
+    '''sentence-transformers 推理'''
+
+    def __init__(self, model_name: str, max_length: int = 512):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.model.max_seq_length = max_length
+        # 直接调用模型前向（与 SentenceTransformer.encode 相同的模块链），需要先切换到推理模式
+        self.model.eval()
+
+    def encode(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        '''返回 (向量矩阵, 每条文本截断后的 token 数)，token 数取自推理时的 attention mask'''
+        import torch
+
+        features = self.model.tokenize(texts)
+        with torch.no_grad():
+            output = self.model(features)
+        return (output['sentence_embedding'].float().numpy(),
+                features['attention_mask'].sum(dim=1).numpy())
+
+
+def onnx_dir(model_name: str, root: str = 'onnx_models') -> str:
+    return os.path.join(root, model_name.replace('/', '_'))
+
+
+def export_onnx(model_name: str, output_dir: Optional[str] = None, quantize: bool = False) -> str:
+    '''
+    把 Hugging Face 模型导出为 ONNX，quantize 为 True 时再做 int8 动态量化，已导出时直接返回
+
+    Returns:
+        str: onnx 文件路径，目录中同时保存 tokenizer.
+    '''
+    output_dir = output_dir or onnx_dir(model_name)
+    fp32_path = os.path.join(output_dir, 'model.onnx')
+    int8_path = os.path.join(output_dir, 'model.int8.onnx')
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        os.makedirs(output_dir, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name).eval()
+        inputs = dict(tokenizer(['导出示例文本'], return_tensors='pt'))
+        names = list(inputs)
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (inputs,), fp32_path,
+                input_names=names,
+                output_names=['last_hidden_state'],
+                dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in names + ['last_hidden_state']},
+                opset_version=14,
+            )
+        tokenizer.save_pretrained(output_dir)
+    if not quantize:
+        return fp32_path
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+class OnnxEncoder():
+    '''onnxruntime 推理，池化方式见 POOLING'''
+
+    def __init__(self, model_name: str, quantize: bool = False, threads: Optional[int] = None,
+                 max_length: int = 512):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(model_name, quantize=quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(path))
+        self.pooling, self.normalize = POOLING.get(model_name, ('mean', False))
+        self.max_length = max_length
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [item.name for item in self.session.get_inputs()]
+
+    def encode(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        '''返回 (向量矩阵, 每条文本截断后的 token 数)，token 数取自推理时的 attention mask'''
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                return_tensors='np')
+        hidden = self.session.run(None, {name: tokens[name].astype(np.int64) for name in self.input_names})[0]
+        if self.pooling == 'cls':
+            vectors = hidden[:, 0]
+        else:
+            mask = tokens['attention_mask'][..., None].astype(np.float32)
+            vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.astype(np.float32), tokens['attention_mask'].sum(axis=1)
+
+
+def load_encoder(model_name: str, backend: str = 'torch', quantize: bool = False,
+                 threads: Optional[int] = None, max_length: int = 512):
+    if backend == 'onnx':
+        return OnnxEncoder(model_name, quantize, threads, max_length)
+    if backend == 'torch':
+        return TorchEncoder(model_name, max_length)
+    raise ValueError(f'不支持的推理后端：{backend}')
+
+
+class DynamicBatcher():
+    '''
+    动态批处理
+
+    请求进入队列后由单个推理线程处理：取到第一个请求后最多再等待 max_wait_ms 收集其他请求，
+    把所有文本按长度排序，每 max_batch_size 条为一批推理（长度相近的文本在同一批，padding 最少），
+    再按原顺序把向量与 token 数分发回各请求.
+    '''
+
+    def __init__(self, encoder: Any, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = {'requests': 0, 'texts': 0, 'batches': 0, 'seconds': 0.0}
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        '''提交一组文本，返回结果为 ((len(texts), 维度) 矩阵, 每条文本的 token 数) 的 Future'''
+        future: Future = Future()
+        if not texts:
+            future.set_result((np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64)))
+        else:
+            self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.submit(texts).result()[0]
+
+    def _collect(self) -> List[Tuple[List[str], Future]]:
+        '''收集一批请求；已被取消的请求（如客户端断开）直接丢弃，其余的 Future 置为运行中，之后不能再被取消'''
+        requests_ = []
+        n_texts = 0
+        deadline = None
+        while n_texts < self.max_batch_size:
+            if deadline is None:
+                request = self._queue.get()
+            else:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if not request[1].set_running_or_notify_cancel():
+                continue
+            if deadline is None:
+                deadline = time.perf_counter() + self.max_wait
+            requests_.append(request)
+            n_texts += len(request[0])
+        return requests_
+
+    def _run(self):
+        while True:
+            requests_ = self._collect()
+            texts = [text for request_texts, _ in requests_ for text in request_texts]
+            start_time = time.perf_counter()
+            try:
+                order = np.argsort([len(text) for text in texts], kind='stable')
+                vectors = None
+                n_tokens = np.empty(len(texts), dtype=np.int64)
+                for start in range(0, len(texts), self.max_batch_size):
+                    rows = order[start:start + self.max_batch_size]
+                    batch, batch_tokens = self.encoder.encode([texts[i] for i in rows])
+                    if vectors is None:
+                        vectors = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+                    vectors[rows] = batch
+                    n_tokens[rows] = batch_tokens
+            except Exception as e:
+                for _, future in requests_:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for request_texts, future in requests_:
+                future.set_result((vectors[offset:offset + len(request_texts)],
+                                   n_tokens[offset:offset + len(request_texts)]))
+                offset += len(request_texts)
+            self.stats['requests'] += len(requests_)
+            self.stats['texts'] += len(texts)
+            self.stats['batches'] += (len(texts) + self.max_batch_size - 1) // self.max_batch_size
+            self.stats['seconds'] += time.perf_counter() - start_time
+
+
+def create_app(batchers: Dict[str, DynamicBatcher]):
+    '''OpenAI 兼容的 /v1/embeddings 接口'''
+    from typing import Union
+
+    from fastapi import FastAPI, HTTPException
+    from pydantic import BaseModel as RequestModel
+
+    class EmbeddingRequest(RequestModel):
+        input: Union[str, List[str]]
+        model: str
+
+    app = FastAPI()
+
+    @app.post('/v1/embeddings')
+    async def embeddings(request: EmbeddingRequest):
+        batcher = batchers.get(request.model)
+        if batcher is None:
+            raise HTTPException(status_code=404, detail=f'未加载模型：{request.model}')
+        texts = [request.input] if isinstance(request.input, str) else request.input
+        vectors, token_counts = await asyncio.wrap_future(batcher.submit(texts))
+        n_tokens = int(token_counts.sum())
+        return {
+            'object': 'list',
+            'model': request.model,
+            'data': [{'object': 'embedding', 'index': i, 'embedding': vector.tolist()}
+                     for i, vector in enumerate(vectors)],
+            'usage': {'prompt_tokens': n_tokens, 'total_tokens': n_tokens},
+        }
+
+    @app.get('/v1/models')
+    async def models():
+        return {'object': 'list', 'data': [{'id': name, 'object': 'model'} for name in batchers]}
+
+    @app.get('/stats')
+    async def stats():
+        return {name: batcher.stats for name, batcher in batchers.items()}
+
+    return app
+
+
+class LocalServerEmbeddings(BaseModel, Embeddings):
+    '''本地 embedding 服务的 LangChain 封装'''
+
+    base_url: str = 'http://127.0.0.1:8001/v1'
+    model: str = 'BAAI/bge-small-zh-v1.5'
+    # 每次请求的文本数，服务端会再与其他请求合批
+    batch_size: int = 256
+    timeout: float = 120.0
+    # 查询前缀，如 bge 的 '为这个句子生成表示以用于检索相关文章：'；为空时与文档相同处理
+    query_instruction: str = ''
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        response = requests.post(f'{self.base_url}/embeddings', json={'input': texts, 'model': self.model},
+                                 timeout=self.timeout)
+        response.raise_for_status()
+        data = sorted(response.json()['data'], key=lambda item: item['index'])
+        return [item['embedding'] for item in data]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([self.query_instruction + text])[0]
+
+
+def parse_cores(value: Optional[str]) -> Optional[List[int]]:
+    '''把 "0-3,6" 解析为 [0, 1, 2, 3, 6]'''
+    if not value:
+        return None
+    cores = []
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cores.extend(range(int(first), int(last) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地 embedding 模型推理服务')
+    parser.add_argument('--models', nargs='+', default=['BAAI/bge-small-zh-v1.5'])
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--quantize', action='store_true', help='ONNX 模型做 int8 动态量化')
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--cores', default=None, help='绑定的 CPU 核，如 0-3')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    args = parser.parse_args()
+
+    pin_threads(args.threads, parse_cores(args.cores))
+    batchers = {
+        name: DynamicBatcher(load_encoder(name, args.backend, args.quantize, args.threads),
+                             args.max_batch_size, args.max_wait_ms)
+        for name in args.models
+    }
+
+    import uvicorn
+
+    uvicorn.run(create_app(batchers), host=args.host, port=args.port)
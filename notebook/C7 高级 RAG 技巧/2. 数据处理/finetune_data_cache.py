@@ -0,0 +1,344 @@
+'''
+预分词、按长度分桶的向量模型微调数据管道
+
+4.微调向量模型 中 model.fit 每个 epoch 都会在 smart_batching_collate 里重新分词，并把每批补齐到批内最长；
+在只有 CPU 的机器上，分词与补齐出来的 padding 都是白白消耗的计算。这里：
+
+    1. 所有文本只分词一次，token id 连续写入 memmap 文件，另存每条样本各列的 (起点, 长度)；
+       缓存按 分词器 + max_seq_length + 数据内容 的哈希命名，重复运行直接打开，不再预处理；
+    2. LengthBucketBatchSampler 先打乱，再在每 bucket_size 个批次的范围内按长度排序切批，
+       同一批的样本长度接近，补齐的 padding 很少，同时保留批次间的随机性；
+    3. DataLoader 使用多个 worker 读取 memmap、补齐并构造张量；
+    4. train 复刻 model.fit 的训练循环（AdamW + 线性 warmup），接收已分词的批次，并报告每个 epoch 的 examples/s。
+
+用法：
+    cache = TokenizedCache.build(model, texts=[question1, question2], labels=labels, cache_dir='finetune_cache')
+    train(model, cache, losses.ContrastiveLoss(model=model), epochs=10, batch_size=32, num_workers=4,
+          evaluator=evaluator, output_path='./medical_bge_small')
+
+    python finetune_data_cache.py --epochs 1 --num-workers 4
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+# 缓存格式的版本，格式变化时递增
+CACHE_VERSION = 1
+
+
+def _cache_key(name: str, max_seq_length: int, texts: Sequence[Sequence[str]], labels: Optional[Sequence]) -> str:
+    digest = hashlib.sha1(f'{CACHE_VERSION}\x00{name}\x00{max_seq_length}'.encode('utf-8'))
+    for column in texts:
+        for text in column:
+            digest.update(text.encode('utf-8') + b'\x00')
+        digest.update(b'\x01')
+    if labels is not None:
+        digest.update(np.asarray(labels).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class TokenizedCache(Dataset):
+    '''
+    memmap 中的预分词数据集
+
+    目录结构：tokens.bin（全部 token id，int32）、offsets.npy（(样本数, 列数, 2)，各列的起点与长度）、
+    labels.npy、meta.json. 第 i 条样本为各列的 token id 数组与标签.
+    '''
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.labels = np.load(os.path.join(path, 'labels.npy'))
+        # 每条样本的长度取各列中最长的一列，用于分桶
+        self.lengths = self.offsets[:, :, 1].max(axis=1)
+        self._tokens = None
+
+    @property
+    def tokens(self) -> np.memmap:
+        # 延迟打开：DataLoader 的每个 worker 各自映射文件
+        if self._tokens is None:
+            self._tokens = np.memmap(os.path.join(self.path, 'tokens.bin'), dtype=np.int32, mode='r',
+                                     shape=(self.meta['num_tokens'],))
+        return self._tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tokens'] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> Tuple[List[np.ndarray], float]:
+        tokens = self.tokens
+        return [tokens[start:start + length] for start, length in self.offsets[index]], self.labels[index]
+
+    @classmethod
+    def build(
+            cls,
+            model,
+            texts: Sequence[Sequence[str]],
+            labels: Optional[Sequence] = None,
+            cache_dir: str = 'finetune_cache',
+            batch_size: int = 1024,
+    ) -> 'TokenizedCache':
+        '''
+        分词并写入缓存；相同 模型、max_seq_length 与数据的缓存已存在时直接打开
+
+        Args:
+            model (SentenceTransformer): 使用其 tokenizer 与 max_seq_length.
+            texts (Sequence[Sequence[str]]): 按列组织的文本，如 [question1 列表, question2 列表]
+                或 [anchor 列表, positive 列表, negative 列表].
+            labels (Sequence): 每条样本的标签，为空时全为 0（与 InputExample 默认值相同）.
+            cache_dir (str): 缓存根目录.
+            batch_size (int): 每次调用分词器的文本数.
+        '''
+        n = len(texts[0])
+        if any(len(column) != n for column in texts):
+            raise ValueError('各列的样本数不一致')
+        tokenizer = model.tokenizer
+        max_seq_length = model.max_seq_length
+        name = getattr(tokenizer, 'name_or_path', type(tokenizer).__name__)
+        path = os.path.join(cache_dir, _cache_key(name, max_seq_length, texts, labels))
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            return cls(path)
+
+        # 与 sentence_transformers 的 Transformer.tokenize 一致：按需小写、去除首尾空白
+        do_lower_case = getattr(model._first_module(), 'do_lower_case', False)
+        os.makedirs(path, exist_ok=True)
+        offsets = np.zeros((n, len(texts), 2), dtype=np.int64)
+        position = 0
+        tmp_path = os.path.join(path, 'tokens.bin.tmp')
+        with open(tmp_path, 'wb') as f:
+            for start in range(0, n, batch_size):
+                for column, column_texts in enumerate(texts):
+                    batch = [str(text).strip() for text in column_texts[start:start + batch_size]]
+                    if do_lower_case:
+                        batch = [text.lower() for text in batch]
+                    input_ids = tokenizer(batch, truncation=True, max_length=max_seq_length,
+                                          return_attention_mask=False, return_token_type_ids=False)['input_ids']
+                    for i, ids in enumerate(input_ids):
+                        offsets[start + i, column] = (position, len(ids))
+                        position += len(ids)
+                    f.write(np.concatenate([np.asarray(ids, dtype=np.int32) for ids in input_ids]).tobytes())
+        os.replace(tmp_path, os.path.join(path, 'tokens.bin'))
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        np.save(os.path.join(path, 'labels.npy'),
+                np.zeros(n, dtype=np.float32) if labels is None else np.asarray(labels))
+        meta = {
+            'version': CACHE_VERSION,
+            'tokenizer': name,
+            'max_seq_length': max_seq_length,
+            'pad_token_id': tokenizer.pad_token_id or 0,
+            'num_examples': n,
+            'num_columns': len(texts),
+            'num_tokens': position,
+        }
+        # meta.json 最后写入，作为缓存完整的标志
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return cls(path)
+
+
+class LengthBucketBatchSampler(Sampler):
+    '''
+    按长度分桶的批采样器
+
+    每个 epoch 先打乱全部样本，再每 batch_size * bucket_size 条一组按长度排序后切成批，最后打乱批的顺序.
+    bucket_size 越大 padding 越少，但批内样本越相似；
+    对 MultipleNegativesRankingLoss 这类批内负例损失，批内样本长度接近会让负例略难一些.
+    '''
+
+    def __init__(self, lengths: np.ndarray, batch_size: int, bucket_size: int = 50, shuffle: bool = True,
+                 drop_last: bool = False, seed: int = 42):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        group = self.batch_size * self.bucket_size
+        batches = []
+        for start in range(0, len(indices), group):
+            chunk = indices[start:start + group]
+            chunk = chunk[np.argsort(self.lengths[chunk], kind='stable')]
+            for i in range(0, len(chunk), self.batch_size):
+                batches.append(chunk[i:i + self.batch_size].tolist())
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            rng.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+class PadCollator():
+    '''把一批预分词样本补齐为 sentence_transformers 损失函数接收的 (各列 features, labels)'''
+
+    def __init__(self, pad_token_id: int = 0):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, batch: List[Tuple[List[np.ndarray], float]]) -> Tuple[List[Dict[str, torch.Tensor]],
+                                                                               torch.Tensor]:
+        features = []
+        for column in range(len(batch[0][0])):
+            sequences = [example[0][column] for example in batch]
+            width = max(len(ids) for ids in sequences)
+            input_ids = np.full((len(batch), width), self.pad_token_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for i, ids in enumerate(sequences):
+                input_ids[i, :len(ids)] = ids
+                attention_mask[i, :len(ids)] = 1
+            features.append({
+                'input_ids': torch.from_numpy(input_ids),
+                'token_type_ids': torch.zeros_like(torch.from_numpy(input_ids)),
+                'attention_mask': torch.from_numpy(attention_mask),
+            })
+        labels = torch.tensor(np.asarray([example[1] for example in batch]))
+        return features, labels
+
+
+def make_dataloader(cache: TokenizedCache, batch_size: int = 32, num_workers: int = 0, bucket_size: int = 50,
+                    shuffle: bool = True, seed: int = 42) -> DataLoader:
+    '''分桶采样、多 worker 读取的 DataLoader'''
+    return DataLoader(
+        cache,
+        batch_sampler=LengthBucketBatchSampler(cache.lengths, batch_size, bucket_size, shuffle, seed=seed),
+        collate_fn=PadCollator(cache.meta['pad_token_id']),
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
+    )
+
+
+def padding_ratio(cache: TokenizedCache, batch_sampler: Sampler) -> float:
+    '''一个 epoch 中 padding 占全部输入 token 的比例，用于比较分桶前后的浪费'''
+    real = padded = 0
+    for batch in batch_sampler:
+        lengths = cache.offsets[batch, :, 1]
+        real += int(lengths.sum())
+        padded += int(lengths.max(axis=0).sum()) * len(batch)
+    return 1 - real / padded if padded else 0.0
+
+
+def train(
+        model,
+        cache: TokenizedCache,
+        loss: torch.nn.Module,
+        epochs: int = 1,
+        batch_size: int = 32,
+        num_workers: int = 0,
+        bucket_size: int = 50,
+        learning_rate: float = 2e-5,
+        warmup_steps: int = 0,
+        weight_decay: float = 0.01,
+        max_grad_norm: float = 1.0,
+        evaluator: Optional[Callable] = None,
+        output_path: Optional[str] = None,
+        seed: int = 42,
+) -> List[dict]:
+    '''
+    在预分词缓存上微调，训练过程与 SentenceTransformer.fit 相同（AdamW、线性 warmup 后线性衰减、梯度裁剪）
+
+    Returns:
+        List[dict]: 每个 epoch 的 examples、seconds、examples_per_second、loss 与评估分数.
+    '''
+    from transformers import get_linear_schedule_with_warmup
+
+    dataloader = make_dataloader(cache, batch_size, num_workers, bucket_size, seed=seed)
+    loss.to(model.device)
+    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+    parameters = list(loss.named_parameters())
+    optimizer = torch.optim.AdamW([
+        {'params': [p for n, p in parameters if not any(nd in n for nd in no_decay)], 'weight_decay': weight_decay},
+        {'params': [p for n, p in parameters if any(nd in n for nd in no_decay)], 'weight_decay': 0.0},
+    ], lr=learning_rate)
+    scheduler = get_linear_schedule_with_warmup(optimizer, warmup_steps, len(dataloader) * epochs)
+
+    history = []
+    for epoch in range(epochs):
+        dataloader.batch_sampler.set_epoch(epoch)
+        loss.train()
+        total_loss, examples = 0.0, 0
+        start_time = time.perf_counter()
+        for features, labels in dataloader:
+            features = [{key: value.to(model.device) for key, value in feature.items()} for feature in features]
+            loss_value = loss(features, labels.to(model.device))
+            optimizer.zero_grad()
+            loss_value.backward()
+            torch.nn.utils.clip_grad_norm_(loss.parameters(), max_grad_norm)
+            optimizer.step()
+            scheduler.step()
+            total_loss += loss_value.item() * len(labels)
+            examples += len(labels)
+        seconds = time.perf_counter() - start_time
+        record = {
+            'epoch': epoch,
+            'examples': examples,
+            'seconds': seconds,
+            'examples_per_second': examples / seconds,
+            'loss': total_loss / max(examples, 1),
+        }
+        if evaluator is not None:
+            record['score'] = evaluator(model, output_path=output_path, epoch=epoch, steps=-1)
+        history.append(record)
+        print(f"epoch {epoch}: {examples} examples, {seconds:.1f}s, "
+              f"{record['examples_per_second']:.1f} examples/s, loss {record['loss']:.4f}")
+    if output_path:
+        model.save(output_path)
+    return history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='在预分词、分桶的缓存上微调 Med_QQpairs')
+    parser.add_argument('--model', default='BAAI/bge-small-zh-v1.5')
+    parser.add_argument('--cache-dir', default='finetune_cache')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-workers', type=int, default=2)
+    parser.add_argument('--bucket-size', type=int, default=50)
+    parser.add_argument('--output', default='./medical_bge_small')
+    args = parser.parse_args()
+
+    from datasets import load_dataset
+    from sentence_transformers import InputExample, SentenceTransformer, losses
+    from sentence_transformers.evaluation import BinaryClassificationEvaluator
+
+    model = SentenceTransformer(args.model, device='cpu', cache_folder='./bge_small')
+    dataset = load_dataset(path='vegaviazhang/Med_QQpairs', cache_dir='./medical')['train'].shuffle(seed=42)
+    train_rows, dev_rows = dataset[:800], dataset[800:]
+
+    start_time = time.perf_counter()
+    cache = TokenizedCache.build(model, [train_rows['question1'], train_rows['question2']], train_rows['label'],
+                                 cache_dir=args.cache_dir)
+    print(f'缓存 {cache.path}：{len(cache)} 条，{time.perf_counter() - start_time:.2f}s')
+    sampler = LengthBucketBatchSampler(cache.lengths, args.batch_size, args.bucket_size)
+    print(f'padding 比例：分桶 {padding_ratio(cache, sampler):.1%}，'
+          f'不分桶 {padding_ratio(cache, LengthBucketBatchSampler(cache.lengths, args.batch_size, 1)):.1%}')
+
+    dev_examples = [InputExample(texts=[q1, q2], label=label)
+                    for q1, q2, label in zip(dev_rows['question1'], dev_rows['question2'], dev_rows['label'])]
+    evaluator = BinaryClassificationEvaluator.from_input_examples(dev_examples, name='med-dev')
+    train(model, cache, losses.ContrastiveLoss(model=model), epochs=args.epochs, batch_size=args.batch_size,
+          num_workers=args.num_workers, bucket_size=args.bucket_size, evaluator=evaluator, output_path=args.output)
@@ -1,11 +1,39 @@
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from openai import OpenAI
 from zhipuai import ZhipuAI
 import re
+import os
+import glob
 import json
+import time
+import hashlib
 from langchain_core.documents import Document
 from tqdm import tqdm
 
+def open_append(path: str):
+    '''以追加模式打开 jsonl 文件；上次中断留下了写了一半的最后一行时，先截掉这一行再追加'''
+    if os.path.exists(path):
+        with open(path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            # 从文件末尾按块向前查找最后一个换行符
+            while position > 0:
+                start = max(0, position - 65536)
+                f.seek(start)
+                chunk = f.read(position - start)
+                if position == end and chunk.endswith(b'\n'):
+                    break
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    break
+                position = start
+            else:
+                f.truncate(0)
+    return open(path, 'a', encoding='utf-8')
+
+
 class QaPairs():
     '''存储List[dict]类型数据'''
 
@@ -19,14 +47,134 @@ class QaPairs():
         with open(path, "w", encoding='utf-8') as f:
             json.dump(self.qa_pairs, f, ensure_ascii=False, indent=4)
 
+    def save_jsonl(self, path: str):
+        '''将数据存储为jsonl格式，每行一条'''
+
+        with open(path, "w", encoding='utf-8') as f:
+            for qa in self.qa_pairs:
+                f.write(json.dumps(qa, ensure_ascii=False) + '\n')
+
     @classmethod
     def from_json(cls, path:str) -> 'QaPairs':
         '''读取json格式数据'''
 
-        with open(path) as f:
+        with open(path, encoding='utf-8') as f:
             data = json.load(f)
         return cls(data)
 
+    @classmethod
+    def from_jsonl(cls, path: str) -> 'QaPairs':
+        '''读取jsonl格式数据，path 也可以是 JsonlQaPairs 的分片前缀'''
+
+        return cls(list(JsonlQaPairs(path)))
+
+
+class JsonlQaPairs():
+    '''
+    以jsonl文件为后端的问答对数据集，逐条追加写入、流式迭代读取
+
+    path 以 .jsonl 结尾时只使用这一个文件；指定 shard_size 时按
+    {path 去掉 .jsonl}-00000.jsonl、-00001.jsonl ... 分片写入，每片最多 shard_size 条。
+    读取时依次遍历单文件与全部分片。写入时按 (query, 来源) 去重，
+    来源取 source 字段，没有时取 page_num。
+    '''
+
+    def __init__(self, path: str, shard_size: Optional[int] = None):
+        self.path = path
+        self.shard_size = shard_size
+        self.prefix = path[:-len('.jsonl')] if path.endswith('.jsonl') else path
+        # 写入时才扫描已有数据构建去重集合与分片状态
+        self._keys = None
+        self._shard_index = 0
+        self._shard_count = 0
+
+    @staticmethod
+    def key(qa: dict) -> str:
+        '''去重键：(query, 来源) 的哈希'''
+        source = qa.get('source', qa.get('page_num'))
+        raw = json.dumps([qa.get('query'), source], ensure_ascii=False)
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+    def files(self) -> List[str]:
+        '''按顺序返回已存在的数据文件'''
+        files = sorted(glob.glob(glob.escape(self.prefix) + '-[0-9][0-9][0-9][0-9][0-9].jsonl'))
+        single = self.prefix + '.jsonl'
+        if os.path.exists(single):
+            files.insert(0, single)
+        return files
+
+    def __iter__(self) -> Iterator[dict]:
+        for path in self.files():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断时写了一半的最后一行
+                        continue
+
+    def _prepare_write(self):
+        if self._keys is not None:
+            return
+        self._keys = set()
+        for qa in self:
+            self._keys.add(self.key(qa))
+        if self.shard_size:
+            shards = [f for f in self.files() if f != self.prefix + '.jsonl']
+            if shards:
+                self._shard_index = len(shards) - 1
+                with open(shards[-1], encoding='utf-8') as f:
+                    self._shard_count = sum(1 for line in f if line.strip())
+
+    def _write_path(self) -> str:
+        if not self.shard_size:
+            return self.prefix + '.jsonl'
+        if self._shard_count >= self.shard_size:
+            self._shard_index += 1
+            self._shard_count = 0
+        return f'{self.prefix}-{self._shard_index:05d}.jsonl'
+
+    def extend(self, qa_pairs: Iterable[dict]) -> int:
+        '''追加多条问答对并立即落盘，返回实际写入（去重后）的条数'''
+        self._prepare_write()
+        written = 0
+        f = None
+        path = None
+        try:
+            for qa in qa_pairs:
+                key = self.key(qa)
+                if key in self._keys:
+                    continue
+                new_path = self._write_path()
+                if new_path != path:
+                    if f is not None:
+                        f.close()
+                    path = new_path
+                    f = open_append(path)
+                f.write(json.dumps(qa, ensure_ascii=False) + '\n')
+                self._keys.add(key)
+                self._shard_count += 1
+                written += 1
+        finally:
+            if f is not None:
+                f.flush()
+                f.close()
+        return written
+
+    def append(self, qa: dict) -> bool:
+        '''追加一条问答对，重复时返回 False'''
+        return self.extend([qa]) == 1
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def to_qa_pairs(self) -> QaPairs:
+        '''全部读入内存，转换为 QaPairs'''
+        return QaPairs(list(self))
+
 
 llm_list = ['glm-4', 'glm-4v', 'glm-3-turbo', 'gpt-3.5-turbo', 'gpt-4', 'gpt-4o']
 
@@ -53,47 +201,191 @@ PROMPT = '''
 的形式回答
 '''
 
-def list_generate_qa_pairs(
-        texts: List[str],
-        num_questions_per_page: int = 2,
-        model: str = 'glm-4',
-) -> QaPairs:
-    '''借助大模型从给定的texts里提取出问题与对应的答案'''
+def chat_completion(llm, model: str, prompt: str, rate_limiter=None):
+    '''调用大模型；传入 rate_limiter.RateLimiter 时先按预估 token 数申请配额'''
+    if rate_limiter is not None:
+        from rate_limiter import estimate_tokens
+        estimated = estimate_tokens(prompt) + 512
+        rate_limiter.acquire(estimated)
+    response = llm.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "user", "content": prompt},
+        ],
+    )
+    if rate_limiter is not None and response.usage is not None:
+        rate_limiter.record_usage(estimated, response.usage.total_tokens)
+    return response
 
+def get_llm(model: str):
+    '''根据模型名称返回对应的客户端'''
     if model not in llm_list:
         raise ValueError('你选择的模型暂时不被支持'
                             '''请使用'glm-4', 'glm-4v', 'glm-3-turbo', 'gpt-3.5-turbo', 'gpt-4', 'gpt-4o' 中的一个作为model的参数''')
     elif model in llm_list[:3]:
-        llm = ZhipuAI()
+        return ZhipuAI()
     else:
-        llm = OpenAI()
-    qa_pairs = []
+        return OpenAI()
+
+def generate_page_qa_pairs(
+        llm,
+        text: str,
+        num_questions_per_page: int = 2,
+        model: str = 'glm-4',
+        rate_limiter = None,
+        max_retries: int = 3,
+) -> List[dict]:
+    '''为单页文本生成问答对，调用失败时按指数退避重试 max_retries 次'''
+    prompt = PROMPT.format(
+        context_str=text,
+        num_questions_per_page=num_questions_per_page
+    )
+    for attempt in range(max_retries + 1):
+        try:
+            response = chat_completion(llm, model, prompt, rate_limiter)
+            break
+        except Exception:
+            if attempt == max_retries:
+                raise
+            time.sleep(2 ** attempt)
+    matches = re.findall(
+        r'问题\d+：(.*?)原文内容\d+：(.*?)((?=问题\d+：)|$)',
+        response.choices[0].message.content,
+        re.DOTALL
+    )
+    return [{'query': match[0].strip(), 'answer': match[1].strip()} for match in matches]
+
+def load_checkpoint(path: str) -> Dict[int, dict]:
+    '''读取断点文件，返回 {页序号: {'hash': 文本哈希, 'qa_pairs': 问答对}}'''
+    done = {}
+    if path is None or not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            # 跳过中断时写了一半的行
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record['index']] = record
+    return done
 
-    for text in tqdm(texts):
-        if len(text) > 200:
-            prompt = PROMPT.format(
-                context_str=text,
-                num_questions_per_page=num_questions_per_page
-            )
-            response = llm.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "user", "content": prompt},
-                ],
-            )
-            matches = re.findall(
-                r'问题\d+：(.*?)原文内容\d+：(.*?)((?=问题\d+：)|$)',
-                response.choices[0].message.content,
-                re.DOTALL
-            )
-            for _, match in enumerate(matches):
-                qa = {
-                    'query': match[0].strip(),
-                    'answer': match[1].strip()
-                }
-                qa_pairs.append(qa)
+class QaGenerationError(RuntimeError):
+    '''部分页重试用尽仍生成失败；failed 为失败页的序号，qa_pairs 为其余页的结果'''
+
+    def __init__(self, failed: List[int], qa_pairs: 'QaPairs', errors: List[Exception]):
+        super().__init__(f'{len(failed)} 页生成失败，重新运行即可从断点继续：'
+                         + ', '.join(str(index) for index in failed))
+        self.failed = failed
+        self.qa_pairs = qa_pairs
+        self.errors = errors
+
+def generate_qa_pairs(
+        texts: List[str],
+        metadatas: Optional[List[dict]] = None,
+        num_questions_per_page: int = 2,
+        model: str = 'glm-4',
+        rate_limiter = None,
+        max_workers: int = 1,
+        max_retries: int = 3,
+        checkpoint_path: Optional[str] = None,
+        output: Optional[JsonlQaPairs] = None,
+) -> QaPairs:
+    '''
+    并发地借助大模型从 texts 中提取问答对
+
+    Args:
+        texts (List[str]): 待生成问答对的文本，长度不超过 200 的文本会被跳过.
+        metadatas (List[dict]): 与 texts 一一对应，合并进该文本生成的每个问答对.
+        max_workers (int): 并发线程数，为 1 时顺序执行.
+        max_retries (int): 单页调用失败后的重试次数，重试用尽的页不写入断点，下次运行时重新生成.
+        checkpoint_path (str): 断点文件（jsonl），每完成一页追加一行，再次运行时跳过已完成的页.
+        output (JsonlQaPairs): 每完成一页即把问答对追加写入该数据集（按完成顺序，已存在的自动去重）.
+
+    Returns:
+        QaPairs: 按 texts 原顺序排列的问答对.
+
+    Raises:
+        QaGenerationError: 有页重试用尽仍失败，其余页的结果已写入断点与 output，也可从异常的 qa_pairs 取得.
+    '''
+    llm = get_llm(model)
+    metadatas = metadatas or [{} for _ in texts]
+    done = load_checkpoint(checkpoint_path)
+    results: Dict[int, List[dict]] = {}
+    todo = []
+    for index, text in enumerate(texts):
+        if len(text) <= 200:
+            continue
+        text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
+        record = done.get(index)
+        if record is not None and record['hash'] == text_hash:
+            results[index] = record['qa_pairs']
+        else:
+            todo.append((index, text, text_hash))
+
+    if output is not None:
+        # 断点中已完成的页同样写入输出数据集，重复的会被去重跳过
+        for index in sorted(results):
+            output.extend(results[index])
+
+    checkpoint = open_append(checkpoint_path) if checkpoint_path else None
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(generate_page_qa_pairs, llm, text, num_questions_per_page,
+                                model, rate_limiter, max_retries): (index, text_hash)
+                for index, text, text_hash in todo
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                index, text_hash = futures[future]
+                try:
+                    qa_pairs = future.result()
+                except Exception as e:
+                    failed.append((index, e))
+                    continue
+                qa_pairs = [{**qa, **metadatas[index]} for qa in qa_pairs]
+                results[index] = qa_pairs
+                if output is not None:
+                    output.extend(qa_pairs)
+                if checkpoint is not None:
+                    # as_completed 在主线程中迭代，写断点无需加锁
+                    checkpoint.write(json.dumps({'index': index, 'hash': text_hash, 'qa_pairs': qa_pairs},
+                                                ensure_ascii=False) + '\n')
+                    checkpoint.flush()
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    qa_pairs = []
+    for index in sorted(results):
+        qa_pairs.extend(results[index])
+    if failed:
+        failed.sort(key=lambda item: item[0])
+        raise QaGenerationError([index for index, _ in failed], QaPairs(qa_pairs=qa_pairs),
+                                [error for _, error in failed])
     return QaPairs(qa_pairs=qa_pairs)
 
+def list_generate_qa_pairs(
+        texts: List[str],
+        num_questions_per_page: int = 2,
+        model: str = 'glm-4',
+        rate_limiter = None,
+        max_workers: int = 1,
+        checkpoint_path: Optional[str] = None,
+        output: Optional[JsonlQaPairs] = None,
+) -> QaPairs:
+    '''
+    借助大模型从给定的texts里提取出问题与对应的答案
+    rate_limiter 为 rate_limiter.RateLimiter 实例（见 C3），为空时不限流
+    max_workers、checkpoint_path、output 的含义见 generate_qa_pairs
+    '''
+    return generate_qa_pairs(texts, None, num_questions_per_page, model, rate_limiter,
+                             max_workers=max_workers, checkpoint_path=checkpoint_path,
+                             output=output)
+
 def docs_generate_qa_pairs(
         docs: List[Document], 
         num_questions_per_page: int = 2,
@@ -108,43 +400,23 @@ def docs_generate_pdf_qa_pairs(
         pdf_pages: List[Document],
         num_questions_per_page: int = 2,
         model: str = 'glm-4',
+        rate_limiter = None,
+        max_workers: int = 1,
+        checkpoint_path: Optional[str] = None,
+        output: Optional[JsonlQaPairs] = None,
 ) -> QaPairs:
     '''
     借助大模型从给定的texts里提取出问题、答案
     返回结果为问题、答案、所属页码
-    '''
-
-    if model not in llm_list:
-        raise ValueError('你选择的模型暂时不被支持'
-                            '''请使用'glm-4', 'glm-4v', 'glm-3-turbo', 'gpt-3.5-turbo', 'gpt-4', 'gpt-4o' 中的一个作为model的参数''')
-    elif model in llm_list[:3]:
-        llm = ZhipuAI()
-    else:
-        llm = OpenAI()
-    qa_pairs = []
+    rate_limiter 为 rate_limiter.RateLimiter 实例（见 C3），为空时不限流
+    max_workers、checkpoint_path、output 的含义见 generate_qa_pairs，例如：
 
-    for page in tqdm(pdf_pages):
-        if len(page.page_content) > 200:
-            prompt = PROMPT.format(
-                context_str=page.page_content,
-                num_questions_per_page=num_questions_per_page
-            )
-            response = llm.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "user", "content": prompt},
-                ],
-            )
-            matches = re.findall(
-                r'问题\d+：(.*?)原文内容\d+：(.*?)((?=问题\d+：)|$)',
-                response.choices[0].message.content,
-                re.DOTALL
-            )
-            for _, match in enumerate(matches):
-                qa = {
-                    'query': match[0].strip(),
-                    'answer': match[1].strip(),
-                    'page_num': page.metadata['page']
-                }
-                qa_pairs.append(qa)
-    return QaPairs(qa_pairs=qa_pairs)
+        qa_pairs = docs_generate_pdf_qa_pairs(pdf_pages, max_workers=8,
+                                              checkpoint_path='qa_checkpoint.jsonl',
+                                              output=JsonlQaPairs('train_dataset.jsonl'))
+    '''
+    texts = [page.page_content for page in pdf_pages]
+    metadatas = [{'page_num': page.metadata['page']} for page in pdf_pages]
+    return generate_qa_pairs(texts, metadatas, num_questions_per_page, model, rate_limiter,
+                             max_workers=max_workers, checkpoint_path=checkpoint_path,
+                             output=output)
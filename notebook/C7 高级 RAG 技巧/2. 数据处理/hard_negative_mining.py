@@ -0,0 +1,243 @@
+'''
+基于向量索引批量挖掘难负例，生成向量模型微调用的 (anchor, positive, negative) 三元组
+
+4.微调向量模型 中的负例是手写的；这里对 train_dataset.json 中的每个问答对，以 query 为 anchor、answer 为 positive，
+在 语料块 + 全部 answer 构成的候选集合上检索与 query 最相似、但不是正例的文本作为难负例：
+
+    1. 候选文本一次性批量 embedding（可传入 CachedEmbeddings 复用之前的向量）；
+    2. 有 hnswlib 时建 HNSW 近似索引，query 按批 knn_query（多线程），否则分块矩阵乘精确检索；
+    3. 排除正例的近似重复：与 positive 文本相同或互相包含、与 positive 的余弦相似度不低于 dup_threshold、
+       可选地排除与问答对同页的语料块（同页内容很可能也能回答问题，是假负例）；
+    4. 只保留与 query 的相似度低于 margin * sim(query, positive) 的候选，进一步过滤假负例；
+    5. 三元组逐条生成，写出为 JSONL，不在内存中持有全部结果。
+
+用法：
+    triples = mine_hard_negatives(qa_pairs, [doc.page_content for doc in docs], embedding,
+                                  [doc.metadata for doc in docs], num_negatives=3)
+    write_triples(triples, 'hard_negatives.jsonl')
+
+    python hard_negative_mining.py --qa train_dataset.json --output hard_negatives.jsonl
+'''
+
+import argparse
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from recall_eval import embed_queries, embed_texts, normalize
+
+
+class VectorIndex():
+    '''批量近邻检索：index_type='hnsw' 且安装了 hnswlib 时为 HNSW 近似检索，否则为分块精确检索'''
+
+    def __init__(
+            self,
+            vectors: np.ndarray,
+            index_type: str = 'hnsw',
+            hnsw_m: int = 16,
+            hnsw_ef_construction: int = 200,
+            hnsw_ef: int = 128,
+            num_threads: int = -1,
+    ):
+        '''
+        Args:
+            vectors (np.ndarray): 已归一化的 (候选数, 维度) 向量.
+            index_type (str): 'hnsw' 或 'flat'.
+            hnsw_m, hnsw_ef_construction, hnsw_ef: HNSW 图的参数，与 NumpyVectorStore 含义相同.
+            num_threads (int): 建索引与检索的线程数，-1 为全部 CPU.
+        '''
+        if index_type not in ('flat', 'hnsw'):
+            raise ValueError(f'不支持的 index_type: {index_type}')
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.hnsw_ef = hnsw_ef
+        self.num_threads = num_threads
+        self._hnsw = None
+        if index_type == 'hnsw':
+            try:
+                import hnswlib
+            except ImportError:
+                hnswlib = None
+            if hnswlib is not None and len(self.vectors):
+                self._hnsw = hnswlib.Index(space='ip', dim=self.vectors.shape[1])
+                self._hnsw.init_index(max_elements=len(self.vectors), ef_construction=hnsw_ef_construction,
+                                      M=hnsw_m)
+                self._hnsw.add_items(self.vectors, np.arange(len(self.vectors)), num_threads=num_threads)
+        self.index_type = 'hnsw' if self._hnsw is not None else 'flat'
+
+    def search(self, queries: np.ndarray, k: int, batch_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (问题数, k) 的候选下标与余弦相似度，每行按相似度降序.
+        '''
+        k = min(k, len(self.vectors))
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if self._hnsw is not None:
+            # ef 不小于 k 才能返回 k 个结果
+            self._hnsw.set_ef(max(self.hnsw_ef, k))
+            labels, distances = self._hnsw.knn_query(queries, k=k, num_threads=self.num_threads)
+            # ip 空间的距离为 1 - 内积
+            return labels.astype(np.int64), 1.0 - distances
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        sims = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), batch_size):
+            scores = queries[start:start + batch_size] @ self.vectors.T
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] \
+                else np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+            part_scores = np.take_along_axis(scores, part, axis=1)
+            order = np.argsort(-part_scores, axis=1, kind='stable')
+            ids[start:start + batch_size] = np.take_along_axis(part, order, axis=1)
+            sims[start:start + batch_size] = np.take_along_axis(part_scores, order, axis=1)
+        return ids, sims
+
+
+def _is_near_duplicate(candidate: str, positive: str) -> bool:
+    '''文本相同或互相包含（块切分时答案可能被完整包含在某个语料块中）'''
+    return candidate == positive or positive in candidate or candidate in positive
+
+
+def mine_hard_negatives(
+        qa_pairs: Sequence[dict],
+        corpus_texts: Sequence[str],
+        embedding: Embeddings,
+        corpus_metadatas: Optional[Sequence[dict]] = None,
+        num_negatives: int = 3,
+        min_rank: int = 0,
+        max_rank: int = 50,
+        dup_threshold: float = 0.95,
+        margin: float = 0.95,
+        exclude_same_page: bool = True,
+        index_type: str = 'hnsw',
+        batch_size: int = 256,
+        stats: Optional[Dict[str, int]] = None,
+) -> Iterator[dict]:
+    '''
+    为每个问答对挖掘难负例，逐条生成三元组
+
+    Args:
+        qa_pairs (Sequence[dict]): train_dataset.json 中的 {query, answer, page_num}.
+        corpus_texts (Sequence[str]): 语料块文本；全部 answer 会去重后追加到候选集合中.
+        embedding (Embeddings): 向量模型，候选通过 embed_documents 批量计算，query 通过 embed_query 计算.
+        corpus_metadatas (Sequence[dict]): 语料块 metadata，exclude_same_page 时按其中的 page 与 page_num 比较.
+        num_negatives (int): 每个问答对最多生成的三元组数.
+        min_rank, max_rank (int): 只在检索结果的第 [min_rank, max_rank) 名中选负例；
+            min_rank 大于 0 可跳过最靠前、最可能是假负例的候选.
+        dup_threshold (float): 与 positive 的余弦相似度不低于该值的候选视为正例的近似重复.
+        margin (float): 候选与 query 的相似度需低于 margin * sim(query, positive)，为 None 时不限制.
+        exclude_same_page (bool): 是否排除与问答对同页的语料块.
+        index_type (str): 'hnsw' 或 'flat'.
+        batch_size (int): 每批 embedding 与检索的问题数.
+        stats (dict): 传入时累计 queries、triples、duplicates、same_page、margin 等计数.
+
+    Returns:
+        Iterator[dict]: {anchor, positive, negative, score, rank}，score 为负例与 query 的余弦相似度.
+    '''
+    stats = {} if stats is None else stats
+    texts = list(corpus_texts)
+    pages = [metadata.get('page') for metadata in corpus_metadatas] if corpus_metadatas else [None] * len(texts)
+    rows = {}
+    for row, text in enumerate(texts):
+        rows.setdefault(text, row)
+    for qa in qa_pairs:
+        if qa['answer'] not in rows:
+            rows[qa['answer']] = len(texts)
+            texts.append(qa['answer'])
+            pages.append(None)
+
+    vectors = normalize(embed_texts(embedding, texts, batch_size=batch_size))
+    index = VectorIndex(vectors, index_type=index_type)
+    stats['candidates'] = len(texts)
+
+    for start in range(0, len(qa_pairs), batch_size):
+        batch = qa_pairs[start:start + batch_size]
+        query_vectors = normalize(embed_queries(embedding, [qa['query'] for qa in batch]))
+        ids, sims = index.search(query_vectors, max_rank)
+        positive_rows = np.array([rows[qa['answer']] for qa in batch])
+        positive_vectors = vectors[positive_rows]
+        positive_sims = np.einsum('ij,ij->i', query_vectors, positive_vectors)
+        # 各候选与正例的相似度，一次算出整批
+        duplicate_sims = np.einsum('ikd,id->ik', vectors[ids], positive_vectors)
+
+        for i, qa in enumerate(batch):
+            stats['queries'] = stats.get('queries', 0) + 1
+            found = 0
+            for rank in range(min_rank, ids.shape[1]):
+                row = int(ids[i, rank])
+                if row < 0 or row == positive_rows[i]:
+                    continue
+                if duplicate_sims[i, rank] >= dup_threshold or _is_near_duplicate(texts[row], qa['answer']):
+                    stats['duplicates'] = stats.get('duplicates', 0) + 1
+                    continue
+                if exclude_same_page and pages[row] is not None and pages[row] == qa.get('page_num'):
+                    stats['same_page'] = stats.get('same_page', 0) + 1
+                    continue
+                if margin is not None and sims[i, rank] >= margin * positive_sims[i]:
+                    stats['margin'] = stats.get('margin', 0) + 1
+                    continue
+                stats['triples'] = stats.get('triples', 0) + 1
+                yield {
+                    'anchor': qa['query'],
+                    'positive': qa['answer'],
+                    'negative': texts[row],
+                    'score': float(sims[i, rank]),
+                    'rank': rank,
+                }
+                found += 1
+                if found >= num_negatives:
+                    break
+            if not found:
+                stats['no_negative'] = stats.get('no_negative', 0) + 1
+
+
+def write_triples(triples: Iterable[dict], path: str) -> int:
+    '''逐条写出三元组到 JSONL，返回写出的条数'''
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for triple in triples:
+            f.write(json.dumps(triple, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def iter_triples(path: str) -> Iterator[dict]:
+    '''逐行读取三元组，可直接构造 InputExample(texts=[anchor, positive, negative])'''
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='基于向量索引为微调数据挖掘难负例')
+    parser.add_argument('--qa', default='train_dataset.json')
+    parser.add_argument('--model', default='BAAI/bge-small-zh-v1.5')
+    parser.add_argument('--cache-dir', default='embedding_cache')
+    parser.add_argument('--output', default='hard_negatives.jsonl')
+    parser.add_argument('--num-negatives', type=int, default=3)
+    parser.add_argument('--min-rank', type=int, default=0)
+    parser.add_argument('--max-rank', type=int, default=50)
+    parser.add_argument('--dup-threshold', type=float, default=0.95)
+    parser.add_argument('--margin', type=float, default=0.95)
+    parser.add_argument('--index-type', choices=['hnsw', 'flat'], default='hnsw')
+    args = parser.parse_args()
+
+    from langchain_community.embeddings.huggingface import HuggingFaceEmbeddings
+
+    from embedding_benchmark import load_corpus
+    from embedding_cache import CachedEmbeddings
+
+    with open(args.qa, encoding='utf-8') as f:
+        qa_pairs = json.load(f)
+    docs = load_corpus()
+    embedding = CachedEmbeddings(HuggingFaceEmbeddings(model_name=args.model), cache_dir=args.cache_dir,
+                                 namespace=args.model.split('/')[-1])
+    stats: Dict[str, int] = {}
+    count = write_triples(
+        mine_hard_negatives(qa_pairs, [doc.page_content for doc in docs], embedding,
+                            [doc.metadata for doc in docs], num_negatives=args.num_negatives,
+                            min_rank=args.min_rank, max_rank=args.max_rank, dup_threshold=args.dup_threshold,
+                            margin=args.margin, index_type=args.index_type, stats=stats),
+        args.output)
+    embedding.save()
+    print(f'写出 {count} 条三元组到 {args.output}', stats)
@@ -0,0 +1,192 @@
+'''
+批量、向量化的检索召回评估
+
+替代 附分块长度评估 / 附分块方法评估 中的 calculat_recall：
+文档一次批量 embedding，每个问题只做一次 top max(k) 检索（矩阵乘 + argpartition），
+再用 NumPy 一次算出所有 k 的 recall@k、MRR@k 与 nDCG@k。
+
+用法：
+    from recall_eval import evaluate_retrieval, write_recall_csv
+
+    scores = evaluate_retrieval(qa_pairs.qa_pairs, split_docs, embedding)
+    write_recall_csv('chunksize_recall.csv', {'chunk_200': scores['recall']})
+
+与 calculat_recall 一致，默认以 检索到的文档 metadata['page'] 等于问答对 page_num 视为命中，
+召回率即命中率；只评估 query 长度大于 10 的问答对。
+'''
+
+import csv
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+KS = (1, 3, 5, 10)
+
+
+def embed_texts(embedding: Embeddings, texts: List[str], batch_size: int = 256) -> np.ndarray:
+    '''按 batch_size 分批调用 embed_documents，返回 float32 矩阵'''
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embedding.embed_documents(texts[start:start + batch_size]))
+    return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+
+def embed_queries(embedding: Embeddings, queries: List[str]) -> np.ndarray:
+    '''逐条调用 embed_query，返回 float32 矩阵（BGE 等模型编码查询时会加上检索指令）'''
+    vectors = [embedding.embed_query(query) for query in queries]
+    return np.asarray(vectors, dtype=np.float32).reshape(len(queries), -1)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    '''按行做 L2 归一化'''
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k(
+        query_vectors: np.ndarray,
+        doc_vectors: np.ndarray,
+        k: int,
+        metric: str = 'l2',
+        batch_size: int = 1024,
+) -> np.ndarray:
+    '''
+    对每个问题取相似度最高的 k 个文档下标
+
+    Args:
+        metric (str): 'l2' 与 Chroma 默认的欧氏距离排序一致；'cosine' 为余弦相似度.
+        batch_size (int): 每次参与矩阵乘的问题数，用于限制相似度矩阵的内存.
+
+    Returns:
+        np.ndarray: 形状为 (问题数, k) 的下标矩阵，每行按相似度降序排列.
+    '''
+    k = min(k, doc_vectors.shape[0])
+    if metric == 'cosine':
+        query_vectors = normalize(query_vectors)
+        doc_vectors = normalize(doc_vectors)
+        doc_bias = None
+    elif metric == 'l2':
+        # ||q - d||^2 = ||q||^2 - 2 q·d + ||d||^2，||q||^2 不影响排序
+        doc_bias = 0.5 * np.einsum('ij,ij->i', doc_vectors, doc_vectors)
+    else:
+        raise ValueError(f'不支持的 metric: {metric}')
+
+    results = np.empty((query_vectors.shape[0], k), dtype=np.int64)
+    for start in range(0, query_vectors.shape[0], batch_size):
+        scores = query_vectors[start:start + batch_size] @ doc_vectors.T
+        if doc_bias is not None:
+            scores -= doc_bias
+        if k < scores.shape[1]:
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            part = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        order = np.argsort(-part_scores, axis=1, kind='stable')
+        results[start:start + batch_size] = np.take_along_axis(part, order, axis=1)
+    return results
+
+
+def ranking_metrics(hits: np.ndarray, num_relevant: np.ndarray, ks: Sequence[int] = KS) -> Dict[str, List[float]]:
+    '''
+    由命中矩阵一次性计算所有 k 的指标
+
+    Args:
+        hits (np.ndarray): (问题数, max_k) 的布尔矩阵，hits[i, r] 表示第 i 个问题排第 r 位的文档是否相关.
+        num_relevant (np.ndarray): 每个问题在整个文档集中的相关文档数，用于 nDCG 的理想排序.
+
+    Returns:
+        Dict[str, List[float]]: {'recall': [...], 'mrr': [...], 'ndcg': [...]}，与 ks 一一对应.
+    '''
+    n, max_k = hits.shape
+    hits = hits.astype(np.float64)
+    # 首个命中位置，没有命中记为 max_k
+    first = np.where(hits.any(axis=1), hits.argmax(axis=1), max_k)
+    discounts = 1.0 / np.log2(np.arange(2, max_k + 2))
+    dcg = np.cumsum(hits * discounts, axis=1)
+    ideal = np.cumsum(discounts)
+
+    scores = {'recall': [], 'mrr': [], 'ndcg': []}
+    for k in ks:
+        k_eff = min(k, max_k)
+        found = first < k_eff
+        scores['recall'].append(float(found.mean()) if n else 0.0)
+        scores['mrr'].append(float(np.where(found, 1.0 / (first + 1), 0.0).mean()) if n else 0.0)
+        n_ideal = np.minimum(num_relevant, k_eff)
+        idcg = np.where(n_ideal > 0, ideal[np.maximum(n_ideal, 1) - 1], 1.0)
+        scores['ndcg'].append(float((dcg[:, k_eff - 1] / idcg).mean()) if n else 0.0)
+    return scores
+
+
+def evaluate_retrieval(
+        qa_pairs: List[dict],
+        docs: List[Document],
+        embedding: Optional[Embeddings] = None,
+        ks: Sequence[int] = KS,
+        doc_vectors: Optional[np.ndarray] = None,
+        query_vectors: Optional[np.ndarray] = None,
+        match: str = 'page',
+        metric: str = 'l2',
+        min_query_len: int = 10,
+) -> Dict[str, List[float]]:
+    '''
+    评估在 docs 上检索 qa_pairs 的效果
+
+    Args:
+        qa_pairs (List[dict]): 问答对，需包含 query，按页匹配时还需 page_num.
+        docs (List[Document]): 切分后的文档块.
+        embedding (Embeddings): 未提供 doc_vectors / query_vectors 时用于批量 embedding.
+        doc_vectors (np.ndarray): 与 docs 对应的向量，可复用已有向量库或缓存中的向量.
+        query_vectors (np.ndarray): 与过滤后的问答对对应的向量.
+        match (str): 'page' 以 metadata['page'] 与 page_num 相等为命中；
+            'answer' 以文档内容包含问答对的 answer 为命中.
+        metric (str): 见 top_k.
+        min_query_len (int): 只评估 query 长度大于该值的问答对.
+
+    Returns:
+        Dict[str, List[float]]: {'recall': [...], 'mrr': [...], 'ndcg': [...]}，与 ks 一一对应.
+    '''
+    qa_pairs = [qa for qa in qa_pairs if len(qa['query']) > min_query_len]
+    if doc_vectors is None:
+        doc_vectors = embed_texts(embedding, [doc.page_content for doc in docs])
+    if query_vectors is None:
+        query_vectors = embed_queries(embedding, [qa['query'] for qa in qa_pairs])
+    doc_vectors = np.asarray(doc_vectors, dtype=np.float32)
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+
+    indices = top_k(query_vectors, doc_vectors, max(ks), metric=metric)
+    if match == 'page':
+        doc_pages = np.array([doc.metadata.get('page', -1) for doc in docs])
+        query_pages = np.array([qa['page_num'] for qa in qa_pairs])
+        hits = doc_pages[indices] == query_pages[:, None]
+        pages, counts = np.unique(doc_pages, return_counts=True)
+        page_counts = dict(zip(pages.tolist(), counts.tolist()))
+        num_relevant = np.array([page_counts.get(page, 0) for page in query_pages.tolist()])
+    elif match == 'answer':
+        contents = [doc.page_content for doc in docs]
+        answers = [qa['answer'] for qa in qa_pairs]
+        hits = np.array([[answers[i] in contents[j] for j in row] for i, row in enumerate(indices)],
+                        dtype=bool).reshape(indices.shape)
+        # 相关文档总数只统计检索到的部分，nDCG 因此按检索结果内的理想排序计算
+        num_relevant = hits.sum(axis=1)
+    else:
+        raise ValueError(f'不支持的 match: {match}')
+    return ranking_metrics(hits, num_relevant, ks)
+
+
+def chroma_vectors(vectordb) -> Tuple[List[Document], np.ndarray]:
+    '''从已构建的 Chroma 向量库中取出全部文档与向量，避免重新 embedding'''
+    data = vectordb.get(include=['documents', 'metadatas', 'embeddings'])
+    docs = [Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(data['documents'], data['metadatas'])]
+    return docs, np.asarray(data['embeddings'], dtype=np.float32)
+
+
+def write_recall_csv(path: str, rows: Dict[str, List[float]], ks: Sequence[int] = KS):
+    '''按 chunksize_recall.csv 的格式写出结果，rows 为 {行名: 各 k 的指标}'''
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([''] + [f'top_{k}' for k in ks])
+        for name, row in rows.items():
+            writer.writerow([name] + list(row))
@@ -0,0 +1,183 @@
+'''
+批量、带缓存的语义分块
+
+与 langchain_experimental 的 SemanticChunker 算法相同：按句切分，每句与前后 buffer_size 句拼接后 embedding，
+相邻两句的余弦距离超过阈值处断开。区别在于：
+
+    1. 全部页面的句子汇总后按 batch_size 一次性批量 embedding，而不是逐页调用模型；
+    2. 句子 embedding 经 CachedEmbeddings 按内容哈希缓存，重复实验时不再计算；
+    3. 相邻距离与阈值用 NumPy 向量化计算；
+    4. 可选地把块内各句的向量平均池化作为块向量，建库时不必再 embedding 一遍。
+
+用法：
+    chunker = BatchedSemanticChunker(embedding, cache_dir='embedding_cache', namespace='bge-small-zh-v1.5')
+    split_docs, vectors = chunker.split_documents_with_vectors(data_pages)
+    vectordb = NumpyVectorStore(embedding)
+    vectordb.add_vectors(vectors, [doc.page_content for doc in split_docs], [doc.metadata for doc in split_docs])
+'''
+
+import copy
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import BaseDocumentTransformer, Document
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings
+
+# 中文句末标点后直接断句，英文句末标点后需要有空白（避免切开 3.14 这类数字）
+SENTENCE_SPLIT_REGEX = r'(?<=[。？！])\s*|(?<=[.?!])\s+'
+
+# 各阈值类型的默认参数，与 SemanticChunker 相同
+BREAKPOINT_DEFAULTS: Dict[str, float] = {
+    'percentile': 95,
+    'standard_deviation': 3,
+    'interquartile': 1.5,
+    'gradient': 95,
+}
+
+
+class BatchedSemanticChunker(BaseDocumentTransformer):
+    '''批量 embedding、带缓存的 SemanticChunker'''
+
+    def __init__(
+            self,
+            embedding: Embeddings,
+            cache_dir: Optional[str] = None,
+            namespace: Optional[str] = None,
+            batch_size: int = 256,
+            buffer_size: int = 1,
+            breakpoint_threshold_type: str = 'percentile',
+            breakpoint_threshold_amount: Optional[float] = None,
+            sentence_split_regex: str = SENTENCE_SPLIT_REGEX,
+            joiner: str = '',
+    ):
+        '''
+        Args:
+            embedding (Embeddings): 向量模型，已经是 CachedEmbeddings 时直接使用.
+            cache_dir (str): 句子 embedding 的缓存目录，为空时只在内存中缓存.
+            namespace (str): 缓存命名空间，通常填模型名；为空时取 embedding 的 model_name / model.
+            batch_size (int): 每批 embedding 的句子数.
+            buffer_size (int): 每句前后各拼接的句子数.
+            breakpoint_threshold_type (str): percentile、standard_deviation、interquartile 或 gradient.
+            breakpoint_threshold_amount (float): 阈值参数，为空时使用 BREAKPOINT_DEFAULTS.
+            sentence_split_regex (str): 断句正则.
+            joiner (str): 拼接句子的字符串，中文为空串，英文可用空格.
+        '''
+        if breakpoint_threshold_type not in BREAKPOINT_DEFAULTS:
+            raise ValueError(f'不支持的阈值类型：{breakpoint_threshold_type}')
+        if isinstance(embedding, CachedEmbeddings):
+            self.embedding = embedding
+        else:
+            self.embedding = CachedEmbeddings(embedding, cache_dir, namespace, batch_size)
+        self.buffer_size = buffer_size
+        self.breakpoint_threshold_type = breakpoint_threshold_type
+        self.breakpoint_threshold_amount = (BREAKPOINT_DEFAULTS[breakpoint_threshold_type]
+                                            if breakpoint_threshold_amount is None
+                                            else breakpoint_threshold_amount)
+        self.sentence_split_regex = re.compile(sentence_split_regex)
+        self.joiner = joiner
+
+    def split_sentences(self, text: str) -> List[str]:
+        return [sentence for sentence in self.sentence_split_regex.split(text) if sentence.strip()]
+
+    def _combine(self, sentences: List[str]) -> List[str]:
+        '''每句与前后 buffer_size 句拼接，作为该句 embedding 的输入'''
+        return [self.joiner.join(sentences[max(0, i - self.buffer_size):i + self.buffer_size + 1])
+                for i in range(len(sentences))]
+
+    def _breakpoints(self, distances: np.ndarray) -> np.ndarray:
+        '''返回距离超过阈值的位置，位置 i 表示在第 i 句之后断开'''
+        amount = self.breakpoint_threshold_amount
+        if self.breakpoint_threshold_type == 'gradient':
+            if len(distances) < 2:
+                return np.zeros(0, dtype=np.int64)
+            distances = np.gradient(distances)
+        if self.breakpoint_threshold_type in ('percentile', 'gradient'):
+            threshold = np.percentile(distances, amount)
+        elif self.breakpoint_threshold_type == 'standard_deviation':
+            threshold = np.mean(distances) + amount * np.std(distances)
+        else:
+            q1, q3 = np.percentile(distances, [25, 75])
+            threshold = np.mean(distances) + amount * (q3 - q1)
+        return np.flatnonzero(distances > threshold)
+
+    def _split_all(self, texts: Sequence[str]) -> List[Tuple[List[str], List[Tuple[int, int]], np.ndarray]]:
+        '''
+        对全部文本分块
+
+        Returns:
+            每个文本对应 (句子列表, 各块的句子区间 [start, end), 归一化后的句子向量).
+        '''
+        sentences = [self.split_sentences(text) for text in texts]
+        combined = [sentence for page in sentences for sentence in self._combine(page)]
+        # 全部页面的句子一次性查缓存、批量 embedding
+        rows = self.embedding.lookup(combined) if combined else np.zeros(0, dtype=np.int64)
+        vectors = self.embedding.matrix()[rows] if len(rows) else np.zeros((0, 0), dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        results = []
+        offset = 0
+        for page in sentences:
+            page_vectors = vectors[offset:offset + len(page)]
+            offset += len(page)
+            if len(page) < 2:
+                results.append((page, [(0, len(page))] if page else [], page_vectors))
+                continue
+            distances = 1.0 - np.einsum('ij,ij->i', page_vectors[:-1], page_vectors[1:])
+            edges = [0] + (self._breakpoints(distances) + 1).tolist() + [len(page)]
+            results.append((page, list(zip(edges, edges[1:])), page_vectors))
+        return results
+
+    def split_text(self, text: str) -> List[str]:
+        page, spans, _ = self._split_all([text])[0]
+        return [self.joiner.join(page[start:end]) for start, end in spans]
+
+    def create_documents(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[Document]:
+        return self.create_documents_with_vectors(texts, metadatas, pool=False)[0]
+
+    def create_documents_with_vectors(
+            self,
+            texts: List[str],
+            metadatas: Optional[List[dict]] = None,
+            pool: bool = True,
+    ) -> Tuple[List[Document], Optional[np.ndarray]]:
+        '''
+        分块并返回块向量
+
+        块向量为块内各句（含前后 buffer_size 句上下文）向量的平均，再做归一化。它是整块 embedding 的近似，
+        如果之后还要用 RecursiveCharacterTextSplitter 继续切分，应重新 embedding（可用同一个 CachedEmbeddings）.
+
+        Returns:
+            Tuple[List[Document], np.ndarray]: 文档块与对应的 (块数, 维度) 向量，pool=False 时向量为 None.
+        '''
+        _metadatas = metadatas or [{}] * len(texts)
+        documents, pooled = [], []
+        for (page, spans, page_vectors), metadata in zip(self._split_all(texts), _metadatas):
+            for start, end in spans:
+                documents.append(Document(page_content=self.joiner.join(page[start:end]),
+                                          metadata=copy.deepcopy(metadata)))
+                if pool:
+                    pooled.append(page_vectors[start:end].mean(axis=0))
+        if not pool:
+            return documents, None
+        if not pooled:
+            return documents, np.zeros((0, 0), dtype=np.float32)
+        pooled = np.vstack(pooled).astype(np.float32)
+        return documents, pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def split_documents(self, documents: Sequence[Document]) -> List[Document]:
+        return self.create_documents([doc.page_content for doc in documents],
+                                     [doc.metadata for doc in documents])
+
+    def split_documents_with_vectors(self, documents: Sequence[Document]) -> Tuple[List[Document], np.ndarray]:
+        return self.create_documents_with_vectors([doc.page_content for doc in documents],
+                                                  [doc.metadata for doc in documents])
+
+    def transform_documents(self, documents: Sequence[Document], **kwargs: Any) -> Sequence[Document]:
+        return self.split_documents(list(documents))
+
+    def save(self):
+        '''把本次新增的句子 embedding 写入缓存目录'''
+        self.embedding.save()